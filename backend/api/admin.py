@@ -1,5 +1,19 @@
+from django import forms
 from django.contrib import admin
+from django.db.models import Q
 from .models import UserProfile, Project, Chat, Message, UserSettings
+from .utils_search import trigram_available
+
+class TrigramSearchMixin:
+    """
+    Admin search that also finds names and descriptions with typos, when pg_trgm is installed.
+    """
+    def get_search_results(self, request, queryset, search_term):
+        results, may_have_duplicates = super().get_search_results(request, queryset, search_term)
+        term = search_term.strip()
+        if len(term) >= 3 and trigram_available():
+            results |= queryset.filter(Q(name__trigram_word_similar=term) | Q(description__trigram_word_similar=term))
+        return results, may_have_duplicates
 
 @admin.register(UserProfile)
 class UserProfileAdmin(admin.ModelAdmin):
@@ -9,25 +23,50 @@ class UserProfileAdmin(admin.ModelAdmin):
     readonly_fields = ('id', 'created_at', 'updated_at')
 
 @admin.register(Project)
-class ProjectAdmin(admin.ModelAdmin):
+class ProjectAdmin(TrigramSearchMixin, admin.ModelAdmin):
     list_display = ('name', 'owner', 'created_at', 'updated_at')
     list_filter = ('created_at', 'updated_at')
     search_fields = ('name', 'description', 'owner__username')
     readonly_fields = ('id', 'created_at', 'updated_at')
 
 @admin.register(Chat)
-class ChatAdmin(admin.ModelAdmin):
+class ChatAdmin(TrigramSearchMixin, admin.ModelAdmin):
     list_display = ('name', 'owner', 'project', 'status', 'created_at')
     list_filter = ('status', 'created_at', 'project')
     search_fields = ('name', 'description', 'owner__username', 'project__name')
     readonly_fields = ('id', 'created_at', 'updated_at')
 
+class MessageAdminForm(forms.ModelForm):
+    """
+    Edits Message.content as text instead of picking a MessageBody.
+    - Saving goes through Message.save(), which interns the new body and releases the old one,
+      so reference counts stay right.
+    """
+    content = forms.CharField(widget=forms.Textarea, strip=False)
+
+    class Meta:
+        model = Message
+        fields = ('chat', 'role', 'content', 'original_message', 'parent', 'status')
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        if self.instance.body_id:
+            self.fields['content'].initial = self.instance.content
+
+    def save(self, commit=True):
+        self.instance.content = self.cleaned_data['content']
+        return super().save(commit)
+
 @admin.register(Message)
 class MessageAdmin(admin.ModelAdmin):
+    form = MessageAdminForm
     list_display = ('role', 'chat', 'status', 'created_at')
     list_filter = ('role', 'status', 'created_at')
-    search_fields = ('content', 'chat__name')
-    readonly_fields = ('id', 'created_at', 'updated_at')
+    # Message.content is stored compressed, so it can't be searched with LIKE
+    search_fields = ('chat__name',)
+    # A <select> of every body or message would load the whole table; the body is shown, never picked
+    raw_id_fields = ('original_message', 'parent')
+    readonly_fields = ('id', 'body', 'created_at', 'updated_at')
 
 @admin.register(UserSettings)
 class UserSettingsAdmin(admin.ModelAdmin):
@@ -0,0 +1,39 @@
+from django.conf import settings
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+from .utils_auth import get_principal
+from .utils_revocation import is_revoked
+
+# Authentication classes for the API
+
+class CachedJWTAuthentication(JWTAuthentication):
+    """
+    JWT authentication that trusts the validated token's user id instead of loading the User row.
+    - request.user is the cached principal (see utils_auth.get_principal): with a warm cache,
+      authenticating costs no queries, and filters like owner=request.user need none either.
+    - Token-revocation-by-password-change (CHECK_REVOKE_TOKEN) needs the password hash, so
+      it falls back to the stock per-request lookup.
+    - Access tokens revoked at logout are rejected (TOKEN_REVOCATION_CHECK_ACCESS); the check
+      normally costs a bloom filter probe and no query (see utils_revocation.is_revoked).
+    """
+    def get_validated_token(self, raw_token):
+        validated_token = super().get_validated_token(raw_token)
+        if settings.TOKEN_REVOCATION_CHECK_ACCESS and is_revoked(validated_token.get(api_settings.JTI_CLAIM)):
+            raise InvalidToken(_("Token is revoked"))
+        return validated_token
+
+    def get_user(self, validated_token):
+        if api_settings.CHECK_REVOKE_TOKEN:
+            return super().get_user(validated_token)
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError:
+            raise InvalidToken(_("Token contained no recognizable user identification"))
+        user = get_principal(user_id)
+        if user is None:
+            raise AuthenticationFailed(_("User not found"), code="user_not_found")
+        if api_settings.CHECK_USER_IS_ACTIVE and not user.is_active:
+            raise AuthenticationFailed(_("User is inactive"), code="user_inactive")
+        return user
@@ -0,0 +1,48 @@
+import functools
+import hashlib
+import re
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+try:
+    import numpy
+except ImportError:  # optional: semantic search is unavailable without numpy
+    numpy = None
+
+# Local text embedders for semantic search; SEMANTIC_EMBEDDER names the one in use.
+# An embedder has a `name` (stored with each vector, so changing embedders re-embeds),
+# a `dim`, and embed(texts) -> float32 array of shape (len(texts), dim) with unit-length rows.
+
+WORD_RE = re.compile(r"\w+")
+
+@functools.lru_cache(maxsize=4)
+def load_embedder(path):
+    return import_string(path)()
+
+def get_embedder():
+    return load_embedder(settings.SEMANTIC_EMBEDDER)
+
+class HashingEmbedder:
+    """
+    Deterministic bag-of-words embedder using the hashing trick over words and word pairs.
+    - Needs no model files or network; shared wording scores high, synonyms don't.
+    - Counts are damped (log) so a repeated word can't dominate, and rows are L2-normalised.
+    """
+    dim = 256
+
+    def __init__(self):
+        self.name = f'hashing-{self.dim}-v1'
+
+    def features(self, text):
+        words = WORD_RE.findall(text.lower())
+        return words + [f'{first} {second}' for first, second in zip(words, words[1:])]
+
+    def embed(self, texts):
+        matrix = numpy.zeros((len(texts), self.dim), dtype=numpy.float32)
+        for row, text in enumerate(texts):
+            for feature in self.features(text):
+                digest = int.from_bytes(hashlib.blake2b(feature.encode(), digest_size=8).digest(), 'little')
+                matrix[row, digest % self.dim] += 1.0 if digest >> 63 else -1.0
+        matrix = numpy.sign(matrix) * numpy.log1p(numpy.abs(matrix))
+        norms = numpy.linalg.norm(matrix, axis=1, keepdims=True)
+        return matrix / numpy.where(norms == 0, 1.0, norms)
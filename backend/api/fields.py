@@ -0,0 +1,145 @@
+import contextvars
+import functools
+import time
+import zlib
+from pathlib import Path
+from django.conf import settings
+from django.db import models
+
+try:
+    import zstandard
+except ImportError:  # optional: zlib is used when zstandard isn't installed
+    zstandard = None
+
+# Custom model fields for the API
+
+# Stored values are plain UTF-8 unless they start with this byte, which never occurs in UTF-8
+COMPRESSED_MARKER = b'\xff'
+CODEC_TAGS = {'zlib': b'z', 'zstd': b's', 'zstd-dict': b'd'}
+
+# Per-request decode accounting, reset by DecompressionTimingMiddleware
+decode_stats = contextvars.ContextVar('decode_stats', default=None)
+
+# Every dictionary values were compressed with, by zstd dict_id (see dictionary_by_id)
+loaded_dictionaries = {}
+
+@functools.lru_cache(maxsize=4)
+def load_dictionary(path):
+    with open(path, 'rb') as f:
+        return zstandard.ZstdCompressionDict(f.read())
+
+def register_dictionary(dictionary):
+    """
+    Keep a copy of the dictionary in MESSAGE_COMPRESSION_DICTIONARY_DIR as <dict_id>.zdict, so
+    values written with it still decode after MESSAGE_COMPRESSION_DICTIONARY moves on.
+    """
+    dict_id = dictionary.dict_id()
+    if dict_id not in loaded_dictionaries:
+        directory = Path(settings.MESSAGE_COMPRESSION_DICTIONARY_DIR)
+        path = directory / f'{dict_id}.zdict'
+        if not path.exists():
+            directory.mkdir(parents=True, exist_ok=True)
+            partial = directory / f'.{dict_id}.zdict.partial'
+            partial.write_bytes(dictionary.as_bytes())
+            partial.replace(path)
+        loaded_dictionaries[dict_id] = dictionary
+    return dictionary
+
+def current_dictionary():
+    """The dictionary new values are written with (MESSAGE_COMPRESSION_DICTIONARY), registered."""
+    return register_dictionary(load_dictionary(settings.MESSAGE_COMPRESSION_DICTIONARY))
+
+def dictionary_by_id(dict_id):
+    """
+    The dictionary a zstd frame names in its header, from the registry of every dictionary used.
+    - Frames written without an id (dict_id 0) predate the registry: they used the current one.
+    """
+    if not dict_id:
+        return current_dictionary()
+    dictionary = loaded_dictionaries.get(dict_id)
+    if dictionary is None and settings.MESSAGE_COMPRESSION_DICTIONARY:
+        current_dictionary()
+        dictionary = loaded_dictionaries.get(dict_id)
+    if dictionary is None:
+        path = Path(settings.MESSAGE_COMPRESSION_DICTIONARY_DIR) / f'{dict_id}.zdict'
+        if not path.exists():
+            raise LookupError(f"Message content needs zstd dictionary {dict_id}, which is not in {path.parent}")
+        dictionary = loaded_dictionaries[dict_id] = zstandard.ZstdCompressionDict(path.read_bytes())
+    return dictionary
+
+def active_codec():
+    """
+    The codec new values are written with, from MESSAGE_COMPRESSION_CODEC, or None when disabled.
+    - 'zstd' uses MESSAGE_COMPRESSION_DICTIONARY when one is configured.
+    """
+    codec = settings.MESSAGE_COMPRESSION_CODEC
+    if codec == 'zstd' and zstandard is None:
+        raise ImportError("MESSAGE_COMPRESSION_CODEC is 'zstd' but the zstandard package is not installed")
+    if codec == 'zstd' and settings.MESSAGE_COMPRESSION_DICTIONARY:
+        return 'zstd-dict'
+    return codec or None
+
+def compress_text(text, codec=None):
+    """
+    Encode text for storage: compressed when at least MESSAGE_COMPRESSION_THRESHOLD bytes
+    and compression actually saves space, otherwise plain UTF-8.
+    """
+    raw = text.encode('utf-8')
+    codec = codec or active_codec()
+    if codec is None or len(raw) < settings.MESSAGE_COMPRESSION_THRESHOLD:
+        return raw
+    if codec == 'zlib':
+        payload = zlib.compress(raw, settings.MESSAGE_COMPRESSION_LEVEL or 6)
+    else:
+        dictionary = current_dictionary() if codec == 'zstd-dict' else None
+        # The frame header names the dictionary, so decoding never depends on the current setting
+        compressor = zstandard.ZstdCompressor(
+            level=settings.MESSAGE_COMPRESSION_LEVEL or 3, dict_data=dictionary, write_dict_id=True,
+        )
+        payload = compressor.compress(raw)
+    stored = COMPRESSED_MARKER + CODEC_TAGS[codec] + payload
+    return stored if len(stored) < len(raw) else raw
+
+def decompress_text(stored):
+    """
+    Decode a stored value back to text, whichever codec (if any) wrote it.
+    """
+    stored = bytes(stored)
+    if not stored.startswith(COMPRESSED_MARKER):
+        return stored.decode('utf-8')
+    started = time.perf_counter()
+    tag, payload = stored[1:2], stored[2:]
+    if tag == CODEC_TAGS['zlib']:
+        raw = zlib.decompress(payload)
+    elif zstandard is None:
+        raise ImportError("Message content is zstd-compressed but the zstandard package is not installed")
+    else:
+        dictionary = None
+        if tag == CODEC_TAGS['zstd-dict']:
+            dictionary = dictionary_by_id(zstandard.get_frame_parameters(payload).dict_id)
+        raw = zstandard.ZstdDecompressor(dict_data=dictionary).decompress(payload)
+    stats = decode_stats.get()
+    if stats is not None:
+        stats['count'] += 1
+        stats['seconds'] += time.perf_counter() - started
+    return raw.decode('utf-8')
+
+class CompressedTextField(models.TextField):
+    """
+    TextField stored as bytea, compressed above a size threshold.
+    - Reads (including values()/values_list()) decompress transparently.
+    - Exact lookups work because compression is deterministic; substring lookups don't.
+    """
+    def db_type(self, connection):
+        return 'bytea'
+
+    def from_db_value(self, value, expression, connection):
+        if value is None:
+            return value
+        return decompress_text(value)
+
+    def get_db_prep_value(self, value, connection, prepared=False):
+        value = super().get_db_prep_value(value, connection, prepared)
+        if value is None:
+            return value
+        return connection.Database.Binary(compress_text(value))
@@ -0,0 +1,18 @@
+from django.contrib.auth.hashers import Argon2PasswordHasher
+
+try:
+    import argon2
+except ImportError:  # optional: settings keep PBKDF2 first when argon2-cffi isn't installed
+    argon2 = None
+
+# Password hashers tuned for login throughput (selected with PASSWORD_HASHER in settings)
+
+class Argon2idPasswordHasher(Argon2PasswordHasher):
+    """
+    Argon2id at the OWASP minimum (19 MiB, 2 passes, 1 lane) instead of Django's 100 MiB x 8 lanes.
+    - One lane keeps a login on one core, so a login storm can't starve a worker's other threads.
+    - Same 'argon2' algorithm name: existing argon2 hashes verify, and are re-hashed on next login.
+    """
+    time_cost = 2
+    memory_cost = 19456
+    parallelism = 1
@@ -0,0 +1,20 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from api.utils_semantic import rebuild_user_index, semantic_search_available
+
+
+class Command(BaseCommand):
+    help = "Rebuild users' semantic search indexes from the database, embedding messages as needed."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', type=int, action='append', help="Only this user id (repeatable)")
+        parser.add_argument('--lists', type=int, help="IVF lists per index (default: about sqrt(messages))")
+
+    def handle(self, *args, **options):
+        if not semantic_search_available():
+            raise CommandError("Semantic search needs numpy and SEMANTIC_SEARCH_ENABLED")
+        user_ids = options['user'] or User.objects.filter(chats__isnull=False).distinct().values_list('pk', flat=True)
+        for user_id in user_ids:
+            indexed = rebuild_user_index(user_id, lists=options['lists'])
+            self.stdout.write(f"User {user_id}: indexed {indexed} messages")
+        self.stdout.write(self.style.SUCCESS("Semantic indexes rebuilt"))
@@ -0,0 +1,14 @@
+from datetime import timedelta
+from django.core.management.base import BaseCommand
+from api.utils_sync import compact_change_log
+
+
+class Command(BaseCommand):
+    help = "Delete change log rows superseded by a later change to the same entity."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=7, help="Only compact rows older than this many days")
+
+    def handle(self, *args, **options):
+        deleted = compact_change_log(older_than=timedelta(days=options['days']))
+        self.stdout.write(self.style.SUCCESS(f"Compacted {deleted} change log rows"))
@@ -0,0 +1,28 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from api.fields import active_codec
+from api.utils_compression import compress_existing_messages, compression_report
+
+
+class Command(BaseCommand):
+    help = "Compress existing message bodies above MESSAGE_COMPRESSION_THRESHOLD, or report savings."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500, help="Bodies locked and rewritten per batch")
+        parser.add_argument('--pause', type=float, default=0.0, help="Seconds to sleep between batches")
+        parser.add_argument('--report', action='store_true', help="Only report bytes saved and decode cost")
+
+    def handle(self, *args, **options):
+        if not options['report']:
+            if active_codec() is None:
+                raise CommandError("Set MESSAGE_COMPRESSION_CODEC to 'zlib' or 'zstd' first")
+            rows, before, after = compress_existing_messages(
+                settings.MESSAGE_COMPRESSION_THRESHOLD, batch_size=options['batch_size'], pause=options['pause']
+            )
+            self.stdout.write(self.style.SUCCESS(f"Compressed {rows} message bodies: {before} -> {after} bytes"))
+        report = compression_report()
+        self.stdout.write(
+            f"{report['compressed_rows']}/{report['rows']} message bodies compressed, "
+            f"{report['stored_bytes']} bytes stored for {report['raw_bytes']} bytes of text "
+            f"({report['bytes_saved']} saved), decode {report['decode_us_per_body']:.1f} us/body"
+        )
@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+from api.utils_bodies import collect_garbage, dedup_stats, reconcile_body_refcounts
+
+
+class Command(BaseCommand):
+    help = "Delete unreferenced message bodies, optionally repairing reference counts first."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help="Bodies handled per transaction")
+        parser.add_argument('--reconcile', action='store_true', help="Recount references before collecting")
+        parser.add_argument('--workers', type=int, default=4, help="Batches reconciled in parallel")
+
+    def handle(self, *args, **options):
+        if options['reconcile']:
+            repaired = reconcile_body_refcounts(batch_size=options['batch_size'], workers=options['workers'])
+            self.stdout.write(f"Repaired {repaired} reference counts")
+        deleted = collect_garbage(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f"Deleted {deleted} unreferenced message bodies"))
+        stats = dedup_stats()
+        self.stdout.write(
+            f"{stats['messages']} messages share {stats['bodies']} bodies: "
+            f"{stats['body_bytes']} bytes of text stored for {stats['message_bytes']} bytes referenced"
+        )
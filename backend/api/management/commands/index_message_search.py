@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+from api.utils_search import index_message_bodies
+
+
+class Command(BaseCommand):
+    help = "Build the full-text search vector for message bodies stored before search was enabled."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500, help="Bodies indexed per batch")
+        parser.add_argument('--pause', type=float, default=0.0, help="Seconds to sleep between batches")
+
+    def handle(self, *args, **options):
+        indexed = index_message_bodies(batch_size=options['batch_size'], pause=options['pause'])
+        self.stdout.write(self.style.SUCCESS(f"Indexed {indexed} message bodies"))
@@ -0,0 +1,37 @@
+import csv
+import sys
+import time
+from django.core.management.base import BaseCommand, CommandError
+from api.utils_provisioning import provision_users
+
+
+class Command(BaseCommand):
+    help = (
+        "Create users with profiles and settings in bulk, from a CSV (username,email[,display_name]"
+        "[,password_hash]) or as numbered load-test fixtures with --count."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('csv', nargs='?', help="CSV file with a header row ('-' for stdin)")
+        parser.add_argument('--count', type=int, help="Generate this many fixture users instead of reading a CSV")
+        parser.add_argument('--prefix', default='loadtest', help="Fixture username prefix (default: loadtest)")
+        parser.add_argument('--password', help="Password for rows without a password_hash, hashed once and "
+                                               "shared by all of them (fixtures); otherwise they get an unusable one")
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        if (options['csv'] is None) == (options['count'] is None):
+            raise CommandError("Give either a CSV file or --count")
+        started = time.perf_counter()
+        if options['count'] is not None:
+            prefix = options['prefix']
+            rows = ({'username': f'{prefix}{i}', 'email': f'{prefix}{i}@example.com'} for i in range(options['count']))
+            created, skipped = provision_users(rows, options['password'], options['batch_size'])
+        else:
+            source = sys.stdin if options['csv'] == '-' else open(options['csv'], newline='')
+            with source:
+                created, skipped = provision_users(csv.DictReader(source), options['password'], options['batch_size'])
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(
+            f"Provisioned {created} users ({skipped} skipped) in {elapsed:.1f}s, {created / max(elapsed, 1e-9):.0f} users/s"
+        ))
@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+from api.utils_revocation import purge_expired_tokens
+
+
+class Command(BaseCommand):
+    help = "Delete revocation records for tokens that have expired."
+
+    def handle(self, *args, **options):
+        deleted = purge_expired_tokens()
+        self.stdout.write(self.style.SUCCESS(f"Purged {deleted} expired token revocations"))
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+from api.utils_counters import reconcile_counters
+
+
+class Command(BaseCommand):
+    help = "Recount Chat.message_count and Project.chat_count and repair any drift."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help="Rows locked and recounted per batch")
+        parser.add_argument('--workers', type=int, default=4, help="Batches reconciled in parallel")
+
+    def handle(self, *args, **options):
+        chats, projects = reconcile_counters(batch_size=options['batch_size'], workers=options['workers'])
+        self.stdout.write(self.style.SUCCESS(f"Repaired {chats} chat counters and {projects} project counters"))
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+from api.utils_compression import train_dictionary
+
+
+class Command(BaseCommand):
+    help = "Train a zstd dictionary for message compression (point MESSAGE_COMPRESSION_DICTIONARY at it; a copy is kept in MESSAGE_COMPRESSION_DICTIONARY_DIR)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('output', help="Path to write the dictionary to")
+        parser.add_argument('--samples', type=int, default=2000, help="Recent assistant messages to train on")
+        parser.add_argument('--size', type=int, default=112640, help="Dictionary size in bytes")
+
+    def handle(self, *args, **options):
+        size = train_dictionary(options['output'], samples=options['samples'], dict_size=options['size'])
+        self.stdout.write(self.style.SUCCESS(f"Wrote a {size} byte dictionary to {options['output']}"))
@@ -0,0 +1,98 @@
+import logging
+import time
+from django.conf import settings
+from .fields import decode_stats
+from .utils_metrics import method_label, request_metrics, response_size, route_label, serializer_stats
+from .utils_queries import QueryBudgetExceeded, budget_violations, record_queries, view_budget
+
+logger = logging.getLogger(__name__)
+
+# Middleware for the API
+
+class MetricsMiddleware:
+    """
+    Records per-route request metrics, served in Prometheus text format at /api/metrics.
+    - Latency, status code, SQL query count and time, serializer time and response bytes.
+    - Listed first, so latency covers every other middleware and the response rendering.
+    - Serializer time is to_representation of the API serializers (TimedRepresentationMixin)
+      plus rendering the response, timed from process_template_response to the rendered body.
+    """
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not settings.METRICS_ENABLED:
+            return self.get_response(request)
+        started = time.perf_counter()
+        token = serializer_stats.set({'seconds': 0.0, 'depth': 0})
+        try:
+            # Only the count and time are reported, so no SQL is kept
+            with record_queries(keep_statements=False) as recorder:
+                response = self.get_response(request)
+            stats = serializer_stats.get()
+        finally:
+            serializer_stats.reset(token)
+        request_metrics.observe(
+            route_label(request), method_label(request), response.status_code, time.perf_counter() - started,
+            recorder.count, recorder.seconds, stats['seconds'], response_size(response),
+        )
+        return response
+
+    def process_template_response(self, request, response):
+        stats = serializer_stats.get()
+        if stats is not None:
+            started = time.perf_counter()
+            def rendered(response):
+                stats['seconds'] += time.perf_counter() - started
+            response.add_post_render_callback(rendered)
+        return response
+
+class DecompressionTimingMiddleware:
+    """
+    Reports the time spent decompressing message content in a Server-Timing header.
+    - Only added when the request actually decoded compressed values.
+    """
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        token = decode_stats.set({'count': 0, 'seconds': 0.0})
+        try:
+            response = self.get_response(request)
+            stats = decode_stats.get()
+        finally:
+            decode_stats.reset(token)
+        if stats['count']:
+            response['Server-Timing'] = f'decompress;dur={stats["seconds"] * 1000:.3f};desc="{stats["count"]} values"'
+        return response
+
+class QueryBudgetMiddleware:
+    """
+    Holds every request to the query budget its view declares (see utils_queries.view_budget).
+    - Counts all SQL the request runs, and flags any query shape repeated more than
+      QUERY_BUDGET_DUPLICATE_LIMIT times, the signature of an N+1.
+    - QUERY_BUDGET_MODE 'raise' fails the request (the test suite runs this way), 'log' logs a
+      warning, 'off' skips recording entirely.
+    """
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        mode = settings.QUERY_BUDGET_MODE
+        if mode == 'off':
+            return self.get_response(request)
+        with record_queries() as recorder:
+            response = self.get_response(request)
+        declared = view_budget(request)
+        if declared is None:
+            return response
+        view_name, budget = declared
+        problems = budget_violations(
+            recorder, budget + settings.QUERY_BUDGET_AUTH_ALLOWANCE, settings.QUERY_BUDGET_DUPLICATE_LIMIT
+        )
+        if problems:
+            message = f"{request.method} {request.path} ({view_name}) " + "; ".join(problems)
+            if mode == 'raise':
+                raise QueryBudgetExceeded(message)
+            logger.warning(message)
+        return response
@@ -0,0 +1,42 @@
+# Generated by Django 5.2.3 on 2026-10-19 13:00
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def backfill_counters(apps, schema_editor):
+    Project = apps.get_model('api', 'Project')
+    Chat = apps.get_model('api', 'Chat')
+    Message = apps.get_model('api', 'Message')
+    message_counts = (
+        Message.objects.filter(chat=OuterRef('pk')).order_by()
+        .values('chat').annotate(total=Count('id')).values('total')
+    )
+    Chat.objects.update(message_count=Coalesce(Subquery(message_counts), 0))
+    chat_counts = (
+        Chat.objects.filter(project=OuterRef('pk'), status='active').order_by()
+        .values('project').annotate(total=Count('id')).values('total')
+    )
+    Project.objects.update(chat_count=Coalesce(Subquery(chat_counts), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0004_idempotencykey'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chat',
+            name='message_count',
+            field=models.PositiveIntegerField(default=0, help_text='Denormalized count of messages'),
+        ),
+        migrations.AddField(
+            model_name='project',
+            name='chat_count',
+            field=models.PositiveIntegerField(default=0, help_text='Denormalized count of active chats'),
+        ),
+        migrations.RunPython(backfill_counters, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,20 @@
+# Generated by Django 5.2.3 on 2026-10-19 13:04
+
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    # Build the index without blocking writes to a large messages table
+    atomic = False
+
+    dependencies = [
+        ('api', '0005_counters'),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name='message',
+            index=models.Index(fields=['chat', 'created_at', 'id'], name='messages_chat_id_6d46cf_idx'),
+        ),
+    ]
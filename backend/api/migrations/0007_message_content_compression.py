@@ -0,0 +1,32 @@
+# Generated by Django 5.2.3 on 2026-10-19 13:19
+
+import api.fields
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0006_message_keyset_index'),
+    ]
+
+    operations = [
+        # Existing text is kept as plain UTF-8 bytes (convert_to, not a ::bytea cast, which
+        # would interpret backslashes); `manage.py compress_messages` compresses it later.
+        # Reversing requires no compressed rows to remain.
+        migrations.SeparateDatabaseAndState(
+            database_operations=[
+                migrations.RunSQL(
+                    "ALTER TABLE messages ALTER COLUMN content TYPE bytea USING convert_to(content, 'UTF8')",
+                    "ALTER TABLE messages ALTER COLUMN content TYPE text USING convert_from(content, 'UTF8')",
+                ),
+            ],
+            state_operations=[
+                migrations.AlterField(
+                    model_name='message',
+                    name='content',
+                    field=api.fields.CompressedTextField(help_text='Stored as bytea, compressed above MESSAGE_COMPRESSION_THRESHOLD'),
+                ),
+            ],
+        ),
+    ]
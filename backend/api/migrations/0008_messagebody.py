@@ -0,0 +1,68 @@
+# Generated by Django 5.2.3 on 2026-10-19 13:23
+
+import api.fields
+import api.models
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def move_content_to_bodies(apps, schema_editor):
+    Message = apps.get_model('api', 'Message')
+    MessageBody = apps.get_model('api', 'MessageBody')
+    last_pk = None
+    while True:
+        batch = Message.objects.order_by('pk')
+        if last_pk is not None:
+            batch = batch.filter(pk__gt=last_pk)
+        rows = list(batch.values_list('pk', 'content')[:1000])
+        if not rows:
+            return
+        hashes = MessageBody.objects.intern([content for _, content in rows])
+        Message.objects.bulk_update([Message(pk=pk, body_id=digest) for (pk, _), digest in zip(rows, hashes)], ['body'])
+        last_pk = rows[-1][0]
+
+
+def copy_content_from_bodies(apps, schema_editor):
+    Message = apps.get_model('api', 'Message')
+    for message in Message.objects.select_related('body').iterator(chunk_size=1000):
+        message.content = message.body.content
+        message.save(update_fields=['content'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0007_message_content_compression'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MessageBody',
+            fields=[
+                ('hash', models.CharField(editable=False, max_length=64, primary_key=True, serialize=False)),
+                ('content', api.fields.CompressedTextField(help_text='Stored as bytea, compressed above MESSAGE_COMPRESSION_THRESHOLD')),
+                ('size', models.PositiveIntegerField(help_text='UTF-8 length of the content in bytes')),
+                ('ref_count', models.PositiveIntegerField(default=0, help_text='Messages referencing this body')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'db_table': 'message_bodies',
+                'indexes': [models.Index(condition=models.Q(('ref_count', 0)), fields=['ref_count'], name='message_bodies_unreferenced')],
+            },
+            managers=[
+                ('objects', api.models.MessageBodyManager()),
+            ],
+        ),
+        migrations.AddField(
+            model_name='message',
+            name='body',
+            field=models.ForeignKey(db_column='body_hash', null=True, on_delete=django.db.models.deletion.PROTECT, related_name='messages', to='api.messagebody'),
+        ),
+        # Nullable until 0009 drops it, so reversing 0009 can re-add the column before it is refilled
+        migrations.AlterField(
+            model_name='message',
+            name='content',
+            field=api.fields.CompressedTextField(help_text='Stored as bytea, compressed above MESSAGE_COMPRESSION_THRESHOLD', null=True),
+        ),
+        migrations.RunPython(move_content_to_bodies, copy_content_from_bodies),
+    ]
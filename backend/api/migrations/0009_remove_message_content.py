@@ -0,0 +1,24 @@
+# Generated by Django 5.2.3 on 2026-10-19 13:23
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    # Separate from 0008 so the schema change doesn't share a transaction with its data updates
+
+    dependencies = [
+        ('api', '0008_messagebody'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='message',
+            name='content',
+        ),
+        migrations.AlterField(
+            model_name='message',
+            name='body',
+            field=models.ForeignKey(db_column='body_hash', on_delete=django.db.models.deletion.PROTECT, related_name='messages', to='api.messagebody'),
+        ),
+    ]
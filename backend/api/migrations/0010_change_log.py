@@ -0,0 +1,81 @@
+# Generated by Django 5.2.3 on 2026-10-19 13:33
+
+import django.utils.timezone
+from django.db import migrations, models
+
+# One trigger function for all four tables; TG_ARGV[0] is the entity name.
+# Messages and branches find their owner through the chat, which Django's cascade
+# deletes only after its messages and branches, so tombstones still resolve.
+RECORD_CHANGE = """
+CREATE FUNCTION record_change() RETURNS trigger AS $$
+DECLARE
+    changed record;
+    change_owner integer;
+    changed_id uuid;
+BEGIN
+    IF TG_OP = 'DELETE' THEN changed := OLD; ELSE changed := NEW; END IF;
+    IF TG_ARGV[0] IN ('project', 'chat') THEN
+        change_owner := changed.owner_id;
+        changed_id := changed.id;
+    ELSE
+        SELECT owner_id INTO change_owner FROM chats WHERE id = changed.chat_id;
+        IF TG_ARGV[0] = 'message' THEN changed_id := changed.id; ELSE changed_id := changed.branch_id; END IF;
+    END IF;
+    IF change_owner IS NOT NULL THEN
+        INSERT INTO change_log (owner_id, txid, entity, entity_id, deleted, created_at)
+        VALUES (change_owner, txid_current(), TG_ARGV[0], changed_id, TG_OP = 'DELETE', now());
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+"""
+
+TABLES = [('projects', 'project'), ('chats', 'chat'), ('messages', 'message'), ('branch', 'branch')]
+
+CREATE_TRIGGERS = [
+    f"CREATE TRIGGER {table}_change_log AFTER INSERT OR UPDATE OR DELETE ON {table} "
+    f"FOR EACH ROW EXECUTE FUNCTION record_change('{entity}')"
+    for table, entity in TABLES
+]
+DROP_TRIGGERS = [f"DROP TRIGGER {table}_change_log ON {table}" for table, _ in TABLES]
+
+# Existing rows become the starting state a first sync downloads
+BACKFILL = """
+INSERT INTO change_log (owner_id, txid, entity, entity_id, deleted, created_at)
+SELECT owner_id, txid_current(), 'project', id, false, now() FROM projects
+UNION ALL
+SELECT owner_id, txid_current(), 'chat', id, false, now() FROM chats
+UNION ALL
+SELECT c.owner_id, txid_current(), 'message', m.id, false, now() FROM messages m JOIN chats c ON c.id = m.chat_id
+UNION ALL
+SELECT c.owner_id, txid_current(), 'branch', b.branch_id, false, now() FROM branch b JOIN chats c ON c.id = b.chat_id
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0009_remove_message_content'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ChangeLog',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('owner_id', models.IntegerField(help_text='User the changed row belongs to (not a FK: tombstones outlive rows)')),
+                ('txid', models.BigIntegerField(help_text='txid_current() of the writing transaction')),
+                ('entity', models.CharField(choices=[('project', 'Project'), ('chat', 'Chat'), ('message', 'Message'), ('branch', 'Branch')], max_length=20)),
+                ('entity_id', models.UUIDField()),
+                ('deleted', models.BooleanField(default=False)),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+            options={
+                'db_table': 'change_log',
+                'indexes': [models.Index(fields=['owner_id', 'txid', 'id'], name='change_log_owner_i_a154f8_idx'), models.Index(fields=['entity_id'], name='change_log_entity__ad88db_idx')],
+            },
+        ),
+        migrations.RunSQL(RECORD_CHANGE, "DROP FUNCTION record_change()"),
+        migrations.RunSQL(CREATE_TRIGGERS, list(reversed(DROP_TRIGGERS))),
+        migrations.RunSQL(BACKFILL, migrations.RunSQL.noop),
+    ]
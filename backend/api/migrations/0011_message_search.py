@@ -0,0 +1,27 @@
+# Generated by Django 5.2.3 on 2026-10-19 13:40
+
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+    # Build the GIN index without blocking writes; existing bodies are indexed by index_message_search
+    atomic = False
+
+    dependencies = [
+        ('api', '0010_change_log'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='messagebody',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, help_text='Full-text index of the content', null=True),
+        ),
+        AddIndexConcurrently(
+            model_name='messagebody',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['search_vector'], name='message_bodies_search'),
+        ),
+    ]
@@ -0,0 +1,46 @@
+from django.db import DatabaseError, migrations
+
+# Name/description columns served by the quick search and admin search
+TRIGRAM_COLUMNS = [
+    ('projects', 'name'),
+    ('projects', 'description'),
+    ('chats', 'name'),
+    ('chats', 'description'),
+]
+
+
+def create_trigram_indexes(apps, schema_editor):
+    # pg_trgm is a contrib extension that not every server ships; without it quick search
+    # falls back to icontains, so a missing extension isn't an error here.
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute("SELECT 1 FROM pg_available_extensions WHERE name = 'pg_trgm'")
+        if cursor.fetchone() is None:
+            return
+        try:
+            cursor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+        except DatabaseError:
+            return
+        for table, column in TRIGRAM_COLUMNS:
+            cursor.execute(
+                f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {table}_{column}_trgm "
+                f"ON {table} USING gin ({column} gin_trgm_ops)"
+            )
+
+
+def drop_trigram_indexes(apps, schema_editor):
+    with schema_editor.connection.cursor() as cursor:
+        for table, column in TRIGRAM_COLUMNS:
+            cursor.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {table}_{column}_trgm")
+
+
+class Migration(migrations.Migration):
+    # Build the indexes without blocking writes
+    atomic = False
+
+    dependencies = [
+        ('api', '0011_message_search'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_trigram_indexes, drop_trigram_indexes),
+    ]
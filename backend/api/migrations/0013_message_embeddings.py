@@ -0,0 +1,26 @@
+# Generated by Django 5.2.3 on 2026-10-19 13:47
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0012_trigram_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MessageEmbedding',
+            fields=[
+                ('body', models.OneToOneField(db_column='body_hash', on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='embedding', serialize=False, to='api.messagebody')),
+                ('model', models.CharField(help_text='Name of the embedder that produced the vector', max_length=64)),
+                ('vector', models.BinaryField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'db_table': 'message_embeddings',
+            },
+        ),
+    ]
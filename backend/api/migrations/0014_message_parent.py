@@ -0,0 +1,54 @@
+# Generated by Django 5.2.3 on 2026-10-19 13:52
+
+import uuid
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def as_uuid(value):
+    try:
+        return uuid.UUID(str(value))
+    except ValueError:
+        return None
+
+
+def copy_parents_from_graphs(apps, schema_editor):
+    # The parent links are structural, not user edits, so keep them out of the sync change log
+    Chat = apps.get_model('api', 'Chat')
+    chats = Chat.objects.exclude(message_graph={}).values_list('id', 'message_graph')
+    with schema_editor.connection.cursor() as cursor:
+        # ALTER TABLE refuses to run while deferred foreign key checks are queued
+        cursor.execute("SET CONSTRAINTS ALL IMMEDIATE")
+        cursor.execute("ALTER TABLE messages DISABLE TRIGGER messages_change_log")
+        for chat_id, graph in chats.iterator(chunk_size=200):
+            pairs = [
+                (as_uuid(child), as_uuid(node.get('parent')))
+                for child, node in (graph or {}).items() if isinstance(node, dict) and node.get('parent')
+            ]
+            pairs = [(child, parent) for child, parent in pairs if child and parent]
+            if not pairs:
+                continue
+            cursor.execute(
+                "UPDATE messages m SET parent_id = p.parent "
+                "FROM unnest(%s::uuid[], %s::uuid[]) AS p(child, parent) "
+                "WHERE m.id = p.child AND m.chat_id = %s "
+                "AND EXISTS (SELECT 1 FROM messages x WHERE x.id = p.parent AND x.chat_id = m.chat_id)",
+                [[child for child, _ in pairs], [parent for _, parent in pairs], chat_id],
+            )
+        cursor.execute("ALTER TABLE messages ENABLE TRIGGER messages_change_log")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0013_message_embeddings'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='message',
+            name='parent',
+            field=models.ForeignKey(blank=True, help_text='Previous message on the branch; mirrors Chat.message_graph for ancestry queries', null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='replies', to='api.message'),
+        ),
+        migrations.RunPython(copy_parents_from_graphs, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,43 @@
+from django.db import migrations
+
+INDEX_NAME = 'auth_user_email_lower_uniq'
+
+
+def create_email_index(apps, schema_editor):
+    # Accounts that can't be told apart at login would make the unique index fail half-built;
+    # report them so they can be merged or renamed first.
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT lower(email) FROM auth_user WHERE email <> '' "
+            "GROUP BY lower(email) HAVING count(*) > 1 LIMIT 10"
+        )
+        duplicates = [row[0] for row in cursor.fetchall()]
+        if duplicates:
+            raise RuntimeError(
+                "Users share an email address (ignoring case), resolve these before migrating: "
+                + ", ".join(duplicates)
+            )
+        # Blank emails (e.g. createsuperuser without one) stay allowed more than once
+        cursor.execute(
+            f"CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS {INDEX_NAME} "
+            f"ON auth_user (lower(email)) WHERE email <> ''"
+        )
+
+
+def drop_email_index(apps, schema_editor):
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {INDEX_NAME}")
+
+
+class Migration(migrations.Migration):
+    # Build the index without blocking sign-ups
+    atomic = False
+
+    dependencies = [
+        ('auth', '0012_alter_user_first_name_max_length'),
+        ('api', '0014_message_parent'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_email_index, drop_email_index),
+    ]
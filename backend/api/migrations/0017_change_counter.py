@@ -0,0 +1,77 @@
+# Generated by Django 5.2.3 on 2026-10-19 14:57
+
+from importlib import import_module
+
+import django.utils.timezone
+from django.db import migrations, models
+
+# record_change() as before, plus a bump of the owner's counter for projects and chats.
+# The upsert keeps the counter row locked until commit, so concurrent writers of one
+# owner's projects or chats bump it in commit order.
+RECORD_CHANGE = """
+CREATE OR REPLACE FUNCTION record_change() RETURNS trigger AS $$
+DECLARE
+    changed record;
+    change_owner integer;
+    changed_id uuid;
+BEGIN
+    IF TG_OP = 'DELETE' THEN changed := OLD; ELSE changed := NEW; END IF;
+    IF TG_ARGV[0] IN ('project', 'chat') THEN
+        change_owner := changed.owner_id;
+        changed_id := changed.id;
+    ELSE
+        SELECT owner_id INTO change_owner FROM chats WHERE id = changed.chat_id;
+        IF TG_ARGV[0] = 'message' THEN changed_id := changed.id; ELSE changed_id := changed.branch_id; END IF;
+    END IF;
+    IF change_owner IS NOT NULL THEN
+        INSERT INTO change_log (owner_id, txid, entity, entity_id, deleted, created_at)
+        VALUES (change_owner, txid_current(), TG_ARGV[0], changed_id, TG_OP = 'DELETE', now());
+        IF TG_ARGV[0] IN ('project', 'chat') THEN
+            INSERT INTO change_counter (owner_id, entity, seq, updated_at)
+            VALUES (change_owner, TG_ARGV[0], 1, now())
+            ON CONFLICT (owner_id, entity)
+            DO UPDATE SET seq = change_counter.seq + 1, updated_at = EXCLUDED.updated_at;
+        END IF;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+"""
+
+# The 0010 function, restored on reverse
+PREVIOUS_RECORD_CHANGE = import_module('api.migrations.0010_change_log').RECORD_CHANGE.replace(
+    'CREATE FUNCTION', 'CREATE OR REPLACE FUNCTION'
+)
+
+# Existing owners start from their logged changes so far
+BACKFILL = """
+INSERT INTO change_counter (owner_id, entity, seq, updated_at)
+SELECT owner_id, entity, count(*), max(created_at) FROM change_log
+WHERE entity IN ('project', 'chat') GROUP BY owner_id, entity
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0016_revoked_tokens'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ChangeCounter',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('owner_id', models.IntegerField()),
+                ('entity', models.CharField(choices=[('project', 'Project'), ('chat', 'Chat'), ('message', 'Message'), ('branch', 'Branch')], max_length=20)),
+                ('seq', models.BigIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+            options={
+                'db_table': 'change_counter',
+                'constraints': [models.UniqueConstraint(fields=('owner_id', 'entity'), name='change_counter_owner_entity')],
+            },
+        ),
+        migrations.RunSQL(RECORD_CHANGE, PREVIOUS_RECORD_CHANGE),
+        migrations.RunSQL(BACKFILL, migrations.RunSQL.noop),
+    ]
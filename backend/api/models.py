@@ -1,7 +1,21 @@
+import hashlib
+import threading
 import uuid
-from django.db import models
+from collections import Counter
+from contextlib import contextmanager
+from django.conf import settings
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVectorField
+from django.db import connection, models, transaction
+from django.db.models import F
+from django.db.models.functions import Greatest
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
 from django.contrib.auth.models import User
+from django.core.serializers.json import DjangoJSONEncoder
 from django.utils import timezone
+from .fields import CompressedTextField
+from .utils_auth import forget_principal
 
 class UserProfile(models.Model):
     """
@@ -37,6 +51,7 @@ class Project(models.Model):
     name = models.CharField(max_length=255)
     description = models.TextField(blank=True)
     ai_instructions = models.TextField(blank=True, help_text="Project-level instructions for AI")
+    chat_count = models.PositiveIntegerField(default=0, help_text="Denormalized count of active chats")
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
@@ -70,6 +85,7 @@ class Chat(models.Model):
     ai_model = models.CharField(max_length=100, blank=True, help_text="AI model to use for this chat")
     status = models.CharField(max_length=20, choices=Status.choices, default=Status.ACTIVE)
     message_graph = models.JSONField(blank=True, default=dict, help_text="Graph of message relationships: {id: {parent, children}}")
+    message_count = models.PositiveIntegerField(default=0, help_text="Denormalized count of messages")
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
@@ -87,6 +103,149 @@ class Chat(models.Model):
     def __str__(self):
         return f"{self.name} ({self.id})"
 
+def body_hash(text):
+    """SHA-256 hex digest of the UTF-8 text: the MessageBody key."""
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+# Per-thread references collected by MessageBodyManager.deferred_release()
+_deferred_releases = threading.local()
+
+class MessageBodyManager(models.Manager):
+    use_in_migrations = True
+
+    def intern(self, texts):
+        """
+        Store each text once and take one reference per occurrence; returns their hashes.
+        - A single INSERT ... ON CONFLICT upsert, so concurrent writers of the same text can't race.
+        - New bodies get their search_vector in the same statement (bodies never change afterwards).
+        """
+        hashes = [body_hash(text) for text in texts]
+        counts = {}
+        for digest, text in zip(hashes, texts):
+            counts.setdefault(digest, [text, 0])[1] += 1
+        if not counts:
+            return hashes
+        content_field = self.model._meta.get_field('content')
+        # Historical models (data migrations before search_vector existed) skip the column
+        indexed = any(field.name == 'search_vector' for field in self.model._meta.fields)
+        now = timezone.now()
+        params = []
+        for digest, (text, refs) in counts.items():
+            params += [digest, content_field.get_db_prep_value(text, connection), len(text.encode('utf-8')), refs, now]
+            if indexed:
+                params += [settings.MESSAGE_SEARCH_CONFIG, text[:settings.MESSAGE_SEARCH_MAX_CHARS]]
+        columns = 'hash, content, size, ref_count, created_at' + (', search_vector' if indexed else '')
+        row = '(%s, %s, %s, %s, %s, to_tsvector(%s::regconfig, %s))' if indexed else '(%s, %s, %s, %s, %s)'
+        values = ', '.join([row] * len(counts))
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"INSERT INTO message_bodies ({columns}) VALUES {values} "
+                "ON CONFLICT (hash) DO UPDATE SET ref_count = message_bodies.ref_count + EXCLUDED.ref_count",
+                params,
+            )
+        return hashes
+
+    def release(self, digest):
+        """
+        Drop one reference; bodies left at zero are deleted by gc_message_bodies.
+        - Inside deferred_release() the reference is only counted, and dropped on the way out.
+        """
+        pending = getattr(_deferred_releases, 'counts', None)
+        if pending is not None:
+            pending[digest] += 1
+            return
+        self.filter(pk=digest).update(ref_count=Greatest(F('ref_count') - 1, 0))
+
+    def release_many(self, counts):
+        """
+        Drop counts[digest] references from each body in one UPDATE ... FROM (VALUES ...).
+        """
+        if not counts:
+            return
+        values = ', '.join(['(%s, %s)'] * len(counts))
+        params = [value for item in counts.items() for value in item]
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "UPDATE message_bodies SET ref_count = GREATEST(message_bodies.ref_count - released.refs, 0) "
+                f"FROM (VALUES {values}) AS released (hash, refs) WHERE message_bodies.hash = released.hash",
+                params,
+            )
+
+    @contextmanager
+    def deferred_release(self):
+        """
+        Collect the references dropped inside the block (e.g. the post_delete of every message in a
+        cascading chat or project delete) and release them with one release_many at the end,
+        instead of one UPDATE per message. Nested blocks release with the outermost one.
+        """
+        if getattr(_deferred_releases, 'counts', None) is not None:
+            yield
+            return
+        _deferred_releases.counts = Counter()
+        try:
+            yield
+            counts = _deferred_releases.counts
+        finally:
+            _deferred_releases.counts = None
+        self.release_many(counts)
+
+class MessageBody(models.Model):
+    """
+    Content-addressed message text, keyed by the SHA-256 of the content.
+    Identical content (templated replies, regenerations, repeated inputs) is stored once
+    and reference-counted by the messages pointing at it.
+    """
+    hash = models.CharField(max_length=64, primary_key=True, editable=False)
+    content = CompressedTextField(help_text="Stored as bytea, compressed above MESSAGE_COMPRESSION_THRESHOLD")
+    size = models.PositiveIntegerField(help_text="UTF-8 length of the content in bytes")
+    ref_count = models.PositiveIntegerField(default=0, help_text="Messages referencing this body")
+    search_vector = SearchVectorField(null=True, editable=False, help_text="Full-text index of the content")
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    objects = MessageBodyManager()
+
+    class Meta:
+        db_table = 'message_bodies'
+        indexes = [
+            # Garbage collection scans only the unreferenced bodies
+            models.Index(fields=['ref_count'], condition=models.Q(ref_count=0), name='message_bodies_unreferenced'),
+            GinIndex(fields=['search_vector'], name='message_bodies_search'),
+        ]
+
+    def __str__(self):
+        return f"Body {self.hash[:12]} ({self.ref_count} refs)"
+
+class MessageEmbedding(models.Model):
+    """
+    A body's vector from the semantic search embedder, stored as raw float32 bytes.
+    Keyed by body like the full-text search vector, so repeated text is embedded once.
+    """
+    body = models.OneToOneField(
+        MessageBody, on_delete=models.CASCADE, primary_key=True, related_name='embedding', db_column='body_hash'
+    )
+    model = models.CharField(max_length=64, help_text="Name of the embedder that produced the vector")
+    vector = models.BinaryField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        db_table = 'message_embeddings'
+
+    def __str__(self):
+        return f"Embedding of {self.body_id[:12]} ({self.model})"
+
+class MessageManager(models.Manager):
+    def get_queryset(self):
+        # Message.content reads through the body, so fetch it in the same query
+        return super().get_queryset().select_related('body')
+
+    def bulk_create(self, objs, *args, **kwargs):
+        objs = list(objs)
+        pending = [obj for obj in objs if obj._pending_content is not None]
+        hashes = MessageBody.objects.intern([obj._pending_content for obj in pending])
+        for obj, digest in zip(pending, hashes):
+            obj.attach_body(digest)
+        return super().bulk_create(objs, *args, **kwargs)
+
 class Message(models.Model):
     """
     Individual messages within chats.
@@ -106,9 +265,11 @@ class Message(models.Model):
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     chat = models.ForeignKey(Chat, on_delete=models.CASCADE, related_name='messages')
     role = models.CharField(max_length=20, choices=Role.choices, default=Role.USER)
-    content = models.TextField()
+    body = models.ForeignKey(MessageBody, on_delete=models.PROTECT, related_name='messages', db_column='body_hash')
     original_message = models.ForeignKey('self', on_delete=models.SET_NULL, null=True, blank=True, 
                                        related_name='edited_versions', help_text="Reference to original message if this is an edit")
+    parent = models.ForeignKey('self', on_delete=models.SET_NULL, null=True, blank=True, related_name='replies',
+                               help_text="Previous message on the branch; mirrors Chat.message_graph for ancestry queries")
     status = models.CharField(max_length=20, choices=Status.choices, default=Status.SENT)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
@@ -121,12 +282,65 @@ class Message(models.Model):
             models.Index(fields=['status']),
             models.Index(fields=['created_at']),
             models.Index(fields=['original_message']),
+            # Keyset pagination of a chat's history on (created_at, id)
+            models.Index(fields=['chat', 'created_at', 'id']),
         ]
         ordering = ['created_at']
 
+    objects = MessageManager()
+
+    # Columns behind the content property, for .only() (see serializers.sparse_only)
+    sparse_columns = {'content': ('body', 'body__content')}
+
+    _pending_content = None
+
+    @property
+    def content(self):
+        if self._pending_content is not None:
+            return self._pending_content
+        return self.body.content
+
+    @content.setter
+    def content(self, text):
+        # Resolved to a MessageBody on save() / bulk_create()
+        self._pending_content = text
+
+    def attach_body(self, digest):
+        self.body = MessageBody(hash=digest, content=self._pending_content)
+        self._pending_content = None
+
+    def save(self, *args, **kwargs):
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and 'content' in update_fields:
+            update_fields = kwargs['update_fields'] = [name for name in update_fields if name != 'content'] + ['body']
+        # update_fields that leave out the body keep the new content pending for a later save
+        if self._pending_content is None or (update_fields is not None and 'body' not in update_fields):
+            return super().save(*args, **kwargs)
+        old_digest = self.body_id
+        if body_hash(self._pending_content) == old_digest:
+            self._pending_content = None
+            return super().save(*args, **kwargs)
+        # No savepoint: inside a caller's transaction this must not add round trips
+        with transaction.atomic(savepoint=False):
+            [digest] = MessageBody.objects.intern([self._pending_content])
+            self.attach_body(digest)
+            super().save(*args, **kwargs)
+            if old_digest:
+                MessageBody.objects.release(old_digest)
+
     def __str__(self):
         return f"{self.role} message in {self.chat.name} ({self.id})"
 
+@receiver(post_delete, sender=Message)
+def release_message_body(sender, instance, **kwargs):
+    MessageBody.objects.release(instance.body_id)
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def invalidate_principal(sender, instance, **kwargs):
+    # Username or is_active may have changed: authentication re-reads the principal
+    forget_principal(instance.pk)
+
 class Branch(models.Model):
     """
     Branches in chat conversations for handling message editing and branching.
@@ -192,3 +406,101 @@ class UserSettings(models.Model):
 
     def __str__(self):
         return f"Settings for {self.user.username} ({self.id})"
+
+class ChangeLog(models.Model):
+    """
+    Append-only sequence of changes to each user's projects, chats, messages and branches.
+    Rows are written by database triggers (migration 0010), so every write path is captured,
+    including queryset.update() and cascades. Deletions are recorded as tombstones.
+    Read in (txid, id) order by the sync endpoint; see utils_sync for why txid comes first.
+    """
+    class Entity(models.TextChoices):
+        PROJECT = 'project', 'Project'
+        CHAT = 'chat', 'Chat'
+        MESSAGE = 'message', 'Message'
+        BRANCH = 'branch', 'Branch'
+
+    id = models.BigAutoField(primary_key=True)
+    owner_id = models.IntegerField(help_text="User the changed row belongs to (not a FK: tombstones outlive rows)")
+    txid = models.BigIntegerField(help_text="txid_current() of the writing transaction")
+    entity = models.CharField(max_length=20, choices=Entity.choices)
+    entity_id = models.UUIDField()
+    deleted = models.BooleanField(default=False)
+    created_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        db_table = 'change_log'
+        indexes = [
+            # Sync reads one owner's changes after a (txid, id) cursor
+            models.Index(fields=['owner_id', 'txid', 'id']),
+            models.Index(fields=['entity_id']),
+        ]
+
+    def __str__(self):
+        action = 'deleted' if self.deleted else 'changed'
+        return f"{self.entity} {self.entity_id} {action} ({self.id})"
+
+class ChangeCounter(models.Model):
+    """
+    Per-owner, per-entity change counter bumped by the change_log trigger (migration 0017).
+    - Bumped with a row lock held to commit, so a reader sees it move in commit order: a
+      transaction that commits late still moves it past every value read before.
+    - Conditional GETs on the chat and project lists use it as their ETag stamp instead of counting rows.
+    """
+    owner_id = models.IntegerField()
+    entity = models.CharField(max_length=20, choices=ChangeLog.Entity.choices)
+    seq = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        db_table = 'change_counter'
+        constraints = [
+            models.UniqueConstraint(fields=['owner_id', 'entity'], name='change_counter_owner_entity'),
+        ]
+
+    def __str__(self):
+        return f"{self.entity} changes for user {self.owner_id}: {self.seq}"
+
+class IdempotencyKey(models.Model):
+    """
+    Stored responses for write requests sent with an Idempotency-Key header.
+    A retried request with the same key replays the stored response instead of writing again.
+    Rows expire after IDEMPOTENCY_KEY_TTL and are purged by purge_idempotency_keys.
+    """
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='idempotency_keys')
+    key = models.CharField(max_length=255)
+    request_hash = models.CharField(max_length=64, help_text="SHA-256 of the request path and body")
+    response_status = models.PositiveSmallIntegerField()
+    response_body = models.JSONField(encoder=DjangoJSONEncoder)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        db_table = 'idempotency_keys'
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'key'], name='unique_idempotency_key_per_user'),
+        ]
+        indexes = [
+            models.Index(fields=['created_at']),
+        ]
+
+    def __str__(self):
+        return f"Idempotency key {self.key} for {self.user_id}"
+
+class RevokedToken(models.Model):
+    """
+    JWTs revoked before they expire: refresh tokens replaced by rotation or logout, and access
+    tokens ended by logout. Looked up by jti, and only after the in-process bloom filter in
+    utils_revocation reports a possible match. Rows are purged once the token has expired.
+    """
+    jti = models.CharField(max_length=255, primary_key=True)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='revoked_tokens')
+    token_type = models.CharField(max_length=16)
+    expires_at = models.DateTimeField(db_index=True)
+    revoked_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    class Meta:
+        db_table = 'revoked_tokens'
+
+    def __str__(self):
+        return f"Revoked {self.token_type} token {self.jti}"
@@ -0,0 +1,190 @@
+import base64
+import uuid
+from django.conf import settings
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import BooleanField
+from django.db.models.expressions import RawSQL
+from django.utils.dateparse import parse_datetime
+from django.utils.functional import cached_property
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+# Pagination classes for the API
+
+def estimate_count(queryset):
+    """
+    Return the Postgres planner's row estimate for a queryset, or None on other databases.
+    - Costs one EXPLAIN (no rows are read), however large the table is.
+    """
+    connection = connections[queryset.db]
+    if connection.vendor != 'postgresql':
+        return None
+    sql, params = queryset.query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute(f"EXPLAIN (FORMAT JSON) {sql}", params)
+        plan = cursor.fetchone()[0]
+    return int(plan[0]['Plan']['Plan Rows'])
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Django paginator that trusts the planner estimate once it passes PAGINATION_ESTIMATE_THRESHOLD.
+    - Small result sets still get an exact COUNT(*), so they stay precise.
+    """
+    count_is_estimate = False
+
+    @cached_property
+    def count(self):
+        estimate = estimate_count(self.object_list)
+        if estimate is not None and estimate >= settings.PAGINATION_ESTIMATE_THRESHOLD:
+            self.count_is_estimate = True
+            return estimate
+        return super().count
+
+class EstimatedCountPagination(PageNumberPagination):
+    """
+    Page-number pagination whose `count` is a planner estimate on large result sets.
+    - Adds `count_is_estimate` to the response; with an estimate the last pages may be empty.
+    """
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+
+    django_paginator_class = EstimatedCountPaginator
+
+    def get_paginated_response(self, data):
+        return Response({
+            'count': self.page.paginator.count,
+            'count_is_estimate': self.page.paginator.count_is_estimate,
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data,
+        })
+
+class HasMorePagination(PageNumberPagination):
+    """
+    Page-number pagination that never counts: it fetches one extra row to set `has_more`.
+    - Responses carry `has_more`, `next` and `previous` but no `count`.
+    """
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.page_size_value = self.get_page_size(request)
+        try:
+            self.page_number = max(1, int(request.query_params.get(self.page_query_param, 1)))
+        except ValueError:
+            raise NotFound('Invalid page.')
+        offset = (self.page_number - 1) * self.page_size_value
+        rows = list(queryset[offset:offset + self.page_size_value + 1])
+        self.has_more = len(rows) > self.page_size_value
+        return rows[:self.page_size_value]
+
+    def get_next_link(self):
+        if not self.has_more:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.page_query_param, self.page_number + 1)
+
+    def get_previous_link(self):
+        if self.page_number <= 1:
+            return None
+        url = self.request.build_absolute_uri()
+        if self.page_number == 2:
+            return remove_query_param(url, self.page_query_param)
+        return replace_query_param(url, self.page_query_param, self.page_number - 1)
+
+    def get_paginated_response(self, data):
+        return Response({
+            'has_more': self.has_more,
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data,
+        })
+
+class MessageKeysetPagination(BasePagination):
+    """
+    Keyset (cursor) pagination over a chat's messages, newest page first.
+    - Pages are keyed on (created_at, id), served by the messages (chat, created_at, id) index.
+    - Each page is returned oldest-to-newest; `next` points at the page of older messages.
+    - Only used when the client sends ?limit= or ?cursor=, so existing clients keep the full list.
+    """
+    default_limit = 50
+    max_limit = 200
+    limit_query_param = 'limit'
+    cursor_query_param = 'cursor'
+    invalid_cursor_message = 'Invalid cursor'
+
+    def is_requested(self, request):
+        params = request.query_params
+        return self.limit_query_param in params or self.cursor_query_param in params
+
+    def get_limit(self, request):
+        try:
+            limit = int(request.query_params[self.limit_query_param])
+        except (KeyError, ValueError):
+            return self.default_limit
+        return max(1, min(limit, self.max_limit))
+
+    def encode_cursor(self, message):
+        raw = f"{message.created_at.isoformat()}|{message.id}"
+        return base64.urlsafe_b64encode(raw.encode()).decode()
+
+    def decode_cursor(self, cursor):
+        try:
+            created_at, pk = base64.urlsafe_b64decode(cursor.encode()).decode().split('|')
+            created_at = parse_datetime(created_at)
+            pk = uuid.UUID(pk)
+        except (ValueError, UnicodeDecodeError):
+            raise NotFound(self.invalid_cursor_message)
+        if created_at is None:
+            raise NotFound(self.invalid_cursor_message)
+        return created_at, pk
+
+    def older_than(self, queryset, created_at, pk):
+        """
+        Messages before (created_at, pk) in page order.
+        - A row-value comparison is one range bound on the (chat, created_at, id) index, so a deep
+          page reads only its own rows; the equivalent OR of two conditions can't bound the scan.
+        """
+        table = connections[queryset.db].ops.quote_name(queryset.model._meta.db_table)
+        return queryset.filter(RawSQL(
+            f'({table}."created_at", {table}."id") < (%s, %s)', [created_at, pk], output_field=BooleanField(),
+        ))
+
+    def paginate(self, queryset, limit, cursor=None):
+        """
+        Return (messages oldest-to-newest, cursor for the older page or None).
+        """
+        queryset = queryset.order_by('-created_at', '-id')
+        if cursor:
+            created_at, pk = self.decode_cursor(cursor)
+            queryset = self.older_than(queryset, created_at, pk)
+        # Fetch one extra row to learn whether an older page exists
+        rows = list(queryset[:limit + 1])
+        next_cursor = self.encode_cursor(rows[limit - 1]) if len(rows) > limit else None
+        rows = rows[:limit]
+        rows.reverse()
+        return rows, next_cursor
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        rows, self.next_cursor = self.paginate(
+            queryset, self.get_limit(request), request.query_params.get(self.cursor_query_param)
+        )
+        return rows
+
+    def get_next_link(self):
+        if self.next_cursor is None:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, self.next_cursor)
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'next_cursor': self.next_cursor,
+            'results': data,
+        })
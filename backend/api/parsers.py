@@ -0,0 +1,25 @@
+import codecs
+from django.conf import settings
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import JSONParser
+from .renderers import ORJSONRenderer, orjson
+
+# Parsers for the API
+
+class ORJSONParser(JSONParser):
+    """
+    Drop-in JSONParser backed by orjson.
+    - Rejects NaN/Infinity like the stock parser does in strict mode.
+    - Non-UTF-8 request encodings and non-strict mode fall back to the stock parser.
+    """
+    renderer_class = ORJSONRenderer
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        parser_context = parser_context or {}
+        encoding = parser_context.get('encoding', settings.DEFAULT_CHARSET)
+        if orjson is None or not self.strict or codecs.lookup(encoding).name != 'utf-8':
+            return super().parse(stream, media_type, parser_context)
+        try:
+            return orjson.loads(stream.read())
+        except orjson.JSONDecodeError as exc:
+            raise ParseError('JSON parse error - %s' % str(exc))
@@ -0,0 +1,59 @@
+from rest_framework.renderers import JSONRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+try:
+    import orjson
+except ImportError:  # orjson is optional; without it the stock renderer is used
+    orjson = None
+
+# Renderers for the API
+
+# Floats orjson formats exactly like repr(): 0.0 and finite magnitudes in [1e-4, 1e16). Outside it
+# orjson writes 1e16 / 0.00001 where json writes 1e+16 / 1e-05, and NaN/Infinity as null.
+FLOAT_RANGE = (1e-4, 1e16)
+
+def has_unmatched_float(data):
+    """Whether any float in the (nested dict/list) data falls outside FLOAT_RANGE."""
+    low, high = FLOAT_RANGE
+    containers = [(data,)]
+    while containers:
+        for value in containers.pop():
+            kind = type(value)
+            # Exact type checks first: strings and ints make up nearly all of a payload
+            if kind is str or kind is int or value is None or kind is bool:
+                continue
+            if isinstance(value, float):
+                if value and not low <= abs(value) < high:
+                    return True
+            elif isinstance(value, dict):
+                containers.append(value.values())
+            elif isinstance(value, (list, tuple)):
+                containers.append(value)
+    return False
+
+class ORJSONRenderer(JSONRenderer):
+    """
+    Drop-in JSONRenderer backed by orjson, byte-compatible with the stock renderer's compact output.
+    - UUIDs, str subclasses and dict/list subclasses (ReturnDict, ErrorDetail) are encoded natively.
+    - Everything else (datetimes, Decimal, lazy strings, sets) goes through DRF's JSONEncoder,
+      so it is formatted exactly as before.
+    - Indented output, non-default UNICODE/COMPACT/STRICT settings, values orjson can't encode
+      (e.g. integers over 64 bits) and floats it formats differently (exponent forms, NaN and
+      Infinity, which the strict stock renderer rejects) fall back to the stock renderer.
+    """
+    options = orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS if orjson else 0
+    encoder_default = staticmethod(JSONEncoder().default)
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        if (orjson is None or self.ensure_ascii or not self.compact or not self.strict
+                or self.get_indent(accepted_media_type, renderer_context or {}) is not None
+                or has_unmatched_float(data)):
+            return super().render(data, accepted_media_type, renderer_context)
+        try:
+            ret = orjson.dumps(data, default=self.encoder_default, option=self.options)
+        except orjson.JSONEncodeError:
+            return super().render(data, accepted_media_type, renderer_context)
+        # Same strict-javascript-subset escaping as the stock renderer
+        return ret.replace(b'\xe2\x80\xa8', b'\\u2028').replace(b'\xe2\x80\xa9', b'\\u2029')
@@ -1,17 +1,139 @@
+import time
 from rest_framework import serializers
 from django.contrib.auth.models import User
+from django.db.models import F, Func, TextField
+from django.db.models.functions import Cast
+from django.utils import timezone
 from .models import UserProfile, Project, Chat, Message, UserSettings
+from .pagination import MessageKeysetPagination
+from .utils_metrics import serializer_stats
 
 # Create your serializers here. 
 
-class UserSerializer(serializers.ModelSerializer):
+# Sparse fieldsets: ?fields=a,b,nested.c trims the output, ?expand=nested adds relations back
+def parse_field_list(value):
+    return {name.strip() for name in (value or '').split(',') if name.strip()}
+
+def sparse_spec(request):
+    """
+    Return (fields, expand) from the request's query params, or None when no fields were asked for.
+    """
+    # Writes always see every field so validation is unaffected
+    params = getattr(request, 'query_params', None)
+    if not params or 'fields' not in params or request.method not in ('GET', 'HEAD'):
+        return None
+    return parse_field_list(params.get('fields')), parse_field_list(params.get('expand'))
+
+def kept_field_names(field_names, spec, path=''):
+    """
+    Names from field_names that a serializer at `path` should keep for this spec.
+    - A nested relation requested as a whole (`fields=messages`) keeps all of its fields.
+    """
+    if spec is None:
+        return list(field_names)
+    fields, expand = spec
+    prefix = f"{path}." if path else ''
+    if path and (path in fields or path in expand):
+        # The whole relation was requested unless narrower dotted names were given
+        if not any(name.startswith(prefix) for name in fields):
+            return list(field_names)
+    wanted = {name[len(prefix):].split('.')[0] for name in fields | expand if name.startswith(prefix)}
+    return [name for name in field_names if name in wanted]
+
+class SparseFieldsMixin:
+    """
+    Serializer mixin that honours ?fields= and ?expand= from the request in context.
+    - Nested serializers are trimmed by dotted names (`messages.id`), following their field path.
+    """
+    def sparse_path(self):
+        names = []
+        node = self
+        while node.parent is not None:
+            if node.field_name:
+                names.append(node.field_name)
+            node = node.parent
+        names.append(node.context.get('sparse_path', ''))
+        return '.'.join(name for name in reversed(names) if name)
+
+    def get_fields(self):
+        fields = super().get_fields()
+        spec = sparse_spec(self.context.get('request'))
+        if spec is None:
+            return fields
+        keep = kept_field_names(fields.keys(), spec, self.sparse_path())
+        return {name: field for name, field in fields.items() if name in keep}
+
+class UpdateFieldsMixin:
+    """
+    Serializer mixin whose update() writes only the validated columns (plus updated_at).
+    - A full-row save would write back counters and graphs as they were when the instance was
+      read, undoing concurrent F() increments and graph updates made under select_for_update.
+    """
+    def update(self, instance, validated_data):
+        for name, value in validated_data.items():
+            setattr(instance, name, value)
+        instance.save(update_fields=[*validated_data, 'updated_at'])
+        return instance
+
+class TimedRepresentationMixin:
+    """
+    Serializer mixin that adds the time spent in to_representation to the request's metrics.
+    - Only the outermost serializer is timed, so nested serializers aren't counted twice; with
+      many=True each item is timed, leaving out the queryset evaluation before them.
+    """
+    def to_representation(self, instance):
+        stats = serializer_stats.get()
+        if stats is None or stats['depth']:
+            return super().to_representation(instance)
+        stats['depth'] += 1
+        started = time.perf_counter()
+        try:
+            return super().to_representation(instance)
+        finally:
+            stats['seconds'] += time.perf_counter() - started
+            stats['depth'] -= 1
+
+def sparse_only(queryset, serializer_class, request=None, path='', always=()):
+    """
+    Restrict a queryset with .only() to the columns the (sparse) serializer will read.
+    - Unrequested columns such as Message.content, UserProfile.user_memory and
+      Chat.message_graph are then never fetched.
+    - Falls back to the full queryset if a field's source can't be mapped to a column.
+    """
+    model = queryset.model
+    fields = serializer_class().fields
+    columns = {model._meta.pk.name, *always}
+    property_columns = getattr(model, 'sparse_columns', {})
+    for name in kept_field_names(fields.keys(), sparse_spec(request), path):
+        source = fields[name].source
+        if source == '*':
+            continue
+        if source in property_columns:
+            columns.update(property_columns[source])
+            continue
+        try:
+            model_field = model._meta.get_field(source.split('.')[0])
+        except Exception:
+            return queryset
+        if model_field.concrete:
+            columns.add(model_field.name)
+    joined = queryset.query.select_related
+    if isinstance(joined, dict):
+        # Joins the response doesn't read are dropped; the rest can't be deferred
+        queryset = queryset.select_related(None)
+        needed = [relation for relation in joined if relation in columns]
+        if needed:
+            queryset = queryset.select_related(*needed)
+    return queryset.only(*columns)
+
+class UserSerializer(TimedRepresentationMixin, SparseFieldsMixin, serializers.ModelSerializer):
     """Basic user serializer for authentication and user info."""
     class Meta:
         model = User
         fields = ['id', 'username', 'email', 'first_name', 'last_name', 'date_joined']
         read_only_fields = ['id', 'date_joined']
 
-class UserProfileSerializer(serializers.ModelSerializer):
+class UserProfileSerializer(TimedRepresentationMixin, SparseFieldsMixin, serializers.ModelSerializer):
     """User profile serializer with nested user data."""
     user = UserSerializer(read_only=True)
     
@@ -20,15 +142,27 @@ class UserProfileSerializer(serializers.ModelSerializer):
         fields = ['id', 'user', 'display_name', 'avatar_url', 'bio', 'user_memory', 'created_at', 'updated_at']
         read_only_fields = ['id', 'created_at', 'updated_at']
 
-class MessageSerializer(serializers.ModelSerializer):
+class MessageSerializer(TimedRepresentationMixin, SparseFieldsMixin, serializers.ModelSerializer):
     """Message serializer for individual messages."""
+    content = serializers.CharField()
+    
     class Meta:
         model = Message
         fields = ['id', 'chat', 'role', 'content', 'original_message', 'status', 'created_at', 'updated_at']
         read_only_fields = ['id', 'created_at', 'updated_at']
 
-class MessageDetailSerializer(serializers.ModelSerializer):
+class MessageContentSerializer(MessageSerializer):
+    """
+    MessageSerializer for messages created by a view that already holds the chat (and the
+    original, for edits): those are passed to save() instead of being validated, which would
+    fetch them again.
+    """
+    class Meta(MessageSerializer.Meta):
+        read_only_fields = MessageSerializer.Meta.read_only_fields + ['chat', 'original_message']
+
+class MessageDetailSerializer(TimedRepresentationMixin, SparseFieldsMixin, serializers.ModelSerializer):
     """Detailed message serializer with edited versions."""
+    content = serializers.CharField()
     edited_versions = MessageSerializer(many=True, read_only=True)
     
     class Meta:
@@ -36,57 +170,58 @@ class MessageDetailSerializer(serializers.ModelSerializer):
         fields = ['id', 'chat', 'role', 'content', 'original_message', 'status', 'edited_versions', 'created_at', 'updated_at']
         read_only_fields = ['id', 'created_at', 'updated_at']
 
-class ChatSerializer(serializers.ModelSerializer):
+class ChatSerializer(UpdateFieldsMixin, TimedRepresentationMixin, SparseFieldsMixin, serializers.ModelSerializer):
     """Basic chat serializer for list views."""
-    message_count = serializers.SerializerMethodField()
-    
     class Meta:
         model = Chat
         fields = ['id', 'owner', 'project', 'name', 'description', 'ai_model', 'status', 'message_count', 'created_at', 'updated_at']
-        read_only_fields = ['id', 'owner', 'created_at', 'updated_at']
-    
-    def get_message_count(self, obj):
-        return obj.messages.count()
+        read_only_fields = ['id', 'owner', 'message_count', 'created_at', 'updated_at']
 
-class ChatDetailSerializer(serializers.ModelSerializer):
-    """Detailed chat serializer with messages."""
-    messages = MessageSerializer(many=True, read_only=True)
-    message_count = serializers.SerializerMethodField()
+class ChatDetailSerializer(TimedRepresentationMixin, SparseFieldsMixin, serializers.ModelSerializer):
+    """Detailed chat serializer with the newest page of messages and a cursor for older ones."""
+    messages = serializers.SerializerMethodField()
+    messages_cursor = serializers.SerializerMethodField()
     
     class Meta:
         model = Chat
-        fields = ['id', 'owner', 'project', 'name', 'description', 'ai_model', 'status', 'messages', 'message_count', 'created_at', 'updated_at']
-        read_only_fields = ['id', 'owner', 'created_at', 'updated_at']
+        fields = ['id', 'owner', 'project', 'name', 'description', 'ai_model', 'status', 'messages', 'messages_cursor', 'message_count', 'created_at', 'updated_at']
+        read_only_fields = ['id', 'owner', 'message_count', 'created_at', 'updated_at']
+    
+    def messages_path(self):
+        return '.'.join(name for name in (self.sparse_path(), 'messages') if name)
     
-    def get_message_count(self, obj):
-        return obj.messages.count()
+    def newest_page(self, obj):
+        # Both method fields share one query per chat
+        if getattr(obj, '_newest_page', None) is None:
+            paginator = MessageKeysetPagination()
+            messages = sparse_only(obj.messages.all(), MessageSerializer, self.context.get('request'), self.messages_path(), always=('created_at',))
+            obj._newest_page = paginator.paginate(messages, paginator.default_limit)
+        return obj._newest_page
+    
+    def get_messages(self, obj):
+        context = {**self.context, 'sparse_path': self.messages_path()}
+        return MessageSerializer(self.newest_page(obj)[0], many=True, context=context).data
+    
+    def get_messages_cursor(self, obj):
+        return self.newest_page(obj)[1]
 
-class ProjectSerializer(serializers.ModelSerializer):
+class ProjectSerializer(UpdateFieldsMixin, TimedRepresentationMixin, SparseFieldsMixin, serializers.ModelSerializer):
     """Basic project serializer for list views."""
-    chat_count = serializers.SerializerMethodField()
-    
     class Meta:
         model = Project
         fields = ['id', 'owner', 'name', 'description', 'ai_instructions', 'chat_count', 'created_at', 'updated_at']
-        read_only_fields = ['id', 'owner', 'created_at', 'updated_at']
-    
-    def get_chat_count(self, obj):
-        return obj.chats.filter(status=Chat.Status.ACTIVE).count()
+        read_only_fields = ['id', 'owner', 'chat_count', 'created_at', 'updated_at']
 
-class ProjectDetailSerializer(serializers.ModelSerializer):
+class ProjectDetailSerializer(TimedRepresentationMixin, SparseFieldsMixin, serializers.ModelSerializer):
     """Detailed project serializer with chats."""
     chats = ChatSerializer(many=True, read_only=True)
-    chat_count = serializers.SerializerMethodField()
     
     class Meta:
         model = Project
         fields = ['id', 'owner', 'name', 'description', 'ai_instructions', 'chats', 'chat_count', 'created_at', 'updated_at']
-        read_only_fields = ['id', 'owner', 'created_at', 'updated_at']
-    
-    def get_chat_count(self, obj):
-        return obj.chats.filter(status=Chat.Status.ACTIVE).count()
+        read_only_fields = ['id', 'owner', 'chat_count', 'created_at', 'updated_at']
 
-class UserSettingsSerializer(serializers.ModelSerializer):
+class UserSettingsSerializer(TimedRepresentationMixin, SparseFieldsMixin, serializers.ModelSerializer):
     """User settings serializer."""
     class Meta:
         model = UserSettings
@@ -94,27 +229,67 @@ class UserSettingsSerializer(serializers.ModelSerializer):
         read_only_fields = ['id', 'created_at', 'updated_at']
 
 # Dashboard serializers for efficient data loading
-class DashboardProjectSerializer(serializers.ModelSerializer):
+class DashboardProjectSerializer(TimedRepresentationMixin, SparseFieldsMixin, serializers.ModelSerializer):
     """Minimal project data for dashboard."""
-    chat_count = serializers.SerializerMethodField()
-    
     class Meta:
         model = Project
         fields = ['id', 'name', 'description', 'chat_count', 'created_at', 'updated_at']
-        read_only_fields = ['id', 'created_at', 'updated_at']
-    
-    def get_chat_count(self, obj):
-        return obj.chats.filter(status=Chat.Status.ACTIVE).count()
+        read_only_fields = ['id', 'chat_count', 'created_at', 'updated_at']
 
-class DashboardChatSerializer(serializers.ModelSerializer):
+class DashboardChatSerializer(TimedRepresentationMixin, SparseFieldsMixin, serializers.ModelSerializer):
     """Minimal chat data for dashboard."""
-    message_count = serializers.SerializerMethodField()
     project_name = serializers.CharField(source='project.name', read_only=True)
     
     class Meta:
         model = Chat
         fields = ['id', 'name', 'description', 'status', 'message_count', 'project_name', 'created_at', 'updated_at']
-        read_only_fields = ['id', 'created_at', 'updated_at']
-    
-    def get_message_count(self, obj):
-        return obj.messages.count() 
\ No newline at end of file
+        read_only_fields = ['id', 'message_count', 'created_at', 'updated_at']
+
+# Fast read path for message lists: skips model instances and field machinery
+class UTCISOFormat(Func):
+    """
+    Format a timestamptz in SQL exactly like DRF's DateTimeField does in UTC:
+    ISO 8601 with a 'Z' suffix and microseconds only when non-zero.
+    """
+    template = (
+        "to_char(%(expressions)s AT TIME ZONE 'UTC', 'YYYY-MM-DD\"T\"HH24:MI:SS') || "
+        "CASE WHEN date_trunc('second', %(expressions)s) = %(expressions)s THEN '' "
+        "ELSE to_char(%(expressions)s AT TIME ZONE 'UTC', '.US') END || 'Z'"
+    )
+    output_field = TextField()
+
+def message_rows(queryset):
+    """
+    Read-only equivalent of MessageSerializer(queryset, many=True).data.
+    - Selects only the serialized columns with values_list() and builds plain dicts,
+      producing the same JSON as the ModelSerializer at a fraction of the CPU.
+    - UUIDs (and, in UTC, timestamps) are rendered to text in SQL, which skips
+      building a Python object per column only to turn it back into a string.
+    """
+    if timezone.get_current_timezone_name() == 'UTC':
+        as_text = UTCISOFormat
+    else:
+        as_text = lambda field: F(field)
+    rows = queryset.annotate(
+        id_text=Cast('id', TextField()),
+        chat_text=Cast('chat_id', TextField()),
+        original_text=Cast('original_message_id', TextField()),
+        created_text=as_text('created_at'),
+        updated_text=as_text('updated_at'),
+    ).values_list('id_text', 'chat_text', 'role', 'body__content', 'original_text', 'status', 'created_text', 'updated_text')
+    if as_text is not UTCISOFormat:
+        serialize_datetime = serializers.DateTimeField().to_representation
+        rows = [row[:6] + (serialize_datetime(row[6]), serialize_datetime(row[7])) for row in rows]
+    return [
+        {
+            'id': pk,
+            'chat': chat_id,
+            'role': role,
+            'content': content,
+            'original_message': original_id,
+            'status': message_status,
+            'created_at': created_at,
+            'updated_at': updated_at,
+        }
+        for pk, chat_id, role, content, original_id, message_status, created_at, updated_at in rows
+    ]
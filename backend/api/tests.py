@@ -1,10 +1,51 @@
 from django.test import TestCase
+from django.contrib.auth.hashers import check_password, make_password
 from django.contrib.auth.models import User
 from django.urls import reverse
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import IntegrityError, connection, transaction
+from django.db.models import F
+from django.conf import settings
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
 from rest_framework.test import APITestCase, APIClient
 from rest_framework import status
+from rest_framework.renderers import JSONRenderer
+from rest_framework.exceptions import ParseError
 from rest_framework_simplejwt.tokens import RefreshToken
-from .models import UserProfile, Project, Chat, Message
+from .models import UserProfile, UserSettings, Project, Chat, Message, MessageBody, MessageEmbedding, Branch, Edit, IdempotencyKey, ChangeLog, RevokedToken
+from .pagination import MessageKeysetPagination, EstimatedCountPaginator
+from .serializers import (
+    MessageSerializer, ChatDetailSerializer, ProjectDetailSerializer, UserProfileSerializer, message_rows
+)
+from .renderers import ORJSONRenderer, orjson
+from .views import ChatViewSet, IsOwnerOrReadOnly
+from .parsers import ORJSONParser
+from .utils_auth import get_principal
+from .utils_metrics import RequestMetrics, request_metrics
+from .utils_queries import QueryBudgetExceeded, budget_violations, fingerprint, record_queries
+from .utils_revocation import BloomFilter, revocation_filter, revoke_token
+from .utils_search import TRIGRAM_RECHECK_SECONDS, match_names, trigram_available, trigram_state
+from .utils_semantic import SemanticIndex, merge_executor
+from .embeddings import get_embedder, numpy
+from .fields import load_dictionary, loaded_dictionaries, zstandard
+from .hashers import argon2
+from datetime import datetime, timedelta
+from decimal import Decimal
+from io import BytesIO, StringIO
+from pathlib import Path
+from unittest import skipUnless
+from types import SimpleNamespace
+from unittest.mock import patch
+import json
+import os
+import re
+import threading
+import time
+import shutil
+import tempfile
 import uuid
 
 
@@ -261,6 +302,1891 @@ class MessageOperationsTests(BaseTestCase):
         self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
 
 
+class EditAndRegenerateTests(BaseTestCase):
+    """Test the atomic edit-and-regenerate flow on the message graph."""
+    
+    def setUp(self):
+        super().setUp()
+        # Build a two-message graph on a default branch, as add_message does
+        self.chat.message_graph = {
+            str(self.user_message.id): {'parent': None, 'children': [str(self.ai_message.id)]},
+            str(self.ai_message.id): {'parent': str(self.user_message.id), 'children': []},
+        }
+        self.chat.save()
+        self.default_branch = Branch.objects.create(chat=self.chat, head_message_id=self.ai_message.id)
+    
+    def test_add_message_extends_graph_and_branch(self):
+        """Test that add_message links the exchange under the branch head."""
+        url = reverse('chat-add-message', kwargs={'pk': self.chat.id})
+        response = self.client.post(url, {'content': 'Follow-up question'})
+        
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        user_id = response.data['user_message']['id']
+        ai_id = response.data['ai_message']['id']
+        
+        self.chat.refresh_from_db()
+        graph = self.chat.message_graph
+        self.assertEqual(graph[user_id]['parent'], str(self.ai_message.id))
+        self.assertEqual(graph[ai_id]['parent'], user_id)
+        self.default_branch.refresh_from_db()
+        self.assertEqual(str(self.default_branch.head_message_id), ai_id)
+    
+    def test_edit_message_forks_graph_and_records_branch(self):
+        """Test that editing creates the fork, reply, Branch and Edit in one call."""
+        url = reverse('message-edit-message', kwargs={'pk': self.user_message.id})
+        response = self.client.post(url, {'content': 'Edited question'})
+        
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        edited_id = response.data['id']
+        ai_id = response.data['ai_message']['id']
+        self.assertEqual(response.data['ai_message']['role'], 'assistant')
+        self.assertEqual(response.data['branch']['head_message_id'], ai_id)
+        self.assertEqual(response.data['chain'], [edited_id, ai_id])
+        self.assertEqual([m['id'] for m in response.data['messages']], [edited_id, ai_id])
+        
+        self.chat.refresh_from_db()
+        self.assertEqual(self.chat.message_graph[edited_id]['parent'], None)
+        self.assertEqual(self.chat.message_graph[ai_id]['parent'], edited_id)
+        
+        branch = Branch.objects.get(branch_id=response.data['branch']['branch_id'])
+        edit = Edit.objects.get(edit_id=response.data['edit_id'])
+        self.assertEqual(edit.branch, branch)
+        self.assertEqual(edit.prev_message_id, self.user_message.id)
+        self.assertEqual(str(edit.new_message_id), edited_id)
+        self.assertEqual(str(edit.new_head_id), ai_id)
+    
+    def test_edit_message_returns_ancestors_in_chain(self):
+        """Test that editing a later message returns the shared ancestors too."""
+        url = reverse('chat-add-message', kwargs={'pk': self.chat.id})
+        second = self.client.post(url, {'content': 'Second question'}).data['user_message']
+        
+        url = reverse('message-edit-message', kwargs={'pk': second['id']})
+        response = self.client.post(url, {'content': 'Second question, edited'})
+        
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(
+            response.data['chain'][:2],
+            [str(self.user_message.id), str(self.ai_message.id)],
+        )
+        self.assertEqual(len(response.data['messages']), 4)
+    
+    def test_edit_message_query_budget(self):
+        """Test that the edit flow runs within a fixed query budget."""
+        url = reverse('message-edit-message', kwargs={'pk': self.user_message.id})
+        # 9 plus one body upsert for each of the two new messages
+        with self.assertNumQueries(11):
+            response = self.client.post(url, {'content': 'Edited question'})
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+
+class IdempotencyKeyTests(BaseTestCase):
+    """Test Idempotency-Key replay on add_message and edit_message."""
+    
+    def test_add_message_replay_creates_nothing(self):
+        """Test that a retried add_message replays the stored response."""
+        url = reverse('chat-add-message', kwargs={'pk': self.chat.id})
+        first = self.client.post(url, {'content': 'Hello'}, HTTP_IDEMPOTENCY_KEY='retry-1')
+        message_count = Message.objects.count()
+        
+        second = self.client.post(url, {'content': 'Hello'}, HTTP_IDEMPOTENCY_KEY='retry-1')
+        
+        self.assertEqual(second.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(second['Idempotent-Replayed'], 'true')
+        self.assertEqual(second.json(), first.json())
+        self.assertEqual(Message.objects.count(), message_count)
+    
+    def test_edit_message_replay_creates_nothing(self):
+        """Test that a retried edit_message replays the stored response."""
+        url = reverse('message-edit-message', kwargs={'pk': self.user_message.id})
+        first = self.client.post(url, {'content': 'Edited'}, HTTP_IDEMPOTENCY_KEY='edit-1')
+        branch_count = Branch.objects.count()
+        
+        second = self.client.post(url, {'content': 'Edited'}, HTTP_IDEMPOTENCY_KEY='edit-1')
+        
+        self.assertEqual(second.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(second.json()['id'], first.json()['id'])
+        self.assertEqual(Branch.objects.count(), branch_count)
+    
+    def test_key_reused_with_different_payload(self):
+        """Test that reusing a key for a different request is rejected."""
+        url = reverse('chat-add-message', kwargs={'pk': self.chat.id})
+        self.client.post(url, {'content': 'Hello'}, HTTP_IDEMPOTENCY_KEY='retry-2')
+        
+        response = self.client.post(url, {'content': 'Something else'}, HTTP_IDEMPOTENCY_KEY='retry-2')
+        
+        self.assertEqual(response.status_code, status.HTTP_422_UNPROCESSABLE_ENTITY)
+    
+    def test_expired_keys_are_purged(self):
+        """Test that expired keys are not replayed and are removed by the purge command."""
+        url = reverse('chat-add-message', kwargs={'pk': self.chat.id})
+        self.client.post(url, {'content': 'Hello'}, HTTP_IDEMPOTENCY_KEY='retry-3')
+        IdempotencyKey.objects.update(created_at=timezone.now() - timedelta(days=2))
+        
+        response = self.client.post(url, {'content': 'Hello'}, HTTP_IDEMPOTENCY_KEY='retry-3')
+        self.assertNotIn('Idempotent-Replayed', response)
+        
+        IdempotencyKey.objects.update(created_at=timezone.now() - timedelta(days=2))
+        call_command('purge_idempotency_keys', stdout=StringIO())
+        self.assertFalse(IdempotencyKey.objects.exists())
+
+
+class CounterTests(BaseTestCase):
+    """Test the denormalized message_count / chat_count counters."""
+    
+    def setUp(self):
+        super().setUp()
+        # BaseTestCase creates rows directly, so bring the counters in line first
+        call_command('reconcile_counters', workers=1, stdout=StringIO())
+    
+    def test_reconcile_repairs_drift(self):
+        """Test that the reconcile command fixes counters that drifted."""
+        self.chat.refresh_from_db()
+        self.project.refresh_from_db()
+        self.assertEqual(self.chat.message_count, 2)
+        self.assertEqual(self.project.chat_count, 1)
+        
+        Chat.objects.filter(id=self.chat.id).update(message_count=99)
+        out = StringIO()
+        call_command('reconcile_counters', workers=1, stdout=out)
+        
+        self.chat.refresh_from_db()
+        self.assertEqual(self.chat.message_count, 2)
+        self.assertIn('Repaired 1 chat counters', out.getvalue())
+    
+    def test_metadata_writes_leave_counters_alone(self):
+        """Test that renames, status changes and PATCHes write back no stale counter or graph."""
+        chat_id, project_id = self.chat.id, self.project.id
+        writes = [
+            ('patch', reverse('project-rename', kwargs={'pk': project_id}), {'name': 'Renamed'}),
+            ('patch', reverse('project-detail', kwargs={'pk': project_id}), {'description': 'New'}),
+            ('patch', reverse('chat-rename', kwargs={'pk': chat_id}), {'name': 'Renamed'}),
+            ('patch', reverse('chat-update-status', kwargs={'pk': chat_id}), {'status': 'archived'}),
+            ('patch', reverse('chat-detail', kwargs={'pk': chat_id}), {'description': 'New'}),
+        ]
+        for method, url, data in writes:
+            with CaptureQueriesContext(connection) as queries:
+                response = getattr(self.client, method)(url, data, format='json')
+            self.assertEqual(response.status_code, status.HTTP_200_OK, url)
+            # Counter adjustments are relative (GREATEST(... + delta)); a literal value is a write-back
+            stale = [q['sql'] for q in queries if re.search(r'"(message_count|message_graph|chat_count)" = (?!GREATEST)', q['sql'])]
+            self.assertEqual(stale, [], url)
+    
+    def test_add_and_delete_message_update_count(self):
+        """Test that message write paths keep message_count current."""
+        url = reverse('chat-add-message', kwargs={'pk': self.chat.id})
+        self.client.post(url, {'content': 'Hello'})
+        self.client.delete(reverse('message-detail', kwargs={'pk': self.user_message.id}))
+        
+        self.chat.refresh_from_db()
+        self.assertEqual(self.chat.message_count, 3)
+    
+    def test_chat_write_paths_update_project_count(self):
+        """Test that chat create, archive and delete keep chat_count current."""
+        url = reverse('project-create-chat', kwargs={'pk': self.project.id})
+        new_chat_id = self.client.post(url, {'name': 'Second'}).data['id']
+        self.project.refresh_from_db()
+        self.assertEqual(self.project.chat_count, 2)
+        
+        url = reverse('chat-update-status', kwargs={'pk': self.chat.id})
+        self.client.patch(url, {'status': 'archived'})
+        self.project.refresh_from_db()
+        self.assertEqual(self.project.chat_count, 1)
+        
+        self.client.delete(reverse('chat-detail', kwargs={'pk': new_chat_id}))
+        self.project.refresh_from_db()
+        self.assertEqual(self.project.chat_count, 0)
+    
+    def test_chat_list_has_no_per_row_counts(self):
+        """Test that listing chats doesn't issue a count query per chat."""
+        for i in range(5):
+            Chat.objects.create(owner=self.user, name=f'Chat {i}', project=self.project)
+        url = reverse('chat-list')
+        # ETag validator, count estimate, exact count (small list) and the page itself
+        with self.assertNumQueries(4):
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+
+class MessagePaginationTests(BaseTestCase):
+    """Test keyset pagination of chat message listings."""
+    
+    def setUp(self):
+        super().setUp()
+        for i in range(5):
+            Message.objects.create(chat=self.chat, role=Message.Role.USER, content=f'Message {i}')
+        self.ordered_ids = [
+            str(pk) for pk in self.chat.messages.order_by('created_at', 'id').values_list('id', flat=True)
+        ]
+    
+    def walk_pages(self, url, limit):
+        """Follow next cursors from the newest page back to the oldest."""
+        pages = []
+        response = self.client.get(url, {'limit': limit})
+        while True:
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            pages.append([m['id'] for m in response.data['results']])
+            if not response.data['next_cursor']:
+                return pages
+            response = self.client.get(url, {'limit': limit, 'cursor': response.data['next_cursor']})
+    
+    def test_newest_page_then_older(self):
+        """Test that pages run newest first, each in chronological order."""
+        url = reverse('chat-messages', kwargs={'pk': self.chat.id})
+        pages = self.walk_pages(url, 3)
+        
+        self.assertEqual(pages, [self.ordered_ids[4:], self.ordered_ids[1:4], self.ordered_ids[:1]])
+    
+    def test_pages_handle_identical_timestamps(self):
+        """Test that messages sharing created_at are neither skipped nor repeated."""
+        self.chat.messages.update(created_at=timezone.now())
+        ordered_ids = sorted(self.ordered_ids)
+        url = reverse('chat-messages', kwargs={'chat_id': self.chat.id})
+        pages = self.walk_pages(url, 2)
+        
+        self.assertEqual([mid for page in reversed(pages) for mid in page], ordered_ids)
+    
+    def test_cursor_is_an_index_range_bound(self):
+        """Test that an older page is one range scan of the keyset index: bounded, unsorted, limited."""
+        pagination = MessageKeysetPagination()
+        newest = self.chat.messages.order_by('-created_at', '-id').first()
+        page = pagination.older_than(
+            Message.objects.filter(chat=self.chat).order_by('-created_at', '-id'), newest.created_at, newest.id,
+        )[:3]
+        with connection.cursor() as cursor:
+            # Tiny test tables would otherwise be read sequentially
+            cursor.execute("SET LOCAL enable_seqscan = off")
+            cursor.execute("SET LOCAL enable_bitmapscan = off")
+            plan = json.loads(page.explain(format='json'))[0]['Plan']
+        
+        self.assertEqual(plan['Node Type'], 'Limit')
+        nodes, scans = [plan], []
+        while nodes:
+            node = nodes.pop()
+            self.assertNotEqual(node['Node Type'], 'Sort')
+            nodes += node.get('Plans', [])
+            if node.get('Relation Name') == 'messages':
+                scans.append(node)
+        [scan] = scans
+        self.assertEqual(scan['Node Type'], 'Index Scan')
+        self.assertEqual(scan['Scan Direction'], 'Backward')
+        self.assertRegex(scan['Index Cond'], r'ROW\(created_at, id\) < ROW\(')
+        self.assertEqual([str(m.id) for m in reversed(page)], self.ordered_ids[-4:-1])
+    
+    def test_invalid_cursor(self):
+        """Test that a malformed cursor is rejected."""
+        url = reverse('chat-messages', kwargs={'pk': self.chat.id})
+        response = self.client.get(url, {'cursor': 'not-a-cursor'})
+        
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+    
+    def test_chat_detail_embeds_newest_page(self):
+        """Test that chat detail embeds only the newest page plus a cursor."""
+        MessageKeysetPagination.default_limit, default_limit = 4, MessageKeysetPagination.default_limit
+        self.addCleanup(setattr, MessageKeysetPagination, 'default_limit', default_limit)
+        response = self.client.get(reverse('chat-detail', kwargs={'pk': self.chat.id}))
+        
+        self.assertEqual([m['id'] for m in response.data['messages']], self.ordered_ids[3:])
+        self.assertIsNotNone(response.data['messages_cursor'])
+
+
+class PaginationModeTests(BaseTestCase):
+    """Test the estimated-count and has-more pagination modes."""
+    
+    def test_small_lists_get_exact_count(self):
+        """Test that lists below the threshold report an exact count."""
+        response = self.client.get(reverse('project-list'))
+        
+        self.assertEqual(response.data['count'], 1)
+        self.assertFalse(response.data['count_is_estimate'])
+    
+    @override_settings(PAGINATION_ESTIMATE_THRESHOLD=0)
+    def test_large_lists_skip_count_query(self):
+        """Test that lists above the threshold use the planner estimate instead of COUNT(*)."""
+        paginator = EstimatedCountPaginator(Chat.objects.filter(owner=self.user), 20)
+        with CaptureQueriesContext(connection) as queries:
+            count = paginator.count
+        
+        self.assertTrue(paginator.count_is_estimate)
+        self.assertIsInstance(count, int)
+        self.assertFalse(any('COUNT(' in q['sql'] for q in queries.captured_queries))
+    
+    @override_settings(PAGINATION_ESTIMATE_THRESHOLD=0)
+    def test_list_views_estimate_past_threshold(self):
+        """Test that the chat and project lists never run an exact count past the threshold."""
+        for name in ['chat-list', 'project-list']:
+            with self.subTest(name=name):
+                with CaptureQueriesContext(connection) as queries:
+                    response = self.client.get(reverse(name))
+                
+                self.assertTrue(response.data['count_is_estimate'])
+                self.assertFalse(any('COUNT(' in q['sql'] for q in queries.captured_queries))
+    
+    def test_message_list_reports_has_more(self):
+        """Test that the message list pages without counting."""
+        url = reverse('message-list')
+        first = self.client.get(url, {'page_size': 1})
+        
+        self.assertNotIn('count', first.data)
+        self.assertTrue(first.data['has_more'])
+        self.assertEqual(len(first.data['results']), 1)
+        
+        second = self.client.get(first.data['next'])
+        self.assertFalse(second.data['has_more'])
+        self.assertIsNone(second.data['next'])
+        self.assertIsNotNone(second.data['previous'])
+
+
+class FastMessageRowsTests(BaseTestCase):
+    """Test the values_list() read path used by read-only message endpoints."""
+    
+    def test_matches_model_serializer_json(self):
+        """Test that message_rows renders the same JSON as MessageSerializer."""
+        edited = Message.objects.create(
+            chat=self.chat, role=Message.Role.USER, content='Edited',
+            original_message=self.user_message, status=Message.Status.EDITED,
+        )
+        queryset = Message.objects.filter(chat=self.chat)
+        expected = JSONRenderer().render(MessageSerializer(queryset, many=True).data)
+        
+        self.assertEqual(JSONRenderer().render(message_rows(queryset)), expected)
+        self.assertEqual(message_rows(queryset)[-1]['original_message'], str(self.user_message.id))
+        self.assertEqual(message_rows(queryset)[-1]['id'], str(edited.id))
+    
+    def test_matches_model_serializer_whole_seconds_and_other_timezones(self):
+        """Test the timestamp formatting edge cases against MessageSerializer."""
+        Message.objects.filter(id=self.user_message.id).update(created_at=timezone.now().replace(microsecond=0))
+        queryset = Message.objects.filter(chat=self.chat)
+        for tz in ['UTC', 'America/New_York']:
+            with self.subTest(tz=tz), timezone.override(tz):
+                expected = JSONRenderer().render(MessageSerializer(queryset, many=True).data)
+                self.assertEqual(JSONRenderer().render(message_rows(queryset)), expected)
+    
+    def test_branch_chain_uses_chain_order(self):
+        """Test that branch_chain returns messages root to head."""
+        self.chat.message_graph = {
+            str(self.user_message.id): {'parent': None, 'children': [str(self.ai_message.id)]},
+            str(self.ai_message.id): {'parent': str(self.user_message.id), 'children': []},
+        }
+        self.chat.save()
+        url = reverse('chat-graph-branch-chain', kwargs={'pk': self.chat.id})
+        with self.assertNumQueries(2):
+            response = self.client.get(url, {'head_id': str(self.ai_message.id)})
+        
+        self.assertEqual(
+            [m['id'] for m in response.data['messages']],
+            [str(self.user_message.id), str(self.ai_message.id)],
+        )
+
+
+@skipUnless(orjson, 'orjson is not installed')
+class ORJSONRendererTests(BaseTestCase):
+    """Test that the orjson renderer and parser match the stock JSON ones."""
+    
+    def assertSameBytes(self, data):
+        self.assertEqual(ORJSONRenderer().render(data), JSONRenderer().render(data))
+    
+    def test_real_serializer_payloads(self):
+        """Test byte-compatibility on chat, project and message serializer output."""
+        self.user_message.content = 'Line\u2028separator, unicode \u00e9\u4e2d\U0001f600 and "quotes"'
+        self.user_message.save()
+        self.assertSameBytes(ChatDetailSerializer(self.chat).data)
+        self.assertSameBytes(ProjectDetailSerializer(self.project).data)
+        self.assertSameBytes(MessageSerializer(self.chat.messages.all(), many=True).data)
+        self.assertSameBytes(UserProfileSerializer(self.user_profile).data)
+    
+    def test_python_values(self):
+        """Test values that go through DRF's encoder rather than orjson natively."""
+        self.assertSameBytes({
+            'when': timezone.now(),
+            'naive': datetime(2025, 6, 22, 4, 16),
+            'amount': Decimal('1.50'),
+            'tags': {'only-one'},
+            'id': uuid.uuid4(),
+            'nested': [None, True, 1, 'x'],
+            'huge': 2 ** 70,
+        })
+    
+    def test_floats_match_or_fall_back(self):
+        """Test exponent-form floats match the stock renderer and NaN/Infinity are rejected like it."""
+        self.assertSameBytes({'score': [0.0, -0.0, 0.5, 1e-4, 1e15, 123.456]})
+        for value in (1e16, 1.5e-7, 1e-5, -2.5e20, 5e-324):
+            self.assertSameBytes({'nested': [{'score': value}]})
+        for value in (float('nan'), float('inf'), float('-inf')):
+            with self.assertRaises(ValueError):
+                JSONRenderer().render({'score': value})
+            with self.assertRaises(ValueError):
+                ORJSONRenderer().render({'score': value})
+    
+    def test_indent_falls_back_to_stock_renderer(self):
+        """Test that pretty-printed output still matches."""
+        data = {'a': [1, 2]}
+        self.assertEqual(
+            ORJSONRenderer().render(data, 'application/json; indent=4'),
+            JSONRenderer().render(data, 'application/json; indent=4'),
+        )
+    
+    def test_parser(self):
+        """Test that the parser reads JSON and rejects NaN like the stock parser."""
+        parsed = ORJSONParser().parse(BytesIO('{"content": "h\u00e9llo", "n": [1]}'.encode()))
+        self.assertEqual(parsed, {'content': 'h\u00e9llo', 'n': [1]})
+        with self.assertRaises(ParseError):
+            ORJSONParser().parse(BytesIO(b'{"n": NaN}'))
+
+
+class MessageBodyStoreTests(BaseTestCase):
+    """Test the content-addressed, reference-counted message body store."""
+    
+    def refs(self, text):
+        return MessageBody.objects.get(content=text).ref_count
+    
+    def test_admin_edits_content_through_the_store(self):
+        """Test that the message admin edits content as text, keeping reference counts, without listing bodies."""
+        admin_user = User.objects.create_superuser(username='admin', email='admin@example.com', password='adminpass123')
+        client = APIClient()
+        client.force_login(admin_user)
+        for i in range(5):
+            Message.objects.create(chat=self.chat, role=Message.Role.USER, content=f'Filler {i}')
+        url = reverse('admin:api_message_change', args=[self.user_message.id])
+        
+        with CaptureQueriesContext(connection) as queries:
+            page = client.get(url)
+        self.assertContains(page, self.user_message.content)
+        self.assertNotContains(page, 'name="body"')
+        self.assertFalse([q for q in queries if 'FROM "message_bodies"' in q['sql'] and 'WHERE' not in q['sql']])
+        
+        old_content = self.user_message.content
+        response = client.post(url, {
+            'chat': self.chat.id, 'role': Message.Role.USER, 'content': 'Edited in admin', 'status': Message.Status.SENT,
+        })
+        self.assertEqual(response.status_code, 302)
+        self.user_message.refresh_from_db()
+        self.assertEqual(self.user_message.content, 'Edited in admin')
+        self.assertEqual(self.refs('Edited in admin'), 1)
+        self.assertEqual(self.refs(old_content), 0)
+    
+    def test_identical_content_shares_one_body(self):
+        """Test that repeated content is stored once and counted per message."""
+        copy = Message.objects.create(chat=self.chat, role=Message.Role.USER, content=self.user_message.content)
+        Message.objects.bulk_create([
+            Message(chat=self.chat, role=Message.Role.USER, content=self.user_message.content),
+            Message(chat=self.chat, role=Message.Role.USER, content='Only once'),
+        ])
+        
+        self.assertEqual(copy.body_id, self.user_message.body_id)
+        self.assertEqual(self.refs(self.user_message.content), 3)
+        self.assertEqual(self.refs('Only once'), 1)
+        self.assertEqual(MessageBody.objects.count(), 3)
+        self.assertEqual(Message.objects.get(id=copy.id).content, self.user_message.content)
+    
+    def test_update_moves_reference(self):
+        """Test that changing content releases the old body."""
+        url = reverse('message-detail', kwargs={'pk': self.user_message.id})
+        response = self.client.patch(url, {'content': 'New text'}, format='json')
+        
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['content'], 'New text')
+        self.assertEqual(self.refs('New text'), 1)
+        self.assertEqual(self.refs('Hello, this is a user message'), 0)
+    
+    def test_partial_save_leaves_pending_content_alone(self):
+        """Test that update_fields without content neither interns nor releases a body."""
+        message = Message.objects.get(id=self.user_message.id)
+        message.content = 'Not written yet'
+        message.status = Message.Status.EDITED
+        message.save(update_fields=['status'])
+        
+        self.assertEqual(self.refs('Hello, this is a user message'), 1)
+        self.assertFalse(MessageBody.objects.filter(content='Not written yet').exists())
+        self.assertEqual(Message.objects.get(id=message.id).content, 'Hello, this is a user message')
+        
+        message.save(update_fields=['content'])
+        self.assertEqual(Message.objects.get(id=message.id).content, 'Not written yet')
+        self.assertEqual(self.refs('Not written yet'), 1)
+        self.assertEqual(self.refs('Hello, this is a user message'), 0)
+    
+    def test_delete_and_garbage_collection(self):
+        """Test that deleted messages release bodies and gc removes only unreferenced ones."""
+        self.chat.delete()
+        Message.objects.create(
+            chat=Chat.objects.create(owner=self.user, name='Other'), role=Message.Role.USER, content='Kept',
+        )
+        self.assertEqual(self.refs('Hello! This is an AI response.'), 0)
+        
+        out = StringIO()
+        call_command('gc_message_bodies', stdout=out)
+        
+        self.assertEqual(list(MessageBody.objects.values_list('content', flat=True)), ['Kept'])
+        self.assertIn('Deleted 2 unreferenced message bodies', out.getvalue())
+    
+    def test_cascading_delete_releases_bodies_in_one_update(self):
+        """Test that deleting a chat releases all its message bodies with a single UPDATE."""
+        for i in range(5):
+            Message.objects.create(chat=self.chat, role=Message.Role.USER, content=f'Body {i}')
+        url = reverse('chat-detail', kwargs={'pk': self.chat.id})
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.delete(url)
+        
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        self.assertEqual(len([q for q in queries if q['sql'].startswith('UPDATE message_bodies')]), 1)
+        self.assertFalse(MessageBody.objects.exclude(ref_count=0).exists())
+    
+    def test_reconcile_repairs_ref_counts(self):
+        """Test that --reconcile recounts drifted references before collecting."""
+        MessageBody.objects.update(ref_count=0)
+        call_command('gc_message_bodies', reconcile=True, workers=1, stdout=StringIO())
+        
+        self.assertEqual(self.refs(self.user_message.content), 1)
+        self.assertEqual(MessageBody.objects.count(), 2)
+
+
+class MessageCompressionTests(BaseTestCase):
+    """Test compression of large Message.content at rest."""
+    
+    LARGE = "def handler(request):\n    return render(request, 'page.html')\n" * 100
+    
+    def stored_bytes(self, message):
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT content FROM message_bodies WHERE hash = %s", [message.body_id])
+            return bytes(cursor.fetchone()[0])
+    
+    def test_plain_when_disabled(self):
+        """Test that content is stored as plain UTF-8 without a codec."""
+        message = Message.objects.create(chat=self.chat, role=Message.Role.ASSISTANT, content=self.LARGE)
+        self.assertEqual(self.stored_bytes(message), self.LARGE.encode('utf-8'))
+    
+    @override_settings(MESSAGE_COMPRESSION_CODEC='zlib', MESSAGE_COMPRESSION_THRESHOLD=256)
+    def test_transparent_zlib(self):
+        """Test that large content is compressed and every read path decodes it."""
+        message = Message.objects.create(chat=self.chat, role=Message.Role.ASSISTANT, content=self.LARGE)
+        small = Message.objects.create(chat=self.chat, role=Message.Role.USER, content='short \u00e9')
+        
+        stored = self.stored_bytes(message)
+        self.assertTrue(stored.startswith(b'\xffz'))
+        self.assertLess(len(stored), len(self.LARGE) // 10)
+        self.assertEqual(self.stored_bytes(small), 'short \u00e9'.encode('utf-8'))
+        self.assertEqual(Message.objects.get(id=message.id).content, self.LARGE)
+        self.assertTrue(MessageBody.objects.filter(content=self.LARGE).exists())
+        self.assertEqual(message_rows(Message.objects.filter(id=message.id))[0]['content'], self.LARGE)
+        
+        response = self.client.get(reverse('chat-detail', kwargs={'pk': self.chat.id}))
+        self.assertEqual(response.data['messages'][-2]['content'], self.LARGE)
+        self.assertIn('decompress;dur=', response['Server-Timing'])
+    
+    @skipUnless(zstandard, 'zstandard is not installed')
+    @override_settings(MESSAGE_COMPRESSION_CODEC='zstd', MESSAGE_COMPRESSION_THRESHOLD=256)
+    def test_transparent_zstd(self):
+        """Test the zstd codec round trip."""
+        message = Message.objects.create(chat=self.chat, role=Message.Role.ASSISTANT, content=self.LARGE)
+        self.assertTrue(self.stored_bytes(message).startswith(b'\xffs'))
+        self.assertEqual(Message.objects.get(id=message.id).content, self.LARGE)
+    
+    @skipUnless(zstandard, 'zstandard is not installed')
+    def test_zstd_dictionary_survives_retraining(self):
+        """Test that values keep decoding with the dictionary named in their frame after the setting moves on."""
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        paths = []
+        for seed in ('alpha', 'omega'):
+            samples = [f'{seed} reply {i}: {self.LARGE[:300]} {seed * i}'.encode() for i in range(400)]
+            path = os.path.join(directory, f'{seed}.dict')
+            with open(path, 'wb') as f:
+                f.write(zstandard.train_dictionary(4096, samples).as_bytes())
+            paths.append(path)
+        registry = os.path.join(directory, 'registry')
+        self.addCleanup(loaded_dictionaries.clear)
+        
+        compression = dict(MESSAGE_COMPRESSION_CODEC='zstd', MESSAGE_COMPRESSION_THRESHOLD=256,
+                           MESSAGE_COMPRESSION_DICTIONARY_DIR=registry)
+        with override_settings(MESSAGE_COMPRESSION_DICTIONARY=paths[0], **compression):
+            message = Message.objects.create(chat=self.chat, role=Message.Role.ASSISTANT, content=self.LARGE)
+        self.assertTrue(self.stored_bytes(message).startswith(b'\xffd'))
+        
+        # Retrained: the old file is gone and nothing of it is cached in this process
+        os.remove(paths[0])
+        load_dictionary.cache_clear()
+        loaded_dictionaries.clear()
+        with override_settings(MESSAGE_COMPRESSION_DICTIONARY=paths[1], **compression):
+            self.assertEqual(Message.objects.get(id=message.id).content, self.LARGE)
+        self.assertEqual(len(os.listdir(registry)), 2)
+    
+    def test_background_migration_and_report(self):
+        """Test that compress_messages rewrites existing rows without touching updated_at."""
+        message = Message.objects.create(chat=self.chat, role=Message.Role.ASSISTANT, content=self.LARGE)
+        updated_at = Message.objects.get(id=message.id).updated_at
+        
+        out = StringIO()
+        with override_settings(MESSAGE_COMPRESSION_CODEC='zlib', MESSAGE_COMPRESSION_THRESHOLD=256):
+            call_command('compress_messages', batch_size=1, stdout=out)
+        
+        self.assertTrue(self.stored_bytes(message).startswith(b'\xffz'))
+        self.assertEqual(Message.objects.get(id=message.id).content, self.LARGE)
+        self.assertEqual(Message.objects.get(id=message.id).updated_at, updated_at)
+        self.assertIn('Compressed 1 message bodies', out.getvalue())
+        self.assertIn('1/3 message bodies compressed', out.getvalue())
+
+
+class ConditionalGetTests(BaseTestCase):
+    """Test ETag / Last-Modified conditional GETs on polled endpoints."""
+    
+    def assertRevalidates(self, url, queries=1):
+        """GET url, then check a conditional GET gets a 304 within the query budget; returns the ETag."""
+        first = self.client.get(url)
+        self.assertEqual(first.status_code, status.HTTP_200_OK)
+        self.assertIn('private', first['Cache-Control'])
+        self.assertIn('no-cache', first['Cache-Control'])
+        self.assertTrue(first.has_header('Last-Modified'))
+        with self.assertNumQueries(queries):
+            second = self.client.get(url, HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(second.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(second['ETag'], first['ETag'])
+        return first['ETag']
+    
+    def test_chat_list(self):
+        """Test that the chat list revalidates and changes on rename, project rename and delete."""
+        url = reverse('chat-list')
+        etag = self.assertRevalidates(url)
+        
+        self.client.patch(reverse('chat-detail', kwargs={'pk': self.chat.id}), {'name': 'Renamed'}, format='json')
+        renamed = self.assertRevalidates(url)
+        self.assertNotEqual(renamed, etag)
+        
+        self.client.patch(reverse('project-rename', kwargs={'pk': self.project.id}), {'name': 'New name'}, format='json')
+        self.assertNotEqual(self.assertRevalidates(url), renamed)
+        
+        other = Chat.objects.create(owner=self.user, name='Other')
+        before_delete = self.assertRevalidates(url)
+        self.client.delete(reverse('chat-detail', kwargs={'pk': other.id}))
+        self.assertNotEqual(self.client.get(url, HTTP_IF_NONE_MATCH=before_delete).status_code, status.HTTP_304_NOT_MODIFIED)
+    
+    def test_list_validators_run_no_count(self):
+        """Test that the list validators read the change counters instead of counting rows."""
+        for name in ['chat-list', 'project-list']:
+            with self.subTest(name=name):
+                etag = self.client.get(reverse(name))['ETag']
+                with CaptureQueriesContext(connection) as queries:
+                    self.client.get(reverse(name), HTTP_IF_NONE_MATCH=etag)
+                
+                self.assertEqual(len(queries.captured_queries), 1)
+                self.assertIn('change_counter', queries.captured_queries[0]['sql'])
+                self.assertNotIn('COUNT(', queries.captured_queries[0]['sql'])
+    
+    def test_project_list_sees_chat_count_changes(self):
+        """Test that adding a chat to a project changes the project list ETag."""
+        url = reverse('project-list')
+        etag = self.assertRevalidates(url)
+        self.client.post(reverse('project-create-chat', kwargs={'pk': self.project.id}), {'name': 'New'}, format='json')
+        
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, status.HTTP_200_OK)
+    
+    def test_chat_messages(self):
+        """Test both chat message endpoints revalidate and change when a message is added."""
+        for url in [
+            reverse('chat-messages', kwargs={'pk': self.chat.id}),
+            reverse('chat-messages', kwargs={'chat_id': self.chat.id}),
+        ]:
+            with self.subTest(url=url):
+                etag = self.assertRevalidates(url)
+                self.client.post(reverse('chat-add-message', kwargs={'pk': self.chat.id}), {'content': 'More'})
+                response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+                self.assertEqual(response.status_code, status.HTTP_200_OK)
+                self.assertNotEqual(response['ETag'], etag)
+    
+    def test_message_detail_changes_on_edit(self):
+        """Test that a message's ETag changes when it gets an edited version."""
+        url = reverse('message-detail', kwargs={'pk': self.user_message.id})
+        etag = self.assertRevalidates(url)
+        self.client.post(reverse('message-edit-message', kwargs={'pk': self.user_message.id}), {'content': 'Edited'})
+        
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, status.HTTP_200_OK)
+    
+    def test_etag_depends_on_query_string(self):
+        """Test that different pages or field sets get different ETags."""
+        url = reverse('chat-list')
+        etag = self.client.get(url)['ETag']
+        
+        self.assertNotEqual(self.client.get(url, {'fields': 'id'})['ETag'], etag)
+    
+    def test_other_users_chat_is_still_404(self):
+        """Test that validators don't leak other users' chats."""
+        other_user = User.objects.create_user(username='other', password='pass12345')
+        other_chat = Chat.objects.create(owner=other_user, name='Private')
+        response = self.client.get(reverse('chat-messages', kwargs={'pk': other_chat.id}), HTTP_IF_NONE_MATCH='*')
+        
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+class DeltaSyncTests(BaseTestCase):
+    """Test the change-log backed delta sync endpoint."""
+    
+    def sync(self, cursor=None, **params):
+        if cursor:
+            params['cursor'] = cursor
+        response = self.client.get(reverse('sync'), params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.data
+    
+    def test_first_sync_then_nothing(self):
+        """Test that a first sync returns everything and a repeat returns nothing."""
+        first = self.sync()
+        
+        self.assertEqual([p['id'] for p in first['projects']], [str(self.project.id)])
+        self.assertEqual([c['id'] for c in first['chats']], [str(self.chat.id)])
+        self.assertEqual(
+            {m['id'] for m in first['messages']}, {str(self.user_message.id), str(self.ai_message.id)}
+        )
+        
+        second = self.sync(first['cursor'])
+        self.assertEqual(second['chats'] + second['messages'] + second['projects'], [])
+        self.assertEqual(second['cursor'], first['cursor'])
+    
+    def test_only_changes_since_cursor(self):
+        """Test that updates and new rows after the cursor are returned, once each."""
+        cursor = self.sync()['cursor']
+        self.client.patch(reverse('chat-rename', kwargs={'pk': self.chat.id}), {'name': 'Renamed'}, format='json')
+        self.client.post(reverse('chat-add-message', kwargs={'pk': self.chat.id}), {'content': 'New'})
+        
+        changes = self.sync(cursor)
+        
+        self.assertEqual([c['name'] for c in changes['chats']], ['Renamed'])
+        self.assertEqual(sorted(m['role'] for m in changes['messages']), ['assistant', 'user'])
+        self.assertEqual(len(changes['branches']), 1)
+        self.assertEqual(changes['projects'], [])
+    
+    def test_tombstones(self):
+        """Test that deletions, including cascades, come back as deleted ids."""
+        cursor = self.sync()['cursor']
+        self.client.delete(reverse('chat-detail', kwargs={'pk': self.chat.id}))
+        
+        changes = self.sync(cursor)
+        
+        self.assertEqual(changes['deleted']['chats'], [str(self.chat.id)])
+        self.assertEqual(
+            set(changes['deleted']['messages']), {str(self.user_message.id), str(self.ai_message.id)}
+        )
+        self.assertEqual(changes['chats'], [])
+    
+    def test_paging_with_limit(self):
+        """Test that a small limit walks every change via has_more."""
+        seen, cursor = set(), None
+        while True:
+            page = self.sync(cursor, limit=1)
+            seen |= {m['id'] for m in page['messages']}
+            cursor = page['cursor']
+            if not page['has_more']:
+                break
+        
+        self.assertEqual(seen, {str(self.user_message.id), str(self.ai_message.id)})
+    
+    def test_other_users_and_bad_cursor(self):
+        """Test that other users' changes aren't visible and malformed cursors are rejected."""
+        other = User.objects.create_user(username='other', password='pass12345')
+        Chat.objects.create(owner=other, name='Private')
+        
+        self.assertEqual(len(self.sync()['chats']), 1)
+        self.assertEqual(self.client.get(reverse('sync'), {'cursor': 'nope'}).status_code, status.HTTP_400_BAD_REQUEST)
+    
+    def test_compaction_keeps_latest_change(self):
+        """Test that compaction removes superseded rows only."""
+        cursor = self.sync()['cursor']
+        for name in ['One', 'Two', 'Three']:
+            self.chat.name = name
+            self.chat.save()
+        call_command('compact_change_log', days=0, stdout=StringIO())
+        
+        self.assertEqual(ChangeLog.objects.filter(entity_id=self.chat.id).count(), 1)
+        self.assertEqual([c['name'] for c in self.sync(cursor)['chats']], ['Three'])
+
+
+@override_settings(METRICS_PUBLIC=True)
+class MetricsTests(BaseTestCase):
+    """Test request metrics and the Prometheus endpoint at /api/metrics."""
+    
+    def setUp(self):
+        super().setUp()
+        request_metrics.reset()
+    
+    def scrape(self, **headers):
+        response = self.client.get('/api/metrics', **headers)
+        return response, response.content.decode()
+    
+    def test_records_route_status_latency_and_work(self):
+        """Test that requests are recorded per route with latency, queries, serializer time and bytes."""
+        url = reverse('chat-detail', kwargs={'pk': self.chat.id})
+        body = self.client.get(url).content
+        self.client.get(url)
+        self.client.get(reverse('chat-detail', kwargs={'pk': uuid.uuid4()}))
+        
+        response, text = self.scrape()
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response['Content-Type'], 'text/plain; version=0.0.4; charset=utf-8')
+        labels = 'route="chat-detail",method="GET"'
+        self.assertIn(f'api_requests_total{{{labels},status="200"}} 2', text)
+        self.assertIn(f'api_requests_total{{{labels},status="404"}} 1', text)
+        self.assertIn(f'api_request_duration_seconds_bucket{{{labels},le="+Inf"}} 3', text)
+        self.assertIn(f'api_request_duration_seconds_count{{{labels}}} 3', text)
+        self.assertIn(f'api_response_bytes_total{{{labels}}} ', text)
+        
+        values = {line.rsplit(' ', 1)[0]: float(line.rsplit(' ', 1)[1]) for line in text.splitlines() if not line.startswith('#')}
+        self.assertGreaterEqual(values[f'api_response_bytes_total{{{labels}}}'], 2 * len(body))
+        # Two detail reads of two queries each, and a miss of one
+        self.assertEqual(values[f'api_request_db_queries_total{{{labels}}}'], 5)
+        self.assertGreater(values[f'api_request_db_seconds_total{{{labels}}}'], 0)
+        self.assertGreater(values[f'api_request_serializer_seconds_total{{{labels}}}'], 0)
+    
+    def test_histogram_buckets_are_cumulative(self):
+        """Test that latencies land in the first bucket at or above them, cumulatively."""
+        for duration in (0.001, 0.005, 0.3, 20):
+            request_metrics.observe('chat-list', 'GET', 200, duration, 0, 0.0, 0.0, 0)
+        
+        _, text = self.scrape()
+        bucket = 'api_request_duration_seconds_bucket{route="chat-list",method="GET",le="%s"} %d'
+        for le, count in [('0.005', 2), ('0.25', 2), ('0.5', 3), ('10.0', 3), ('+Inf', 4)]:
+            self.assertIn(bucket % (le, count), text)
+    
+    def test_sums_workers_through_metrics_dir(self):
+        """Test that with METRICS_DIR each worker's totals are written there and summed on scrape."""
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        with override_settings(METRICS_DIR=directory):
+            other_worker = RequestMetrics()
+            other_worker.observe('chat-list', 'GET', 200, 0.01, 4, 0.002, 0.001, 100)
+            other_worker.observe('chat-list', 'GET', 500, 0.01, 1, 0.001, 0.0, 50)
+            request_metrics.observe('chat-list', 'GET', 200, 0.01, 2, 0.001, 0.001, 10)
+            # The other worker's second request is written at its next flush
+            other_worker.flush()
+            
+            _, text = self.scrape()
+        
+        # One file per worker
+        self.assertEqual(len(list(Path(directory).glob('metrics-*.json'))), 2)
+        self.assertIn('api_requests_total{route="chat-list",method="GET",status="200"} 2', text)
+        self.assertIn('api_requests_total{route="chat-list",method="GET",status="500"} 1', text)
+        self.assertIn('api_request_db_queries_total{route="chat-list",method="GET"} 7', text)
+        self.assertIn('api_response_bytes_total{route="chat-list",method="GET"} 160', text)
+    
+    def test_exited_workers_fold_into_archive(self):
+        """Test that retired and dead workers' files are folded into one archive without changing the sums."""
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        with override_settings(METRICS_DIR=directory):
+            retired, killed = RequestMetrics(), RequestMetrics()
+            retired.observe('chat-list', 'GET', 200, 0.01, 1, 0.001, 0.0, 10)
+            retired.retire()
+            killed.observe('chat-list', 'GET', 200, 0.01, 2, 0.001, 0.0, 20)
+            # A worker killed before it could retire leaves its file behind, under a pid above pid_max
+            os.rename(Path(directory) / killed.file_name, Path(directory) / f'metrics-{2 ** 22 + 1}-dead.json')
+            
+            _, text = self.scrape()
+            _, again = self.scrape()
+        
+        # Only the live worker (this process, after the first scrape) keeps a file of its own
+        remaining = {path.name for path in Path(directory).glob('metrics-*.json')}
+        self.assertEqual(remaining, {'metrics-archive.json', request_metrics.file_name})
+        # Folding doesn't move the sums, on the scrape that folds or after it
+        for scraped in (text, again):
+            self.assertIn('api_requests_total{route="chat-list",method="GET",status="200"} 2', scraped)
+            self.assertIn('api_response_bytes_total{route="chat-list",method="GET"} 30', scraped)
+    
+    @override_settings(METRICS_PUBLIC=False)
+    def test_private_without_token(self):
+        """Test that without METRICS_TOKEN the endpoint is hidden unless METRICS_PUBLIC is set."""
+        self.assertEqual(self.scrape()[0].status_code, status.HTTP_404_NOT_FOUND)
+    
+    @override_settings(METRICS_TOKEN='scrape-secret', METRICS_PUBLIC=False)
+    def test_token_required_when_configured(self):
+        """Test that METRICS_TOKEN must be presented as a Bearer token."""
+        self.assertEqual(self.scrape()[0].status_code, status.HTTP_401_UNAUTHORIZED)
+        self.assertEqual(self.scrape(HTTP_AUTHORIZATION='Bearer wrong')[0].status_code, status.HTTP_401_UNAUTHORIZED)
+        self.assertEqual(self.scrape(HTTP_AUTHORIZATION='Bearer scrape-secret')[0].status_code, status.HTTP_200_OK)
+
+
+class QueryBudgetTests(BaseTestCase):
+    """Test per-view query budgets and repeated-query (N+1) detection."""
+    
+    def test_fingerprint_strips_literals(self):
+        """Test that queries differing only in their values share a fingerprint."""
+        self.assertEqual(
+            fingerprint("SELECT * FROM chats WHERE id = 'a1' AND n IN (1, 2,  3)"),
+            fingerprint("SELECT *  FROM chats WHERE id = 'b2' AND n IN (4)"),
+        )
+        self.assertNotEqual(fingerprint('SELECT * FROM chats'), fingerprint('SELECT * FROM messages'))
+    
+    def test_repeated_query_shape_is_flagged(self):
+        """Test that a query per row is reported even within the total budget."""
+        for i in range(3):
+            Message.objects.create(chat=self.chat, role=Message.Role.USER, content=f'Row {i}')
+        with record_queries() as recorder:
+            for message_id in Message.objects.values_list('id', flat=True):
+                Message.objects.get(id=message_id)
+        
+        problems = budget_violations(recorder, 100, settings.QUERY_BUDGET_DUPLICATE_LIMIT)
+        self.assertEqual(len(problems), 1)
+        self.assertIn('repeated 5 times', problems[0])
+    
+    def test_count_only_recorder_keeps_no_sql(self):
+        """Test that the metrics recorder counts and times statements without holding on to them."""
+        with record_queries(keep_statements=False) as recorder:
+            list(Message.objects.all())
+            Chat.objects.count()
+        
+        self.assertEqual(recorder.count, 2)
+        self.assertGreater(recorder.seconds, 0)
+        self.assertIsNone(recorder.statements)
+    
+    @override_settings(QUERY_BUDGET_AUTH_ALLOWANCE=0)
+    def test_over_budget_raises_in_tests(self):
+        """Test that an endpoint over its declared budget fails the request."""
+        url = reverse('chat-detail', kwargs={'pk': self.chat.id})
+        with patch.dict(ChatViewSet.query_budgets, {'retrieve': 1}):
+            with self.assertRaisesMessage(QueryBudgetExceeded, 'ChatViewSet.retrieve'):
+                self.client.get(url)
+        self.assertEqual(self.client.get(url).status_code, status.HTTP_200_OK)
+    
+    @override_settings(QUERY_BUDGET_MODE='log', QUERY_BUDGET_AUTH_ALLOWANCE=0)
+    def test_log_mode_warns(self):
+        """Test that log mode serves the response and logs the overrun."""
+        url = reverse('chat-detail', kwargs={'pk': self.chat.id})
+        with patch.dict(ChatViewSet.query_budgets, {'retrieve': 1}), self.assertLogs('api.middleware', 'WARNING') as logs:
+            response = self.client.get(url)
+        
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn('budget is 1', logs.output[0])
+
+
+class DetailRouteQueryTests(BaseTestCase):
+    """Test that every detail route resolves ownership from its queryset, within a fixed query budget."""
+    
+    def setUp(self):
+        super().setUp()
+        self.user_settings = UserSettings.objects.create(user=self.user, settings={'theme': 'dark'})
+        add_url = reverse('chat-add-message', kwargs={'pk': self.chat.id})
+        self.client.post(add_url, {'content': 'Graph question'}, format='json')
+        self.head_id = Branch.objects.get(chat=self.chat).head_message_id
+    
+    def assertRouteQueries(self, budget, method, name, pk, data=None, query=''):
+        url = reverse(name, kwargs={'pk': pk}) + query
+        with CaptureQueriesContext(connection) as queries:
+            response = getattr(self.client, method)(url, data, format='json')
+        sql = [q['sql'] for q in queries]
+        self.assertLess(response.status_code, 300, f"{method.upper()} {url}: {response.content[:200]}")
+        # Ownership comes from owner ids already on the rows, never from loading the user or chat
+        self.assertFalse([q for q in sql if 'FROM "auth_user"' in q], url)
+        self.assertEqual(len(sql), budget, f"{method.upper()} {url}\n" + "\n".join(sql))
+    
+    def test_profile_routes(self):
+        """Test profile detail routes: the nested user is joined, not fetched."""
+        pk = self.user_profile.id
+        self.assertRouteQueries(1, 'get', 'profile-detail', pk)
+        self.assertRouteQueries(2, 'patch', 'profile-detail', pk, {'bio': 'Changed'})
+        self.assertRouteQueries(2, 'delete', 'profile-detail', pk)
+    
+    def test_project_routes(self):
+        """Test project detail routes."""
+        pk = self.project.id
+        self.assertRouteQueries(2, 'get', 'project-detail', pk)
+        self.assertRouteQueries(2, 'patch', 'project-detail', pk, {'name': 'Renamed'})
+        self.assertRouteQueries(2, 'patch', 'project-rename', pk, {'name': 'Renamed again'})
+        self.assertRouteQueries(2, 'get', 'project-chats', pk)
+        self.assertRouteQueries(5, 'post', 'project-create-chat', pk, {'name': 'Side chat'})
+        side_chat = Chat.objects.get(name='Side chat')
+        self.assertRouteQueries(9, 'delete', 'project-delete-chat', pk, {'chat_id': str(side_chat.id)})
+        # Cascades through the project's chat, its messages, bodies and branch
+        self.assertRouteQueries(15, 'delete', 'project-detail', pk)
+    
+    def test_chat_routes(self):
+        """Test chat detail routes."""
+        pk = self.chat.id
+        self.assertRouteQueries(2, 'get', 'chat-detail', pk)
+        self.assertRouteQueries(4, 'patch', 'chat-detail', pk, {'name': 'Renamed'})
+        self.assertRouteQueries(2, 'patch', 'chat-rename', pk, {'name': 'Renamed again'})
+        self.assertRouteQueries(5, 'patch', 'chat-update-status', pk, {'status': 'archived'})
+        self.assertRouteQueries(3, 'get', 'chat-messages', pk)
+        self.assertRouteQueries(13, 'post', 'chat-add-message', pk, {'content': 'Another question'})
+        self.assertRouteQueries(13, 'delete', 'chat-detail', pk)
+    
+    def test_message_routes(self):
+        """Test message detail routes: the chat's owner id is annotated, so the chat is never loaded."""
+        pk = self.user_message.id
+        self.assertRouteQueries(3, 'get', 'message-detail', pk)
+        self.assertRouteQueries(6, 'patch', 'message-detail', pk, {'content': 'Changed'})
+        self.assertRouteQueries(11, 'post', 'message-edit-message', pk, {'content': 'Edited'})
+        self.assertRouteQueries(8, 'delete', 'message-detail', pk)
+    
+    def test_settings_routes(self):
+        """Test settings detail routes."""
+        pk = self.user_settings.id
+        self.assertRouteQueries(1, 'get', 'settings-detail', pk)
+        self.assertRouteQueries(2, 'patch', 'settings-detail', pk, {'settings': {'theme': 'light'}})
+        self.assertRouteQueries(2, 'delete', 'settings-detail', pk)
+    
+    def test_chat_graph_routes(self):
+        """Test chat graph detail routes."""
+        pk = self.chat.id
+        self.assertRouteQueries(1, 'get', 'chat-graph-graph-heads', pk)
+        self.assertRouteQueries(2, 'get', 'chat-graph-branch-chain', pk, query=f'?head_id={self.head_id}')
+        self.assertRouteQueries(2, 'get', 'chat-graph-branches', pk)
+        self.assertRouteQueries(2, 'get', 'chat-graph-siblings', pk, query=f'?message_id={self.head_id}')
+        self.assertRouteQueries(2, 'get', 'chat-graph-search', pk, query=f'?head_id={self.head_id}&q=graph')
+    
+    def test_permission_compares_owner_ids(self):
+        """Test that IsOwnerOrReadOnly refuses writes to other users' objects without querying."""
+        permission = IsOwnerOrReadOnly()
+        patch_request = SimpleNamespace(method='PATCH', user=self.other_user)
+        message = Message.objects.annotate(chat_owner_id=F('chat__owner_id')).get(pk=self.user_message.pk)
+        
+        with self.assertNumQueries(0):
+            self.assertFalse(permission.has_object_permission(patch_request, None, self.project))
+            self.assertFalse(permission.has_object_permission(patch_request, None, message))
+            self.assertTrue(permission.has_object_permission(SimpleNamespace(method='PATCH', user=self.user), None, message))
+            self.assertTrue(permission.has_object_permission(SimpleNamespace(method='GET', user=self.other_user), None, message))
+        # Without the annotation it costs one narrow lookup
+        unannotated = Message.objects.get(pk=self.user_message.pk)
+        with self.assertNumQueries(1):
+            self.assertFalse(permission.has_object_permission(patch_request, None, unannotated))
+
+
+class RegistrationTests(BaseTestCase):
+    """Test transactional registration and bulk provisioning."""
+    
+    def register(self, **overrides):
+        data = {'username': 'newuser', 'email': 'new@example.com', 'password': 'a-long-passphrase-42'}
+        data.update(overrides)
+        return self.client.post(reverse('user_register'), data, format='json')
+    
+    def test_register_creates_user_and_profile_without_lookups(self):
+        """Test that registration writes the user and profile without checking for conflicts first."""
+        with CaptureQueriesContext(connection) as queries:
+            response = self.register(display_name='New')
+        
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.json()['profile']['display_name'], 'New')
+        self.assertFalse([q for q in queries if q['sql'].startswith('SELECT') and 'auth_user' in q['sql']])
+        self.assertTrue(User.objects.get(username='newuser').check_password('a-long-passphrase-42'))
+    
+    def test_conflicts_are_reported_by_field(self):
+        """Test that a taken username or email (in any case) is a 400 naming the field."""
+        self.assertContains(self.register(username='testuser'), 'Username already exists', status_code=400)
+        self.assertContains(self.register(email='TEST@example.com'), 'Email already exists', status_code=400)
+        self.assertFalse(User.objects.filter(username='newuser').exists())
+    
+    def test_failure_rolls_back_the_user(self):
+        """Test that a failure after the user is inserted leaves no half-registered account."""
+        with patch.object(UserProfile.objects, 'create', side_effect=RuntimeError('boom')):
+            with self.assertRaises(RuntimeError):
+                self.register()
+        self.assertFalse(User.objects.filter(username='newuser').exists())
+    
+    def test_provision_fixture_users(self):
+        """Test that --count creates users, profiles and settings sharing one hashed password."""
+        with CaptureQueriesContext(connection) as queries:
+            call_command('provision_users', count=25, password='fixture-pass', batch_size=10, stdout=StringIO())
+        self.assertEqual(len([q for q in queries if q['sql'].startswith('INSERT')]), 9)
+        
+        users = User.objects.filter(username__startswith='loadtest')
+        self.assertEqual(users.count(), 25)
+        self.assertEqual(UserProfile.objects.filter(user__in=users).count(), 25)
+        self.assertEqual(UserSettings.objects.filter(user__in=users).count(), 25)
+        self.assertTrue(users.get(username='loadtest7').check_password('fixture-pass'))
+    
+    def test_provision_from_csv_skips_conflicts(self):
+        """Test CSV provisioning with pre-hashed passwords, skipping taken and invalid rows."""
+        password_hash = make_password('imported-pass')
+        path = os.path.join(tempfile.mkdtemp(), 'users.csv')
+        self.addCleanup(shutil.rmtree, os.path.dirname(path))
+        with open(path, 'w') as f:
+            f.write('username,email,display_name,password_hash\n')
+            f.write(f'alice,alice@example.com,Alice,{password_hash}\n')
+            f.write('bob,bob@example.com,,\n')
+            f.write('testuser,fresh@example.com,,\n')
+            f.write('carol,Test@Example.com,,\n')
+            f.write('dave,dave@example.com,,not-a-hash\n')
+            f.write('alice,alice2@example.com,,\n')
+        out = StringIO()
+        
+        call_command('provision_users', path, stdout=out)
+        self.assertIn('Provisioned 2 users (4 skipped)', out.getvalue())
+        self.assertTrue(User.objects.get(username='alice').check_password('imported-pass'))
+        self.assertEqual(User.objects.get(username='alice').profile.display_name, 'Alice')
+        self.assertFalse(User.objects.get(username='bob').has_usable_password())
+
+
+class TokenRevocationTests(BaseTestCase):
+    """Test refresh rotation, logout and the bloom-filtered revocation check."""
+    
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+        self.refresh = RefreshToken.for_user(self.user)
+        self.access = self.refresh.access_token
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {self.access}')
+    
+    def refresh_with(self, token):
+        return self.client.post(reverse('token_refresh'), {'refresh': str(token)}, format='json')
+    
+    def test_rotation_revokes_the_old_refresh_token(self):
+        """Test that a refresh token works once and is refused when replayed."""
+        response = self.refresh_with(self.refresh)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn('refresh', response.json())
+        
+        self.assertEqual(self.refresh_with(self.refresh).status_code, status.HTTP_401_UNAUTHORIZED)
+        self.assertEqual(self.refresh_with(response.json()['refresh']).status_code, status.HTTP_200_OK)
+        self.assertTrue(RevokedToken.objects.filter(jti=self.refresh['jti'], token_type='refresh').exists())
+    
+    def test_logout_revokes_both_tokens(self):
+        """Test that after logout neither the access nor the refresh token is accepted."""
+        self.assertEqual(self.client.get(reverse('chat-list')).status_code, status.HTTP_200_OK)
+        
+        response = self.client.post(reverse('logout'), {'refresh': str(self.refresh)}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(self.client.get(reverse('chat-list')).status_code, status.HTTP_401_UNAUTHORIZED)
+        self.client.credentials()
+        self.assertEqual(self.refresh_with(self.refresh).status_code, status.HTTP_401_UNAUTHORIZED)
+    
+    def test_logout_rejects_another_users_token(self):
+        """Test that a user can't revoke someone else's refresh token."""
+        response = self.client.post(reverse('logout'), {'refresh': str(RefreshToken.for_user(self.other_user))}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(RevokedToken.objects.exists())
+    
+    @override_settings(TOKEN_REVOCATION_SYNC_INTERVAL=3600)
+    def test_unrevoked_tokens_cost_no_query(self):
+        """Test that the common path is answered by the bloom filter alone."""
+        revoke_token(RefreshToken.for_user(self.user))
+        revocation_filter.refresh(force=True)
+        
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.client.get(reverse('chat-list')).status_code, status.HTTP_200_OK)
+        self.assertFalse([q for q in queries if 'revoked_tokens' in q['sql']])
+    
+    @override_settings(TOKEN_REVOCATION_SYNC_INTERVAL=3600)
+    def test_filter_matches_are_confirmed_against_the_table(self):
+        """Test that a bloom false positive costs one query but doesn't reject the token."""
+        revocation_filter.refresh(force=True)
+        
+        with patch.object(BloomFilter, '__contains__', return_value=True), CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.client.get(reverse('chat-list')).status_code, status.HTTP_200_OK)
+        self.assertEqual(len([q for q in queries if 'revoked_tokens' in q['sql']]), 1)
+    
+    def test_sync_picks_up_revocations_from_other_processes(self):
+        """Test that rows written elsewhere reach this process's filter at the next sync."""
+        revocation_filter.refresh(force=True)
+        RevokedToken.objects.create(
+            jti=self.access['jti'], user=self.user, token_type='access', expires_at=timezone.now() + timedelta(hours=1)
+        )
+        
+        revocation_filter.next_sync = 0
+        self.assertEqual(self.client.get(reverse('chat-list')).status_code, status.HTTP_401_UNAUTHORIZED)
+    
+    def test_revocation_during_rebuild_reaches_the_new_filter(self):
+        """Test that a token revoked after a rebuild read the table is still in the filter it swaps in."""
+        revoked = RefreshToken.for_user(self.user)
+        
+        class RevokedMidRebuild(BloomFilter):
+            def __init__(self, *args):
+                super().__init__(*args)
+                if not getattr(RevokedMidRebuild, 'done', False):
+                    RevokedMidRebuild.done = True
+                    revoke_token(revoked)
+        
+        with patch('api.utils_revocation.BloomFilter', RevokedMidRebuild):
+            revocation_filter.refresh(force=True)
+        
+        self.assertIn(revoked['jti'], revocation_filter.bloom)
+    
+    def test_bloom_filter_has_no_false_negatives(self):
+        """Test the filter's guarantees: every added item matches, few others do."""
+        bloom = BloomFilter(1000, 0.001)
+        for i in range(1000):
+            bloom.add(f'added-{i}')
+        
+        self.assertTrue(all(f'added-{i}' in bloom for i in range(1000)))
+        self.assertLess(sum(f'other-{i}' in bloom for i in range(10000)), 50)
+    
+    def test_purge_removes_expired_revocations(self):
+        """Test that purge_revoked_tokens keeps only revocations of unexpired tokens."""
+        revoke_token(self.refresh)
+        RevokedToken.objects.create(jti='expired', user=self.user, token_type='access', expires_at=timezone.now())
+        
+        call_command('purge_revoked_tokens', stdout=StringIO())
+        self.assertEqual(list(RevokedToken.objects.values_list('jti', flat=True)), [self.refresh['jti']])
+
+
+class LoginTests(BaseTestCase):
+    """Test email login through the lower(email) index."""
+    
+    def login(self, email, password='testpass123'):
+        return self.client.post(reverse('token_obtain_pair'), {'email': email, 'password': password}, format='json')
+    
+    def test_login_ignores_email_case(self):
+        """Test that the email matches case-insensitively and the response shape is unchanged."""
+        response = self.login('TEST@Example.COM')
+        
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json()['user'], {'id': self.user.id, 'username': 'testuser', 'email': 'test@example.com'})
+        self.assertIn('access', response.json())
+    
+    def test_login_is_one_indexed_user_query(self):
+        """Test that the user is found with a single query on the indexed lower(email) expression."""
+        with CaptureQueriesContext(connection) as queries:
+            self.login('test@example.com')
+        user_queries = [q['sql'] for q in queries if 'FROM "auth_user"' in q['sql']]
+        
+        self.assertEqual(len(user_queries), 1)
+        self.assertIn('LOWER("auth_user"."email")', user_queries[0])
+        # The submitted email is lowered by the database too, with the index's case mapping
+        self.assertRegex(user_queries[0], r"= \(?LOWER\('test@example\.com'(::text)?\)")
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT indexdef FROM pg_indexes WHERE indexname = 'auth_user_email_lower_uniq'")
+            self.assertIn('lower((email)::text)', cursor.fetchone()[0])
+    
+    def test_default_hashes_still_verify(self):
+        """Test that hashes from Django's default bcrypt and scrypt hashers are still accepted."""
+        for algorithm in ['bcrypt_sha256', 'scrypt']:
+            with self.subTest(algorithm=algorithm):
+                try:
+                    encoded = make_password('legacy-pass', hasher=algorithm)
+                except ValueError:
+                    self.skipTest(f'{algorithm} library not installed')
+                self.assertTrue(check_password('legacy-pass', encoded))
+    
+    def test_bad_credentials_are_rejected(self):
+        """Test that a wrong password, an unknown email and an inactive user all fail."""
+        self.assertContains(self.login('test@example.com', 'wrong'), 'Incorrect password', status_code=400)
+        self.assertContains(self.login('nobody@example.com'), 'No account found', status_code=400)
+        
+        self.user.is_active = False
+        self.user.save()
+        self.assertEqual(self.login('test@example.com').status_code, status.HTTP_400_BAD_REQUEST)
+    
+    def test_email_is_unique_ignoring_case(self):
+        """Test that the index rejects a second account whose email differs only in case."""
+        User.objects.create_user(username='blank1', email='')
+        User.objects.create_user(username='blank2', email='')
+        
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            User.objects.create_user(username='other', email='Test@Example.com')
+    
+    @skipUnless(argon2, "argon2-cffi is not installed")
+    def test_login_upgrades_password_hash(self):
+        """Test that logging in re-hashes an old hash with the preferred hasher."""
+        with override_settings(PASSWORD_HASHERS=['api.hashers.Argon2idPasswordHasher', 'django.contrib.auth.hashers.PBKDF2PasswordHasher']):
+            self.assertEqual(self.login('test@example.com').status_code, status.HTTP_200_OK)
+        
+        self.user.refresh_from_db()
+        self.assertTrue(self.user.password.startswith('argon2$argon2id$v=19$m=19456,t=2,p=1$'))
+        self.assertEqual(self.login('test@example.com').status_code, status.HTTP_200_OK)
+
+
+@override_settings(AUTH_PRINCIPAL_CACHE_TIMEOUT=60)
+class CachedAuthenticationTests(BaseTestCase):
+    """Test JWT authentication through the cached user principal."""
+    
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {RefreshToken.for_user(self.user).access_token}')
+    
+    def auth_queries(self, path):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(path)
+        return response, [q['sql'] for q in queries if 'FROM "auth_user"' in q['sql']]
+    
+    def test_warm_cache_reads_need_no_auth_queries(self):
+        """Test that once the principal is cached, read endpoints never touch auth_user."""
+        self.client.get(reverse('chat-list'))
+        
+        for path in (reverse('chat-list'), reverse('project-list'), reverse('chat-detail', kwargs={'pk': self.chat.id})):
+            response, queries = self.auth_queries(path)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual(queries, [], path)
+    
+    def test_deactivation_and_deletion_take_effect(self):
+        """Test that saving or deleting the user invalidates the cached principal."""
+        self.client.get(reverse('chat-list'))
+        
+        self.user.is_active = False
+        self.user.save()
+        self.assertEqual(self.client.get(reverse('chat-list')).status_code, status.HTTP_401_UNAUTHORIZED)
+        
+        self.user.is_active = True
+        self.user.save()
+        self.assertEqual(self.client.get(reverse('chat-list')).status_code, status.HTTP_200_OK)
+        
+        self.user.delete()
+        self.assertEqual(self.client.get(reverse('chat-list')).status_code, status.HTTP_401_UNAUTHORIZED)
+    
+    @override_settings(AUTH_PRINCIPAL_CACHE_TIMEOUT=0)
+    def test_unshared_cache_reads_principal_every_request(self):
+        """Test that without a shared cache each request reads the principal, so even updates skipping signals apply."""
+        for _ in range(2):
+            response, queries = self.auth_queries(reverse('chat-list'))
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual(len(queries), 1)
+            self.assertNotIn('"auth_user"."password"', queries[0])
+        
+        User.objects.filter(pk=self.user.pk).update(is_active=False)
+        self.assertEqual(self.client.get(reverse('chat-list')).status_code, status.HTTP_401_UNAUTHORIZED)
+    
+    def test_principal_loads_other_fields_lazily(self):
+        """Test that the principal behaves like a User and saves only what it loaded."""
+        principal = get_principal(self.user.id)
+        
+        with self.assertNumQueries(0):
+            self.assertEqual((principal.pk, principal.username, principal.is_active), (self.user.id, 'testuser', True))
+        self.assertEqual(principal.email, 'test@example.com')
+        principal.first_name = 'Changed'
+        principal.save()
+        
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.first_name, 'Changed')
+        self.assertTrue(self.user.check_password('testpass123'))
+
+
+class BranchSearchTests(BaseTestCase):
+    """Test full-text search restricted to one branch of a forked chat."""
+    
+    def setUp(self):
+        super().setUp()
+        self.chat = Chat.objects.create(owner=self.user, name='Forked Chat', message_graph={})
+        first = self.add_message('kubernetes deploy plan')
+        self.second = self.add_message('kubernetes rollback steps')
+        edit = self.client.post(
+            reverse('message-edit-message', kwargs={'pk': self.second['user_message']['id']}),
+            {'content': 'kubernetes canary release'}, format='json'
+        ).data
+        self.edited_id, self.edit_head = edit['id'], edit['ai_message']['id']
+        self.first_id = first['user_message']['id']
+    
+    def add_message(self, content):
+        return self.client.post(reverse('chat-add-message', kwargs={'pk': self.chat.id}), {'content': content}).data
+    
+    def branch_search(self, head_id, text):
+        url = reverse('chat-graph-search', kwargs={'pk': self.chat.id})
+        return self.client.get(url, {'head_id': head_id, 'q': text})
+    
+    def test_parent_links_mirror_graph(self):
+        """Test that add_message and edit_message keep Message.parent in step with the graph."""
+        self.chat.refresh_from_db()
+        parents = {str(pk): str(parent) if parent else None for pk, parent in
+                   Message.objects.filter(chat=self.chat).values_list('id', 'parent_id')}
+        
+        self.assertEqual(parents, {pk: node['parent'] for pk, node in self.chat.message_graph.items()})
+    
+    def test_only_matches_on_branch(self):
+        """Test that each head only sees matches on its own chain."""
+        original_head = self.second['ai_message']['id']
+        
+        original = {m['id'] for m in self.branch_search(original_head, 'kubernetes').data['messages']}
+        edited = {m['id'] for m in self.branch_search(self.edit_head, 'kubernetes').data['messages']}
+        
+        self.assertIn(self.second['user_message']['id'], original)
+        self.assertNotIn(self.edited_id, original)
+        self.assertIn(self.edited_id, edited)
+        self.assertNotIn(self.second['user_message']['id'], edited)
+        self.assertIn(self.first_id, original & edited)
+        self.assertEqual([m['id'] for m in self.branch_search(self.edit_head, 'canary').data['messages']][0], self.edited_id)
+    
+    def test_deep_chain_in_one_query(self):
+        """Test that a match at the root of a deep chain is found with a single search query."""
+        chain = Chat.objects.create(owner=self.user, name='Deep Chat')
+        parent = Message.objects.create(chat=chain, content='the walrus at the root')
+        for i in range(300):
+            parent = Message.objects.create(chat=chain, content=f'step {i}', parent=parent)
+        url = reverse('chat-graph-search', kwargs={'pk': chain.id})
+        
+        # One query for the chat, one for the search
+        with self.assertNumQueries(2):
+            response = self.client.get(url, {'head_id': parent.id, 'q': 'walrus'})
+        
+        self.assertEqual([m['content'] for m in response.data['messages']], ['the walrus at the root'])
+    
+    def test_validation_and_permissions(self):
+        """Test that missing params are rejected and other users' chats are hidden."""
+        self.assertEqual(self.branch_search(self.edit_head, '').status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.branch_search('nope', 'kubernetes').status_code, status.HTTP_400_BAD_REQUEST)
+        other_chat = Chat.objects.create(owner=self.other_user, name='Other Chat')
+        url = reverse('chat-graph-search', kwargs={'pk': other_chat.id})
+        response = self.client.get(url, {'head_id': self.edit_head, 'q': 'kubernetes'})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+@skipUnless(numpy, "numpy is not installed")
+class SemanticSearchTests(BaseTestCase):
+    """Test semantic message search over the per-user nearest-neighbour index."""
+    
+    def setUp(self):
+        super().setUp()
+        index_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, index_dir, ignore_errors=True)
+        settings_override = override_settings(SEMANTIC_SEARCH_ENABLED=True, SEMANTIC_INDEX_DIR=index_dir)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+    
+    def semantic_search(self, text):
+        response = self.client.get(reverse('semantic-search'), {'q': text})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return [hit['id'] for hit in response.json()['results']]
+    
+    def test_embedder_is_deterministic_and_normalised(self):
+        """Test that the hashing embedder gives the same unit vectors every time."""
+        embedder = get_embedder()
+        first, second = embedder.embed(['tuning postgres autovacuum', 'tuning postgres autovacuum'])
+        
+        self.assertTrue(numpy.array_equal(first, second))
+        self.assertAlmostEqual(float(numpy.linalg.norm(first)), 1.0, places=5)
+    
+    def test_add_message_is_indexed_incrementally(self):
+        """Test that messages from add_message are searchable without a rebuild."""
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(
+                reverse('chat-add-message', kwargs={'pk': self.chat.id}),
+                {'content': 'How should I tune postgres autovacuum thresholds?'}
+            )
+        
+        hits = self.semantic_search('postgres autovacuum tuning')
+        
+        self.assertEqual(hits[0], response.data['user_message']['id'])
+    
+    def test_rebuild_and_stale_hits(self):
+        """Test build_semantic_index, and that edited, deleted and other users' messages drop out."""
+        other_chat = Chat.objects.create(owner=self.other_user, name='Other Chat')
+        Message.objects.create(chat=other_chat, role=Message.Role.USER, content='Hello, this is a user message')
+        self.assertEqual(self.semantic_search('hello user message'), [])
+        
+        call_command('build_semantic_index', stdout=StringIO())
+        
+        self.assertEqual(self.semantic_search('hello user message')[0], str(self.user_message.id))
+        self.user_message.content = 'Something else entirely'
+        self.user_message.save()
+        self.ai_message.delete()
+        self.assertEqual(self.semantic_search('hello user message'), [])
+        
+        # Garbage-collected bodies take their embeddings with them
+        call_command('gc_message_bodies', stdout=StringIO())
+        self.assertEqual(MessageEmbedding.objects.filter(body__ref_count=0).count(), 0)
+        self.assertTrue(MessageEmbedding.objects.exists())
+    
+    def test_ivf_recall_against_brute_force(self):
+        """Test that probing a few IVF lists finds nearly all of the exact top 10."""
+        rng = numpy.random.default_rng(1)
+        centers = rng.normal(size=(40, 32))
+        vectors = (centers[rng.integers(0, 40, 4000)] + rng.normal(scale=0.6, size=(4000, 32))).astype(numpy.float32)
+        vectors /= numpy.linalg.norm(vectors, axis=1, keepdims=True)
+        index = SemanticIndex(tempfile.mkdtemp(dir=settings.SEMANTIC_INDEX_DIR), 32)
+        keys = SemanticIndex.make_keys([(uuid.UUID(int=i), f'{i:064x}') for i in range(len(vectors))])
+        with index.lock():
+            index.build(keys, vectors, lists=60)
+        
+        found = 0
+        for query in vectors[:50]:
+            exact = {uuid.UUID(int=int(i)) for i in numpy.argsort(-(vectors @ query))[:10]}
+            found += len(exact & {hit[0] for hit in index.search(query, 10, nprobe=8)})
+        
+        self.assertGreaterEqual(found / 500, 0.9)
+    
+    def test_delta_merge_keeps_newest_row(self):
+        """Test that merging the delta keeps one row per message, the latest one."""
+        index = SemanticIndex(tempfile.mkdtemp(dir=settings.SEMANTIC_INDEX_DIR), 4)
+        message = uuid.uuid4()
+        index.add(SemanticIndex.make_keys([(message, '0' * 64)]), numpy.array([[1, 0, 0, 0]], dtype=numpy.float32))
+        index.add(SemanticIndex.make_keys([(message, '1' * 64)]), numpy.array([[0, 1, 0, 0]], dtype=numpy.float32))
+        
+        index.merge()
+        
+        self.assertEqual(len(index.load_delta()), 0)
+        self.assertEqual(index.search(numpy.array([0, 1, 0, 0], dtype=numpy.float32), 5, 1), [(message, '1' * 64, 1.0)])
+    
+    def test_rows_added_during_merge_stay_in_delta(self):
+        """Test that rows appended while a merge rebuilds the base survive it, in the delta."""
+        index = SemanticIndex(tempfile.mkdtemp(dir=settings.SEMANTIC_INDEX_DIR), 4)
+        merged, late = uuid.uuid4(), uuid.uuid4()
+        index.add(SemanticIndex.make_keys([(merged, '0' * 64)]), numpy.array([[1, 0, 0, 0]], dtype=numpy.float32))
+        write_generation = index.write_generation
+        
+        def add_while_writing(*args):
+            index.add(SemanticIndex.make_keys([(late, '1' * 64)]), numpy.array([[0, 1, 0, 0]], dtype=numpy.float32))
+            return write_generation(*args)
+        
+        with patch.object(index, 'write_generation', add_while_writing):
+            index.merge()
+        
+        self.assertEqual(len(index.load_delta()), 1)
+        self.assertEqual([hit[0] for hit in index.search(numpy.array([1, 0.5, 0, 0], dtype=numpy.float32), 5, 1)], [merged, late])
+    
+    @override_settings(SEMANTIC_INDEX_DELTA_MAX=1)
+    def test_add_message_merges_off_request(self):
+        """Test that a full delta is merged on the background merge thread, not the request's."""
+        merge_threads = []
+        with patch.object(SemanticIndex, 'merge', lambda index: merge_threads.append(threading.current_thread().name)):
+            with self.captureOnCommitCallbacks(execute=True):
+                self.client.post(reverse('chat-add-message', kwargs={'pk': self.chat.id}), {'content': 'Hello'})
+            merge_executor.submit(lambda: None).result()
+        
+        self.assertEqual(len(merge_threads), 1)
+        self.assertTrue(merge_threads[0].startswith('semantic-merge'))
+    
+    def test_disabled(self):
+        """Test that the endpoint reports when semantic search is off."""
+        with override_settings(SEMANTIC_SEARCH_ENABLED=False):
+            response = self.client.get(reverse('semantic-search'), {'q': 'anything'})
+        self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+
+
+class QuickSearchTests(BaseTestCase):
+    """Test as-you-type search over project and chat names."""
+    
+    def setUp(self):
+        super().setUp()
+        self.k8s_project = Project.objects.create(owner=self.user, name='Kubernetes Migration')
+        self.k8s_chat = Chat.objects.create(owner=self.user, name='Planning the rollout', description='kubernetes cluster upgrade')
+        Chat.objects.create(owner=self.other_user, name='Kubernetes for someone else')
+    
+    def quick_search(self, text, **params):
+        response = self.client.get(reverse('quick-search'), {'q': text, **params})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.json()
+    
+    def test_prefix_and_description_matches(self):
+        """Test that short text matches name prefixes and longer text also matches descriptions."""
+        result = self.quick_search('ku')
+        self.assertEqual([p['name'] for p in result['projects']], ['Kubernetes Migration'])
+        self.assertEqual(result['chats'], [])
+        
+        result = self.quick_search('kubernetes')
+        self.assertEqual([c['id'] for c in result['chats']], [str(self.k8s_chat.id)])
+        self.assertFalse(result['timed_out'])
+    
+    def test_prefix_matches_rank_first(self):
+        """Test that name prefix matches come before other matches."""
+        Project.objects.create(owner=self.user, name='Notes on kubernetes')
+        
+        names = [p['name'] for p in self.quick_search('kubernetes')['projects']]
+        
+        self.assertEqual(names, ['Kubernetes Migration', 'Notes on kubernetes'])
+    
+    def test_typo_tolerance(self):
+        """Test that misspelled text still finds names when pg_trgm is installed."""
+        if not trigram_available():
+            self.skipTest('pg_trgm is not installed')
+        
+        result = self.quick_search('kubernets migraton')
+        
+        self.assertEqual([p['name'] for p in result['projects']], ['Kubernetes Migration'])
+    
+    def test_missing_trigram_is_rechecked(self):
+        """Test that a missing pg_trgm is looked up again after a while, and an installed one never."""
+        self.addCleanup(trigram_state.update, dict(trigram_state))
+        installed = trigram_available()
+        
+        trigram_state.update(available=False, checked_at=time.monotonic())
+        with self.assertNumQueries(0):
+            self.assertFalse(trigram_available())
+        
+        trigram_state['checked_at'] -= TRIGRAM_RECHECK_SECONDS + 1
+        with self.assertNumQueries(1):
+            self.assertEqual(trigram_available(), installed)
+        if installed:
+            with self.assertNumQueries(0):
+                self.assertTrue(trigram_available())
+    
+    @override_settings(QUICK_SEARCH_TIMEOUT_MS=20)
+    def test_timeout_returns_partial_results(self):
+        """Test that a search over its time budget is cancelled, keeping what finished."""
+        def slow_chats(queryset, text):
+            if queryset.model is Chat:
+                with connection.cursor() as cursor:
+                    cursor.execute("SELECT pg_sleep(1)")
+            return match_names(queryset, text)
+        
+        with patch('api.views_search.match_names', side_effect=slow_chats):
+            result = self.quick_search('kubernetes')
+        
+        self.assertTrue(result['timed_out'])
+        self.assertEqual(len(result['projects']), 1)
+        self.assertEqual(result['chats'], [])
+        with connection.cursor() as cursor:
+            cursor.execute("SHOW statement_timeout")
+            self.assertEqual(cursor.fetchone()[0], '0')
+    
+    def test_validation(self):
+        """Test that missing text and bad limits are rejected."""
+        for params in ({}, {'q': ''}, {'q': 'ku', 'limit': 'x'}):
+            response = self.client.get(reverse('quick-search'), params)
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class BatchTests(BaseTestCase):
+    """Test running several API requests through /api/batch/."""
+    
+    def batch(self, requests, **options):
+        response = self.client.post(reverse('batch'), {'requests': requests, **options}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.json()
+    
+    def test_chat_page_in_one_request(self):
+        """Test that each sub-response matches the same request made directly."""
+        paths = [
+            reverse('chat-detail', kwargs={'pk': self.chat.id}),
+            reverse('chat-messages', kwargs={'pk': self.chat.id}),
+            reverse('chat-graph-branches', kwargs={'pk': self.chat.id}),
+            reverse('chat-graph-graph-heads', kwargs={'pk': self.chat.id}),
+            reverse('chat-list') + '?page_size=1',
+        ]
+        
+        result = self.batch([{'method': 'GET', 'path': path} for path in paths])
+        
+        self.assertFalse(result['rolled_back'])
+        for path, sub in zip(paths, result['responses']):
+            self.assertEqual(sub['status'], status.HTTP_200_OK)
+            self.assertEqual(sub['body'], self.client.get(path).json())
+        self.assertIn('ETag', result['responses'][1]['headers'])
+    
+    def test_authenticates_once(self):
+        """Test that a JWT batch looks the user up once, not once per sub-request."""
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f'Bearer {RefreshToken.for_user(self.user).access_token}')
+        path = reverse('chat-detail', kwargs={'pk': self.chat.id})
+        
+        with CaptureQueriesContext(connection) as queries:
+            response = client.post(reverse('batch'), {'requests': [{'path': path}] * 3}, format='json')
+        
+        self.assertEqual([sub['status'] for sub in response.data['responses']], [200] * 3)
+        user_lookups = [q for q in queries if q['sql'].startswith('SELECT') and 'FROM "auth_user"' in q['sql']]
+        self.assertEqual(len(user_lookups), 1)
+    
+    def test_writes_and_headers(self):
+        """Test that sub-request bodies and headers (e.g. Idempotency-Key) reach the view."""
+        add = {
+            'method': 'POST',
+            'path': reverse('chat-add-message', kwargs={'pk': self.chat.id}),
+            'body': {'content': 'Batched'},
+            'headers': {'Idempotency-Key': 'batch-key'},
+        }
+        
+        first, replay = self.batch([add, add])['responses']
+        
+        self.assertEqual(first['status'], status.HTTP_201_CREATED)
+        self.assertEqual(replay['headers']['Idempotent-Replayed'], 'true')
+        self.assertEqual(Message.objects.filter(chat=self.chat).count(), 4)
+    
+    def test_atomic_batch_rolls_back(self):
+        """Test that an atomic batch stops at the first failure and undoes earlier writes."""
+        rename = {
+            'method': 'PATCH',
+            'path': reverse('chat-rename', kwargs={'pk': self.chat.id}),
+            'body': {'name': 'Renamed'},
+        }
+        missing = {'path': reverse('chat-detail', kwargs={'pk': uuid.uuid4()})}
+        
+        result = self.batch([rename, missing, rename], atomic=True)
+        
+        self.assertTrue(result['rolled_back'])
+        self.assertEqual([sub['status'] for sub in result['responses']], [200, 404, 424])
+        self.chat.refresh_from_db()
+        self.assertEqual(self.chat.name, 'Test Chat')
+        
+        result = self.batch([rename, missing])
+        self.assertFalse(result['rolled_back'])
+        self.chat.refresh_from_db()
+        self.assertEqual(self.chat.name, 'Renamed')
+    
+    def test_sub_requests_are_scoped_to_user(self):
+        """Test that batched requests see only the caller's data."""
+        other_chat = Chat.objects.create(owner=self.other_user, name='Other Chat')
+        
+        result = self.batch([{'path': reverse('chat-detail', kwargs={'pk': other_chat.id})}])
+        
+        self.assertEqual(result['responses'][0]['status'], status.HTTP_404_NOT_FOUND)
+    
+    def test_rejects_invalid_batches(self):
+        """Test that malformed, oversized, nested and non-API batches are rejected."""
+        chat_path = reverse('chat-detail', kwargs={'pk': self.chat.id})
+        invalid = [
+            {'requests': []},
+            {'requests': [{'path': chat_path}] * 21},
+            {'requests': [{'method': 'POST', 'path': reverse('batch')}]},
+            {'requests': [{'path': '/admin/'}]},
+            {'requests': [{'path': '/api/nope/'}]},
+            {'requests': [{'method': 'TRACE', 'path': chat_path}]},
+        ]
+        for body in invalid:
+            response = self.client.post(reverse('batch'), body, format='json')
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST, body)
+
+
+class MessageSearchTests(BaseTestCase):
+    """Test full-text search over message content."""
+    
+    def search(self, **params):
+        response = self.client.get(reverse('message-search'), params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.json()
+    
+    def add(self, content, chat=None):
+        return Message.objects.create(chat=chat or self.chat, role=Message.Role.USER, content=content)
+    
+    def test_ranked_stemmed_matches(self):
+        """Test that matches are stemmed, ranked best first and limited to the caller's messages."""
+        weak = self.add('We talked about postgres once')
+        strong = self.add('Postgres indexes: indexing postgres tables with postgres')
+        self.add('Nothing relevant here')
+        other_chat = Chat.objects.create(owner=self.other_user, name='Other Chat')
+        self.add('postgres indexes for someone else', chat=other_chat)
+        
+        results = self.search(q='postgres index')['results']
+        
+        self.assertEqual([r['id'] for r in results], [str(strong.id)])
+        self.assertEqual(
+            [r['id'] for r in self.search(q='postgres')['results']], [str(strong.id), str(weak.id)]
+        )
+        self.assertEqual(results[0]['chat_id'], str(self.chat.id))
+        self.assertEqual(results[0]['project_id'], str(self.project.id))
+    
+    def test_snippets_are_highlighted_and_escaped(self):
+        """Test that snippets mark the matches and HTML-escape the rest of the text."""
+        self.add('postgres says 1 < 2 and 5 > 3 & more words here')
+        
+        snippet = self.search(q='postgres')['results'][0]['snippet']
+        
+        self.assertIn('<mark>postgres</mark>', snippet)
+        self.assertIn('1 &lt; 2 and 5 &gt; 3 &amp; more', snippet)
+    
+    def test_scoping_and_validation(self):
+        """Test project/chat scoping and rejection of bad parameters."""
+        loose_chat = Chat.objects.create(owner=self.user, name='Loose Chat')
+        self.add('kubernetes rollout', chat=loose_chat)
+        self.add('kubernetes rollback')
+        
+        self.assertEqual(len(self.search(q='kubernetes')['results']), 2)
+        self.assertEqual(len(self.search(q='kubernetes', chat=str(loose_chat.id))['results']), 1)
+        self.assertEqual(len(self.search(q='kubernetes', project=str(self.project.id))['results']), 1)
+        for params in ({}, {'q': ' '}, {'q': 'x', 'chat': 'nope'}):
+            response = self.client.get(reverse('message-search'), params)
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+    
+    @override_settings(MESSAGE_COMPRESSION_CODEC='zlib', MESSAGE_COMPRESSION_THRESHOLD=16)
+    def test_compressed_and_edited_content(self):
+        """Test that compressed bodies are searchable and edits move the match to the new text."""
+        message = self.add('compressed ' + 'lorem ipsum ' * 50 + 'zeppelin')
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT content FROM message_bodies WHERE hash = %s", [message.body_id])
+            self.assertEqual(bytes(cursor.fetchone()[0])[:2], b'\xffz')
+        self.assertEqual([r['id'] for r in self.search(q='zeppelin')['results']], [str(message.id)])
+        
+        message.content = 'now about airships'
+        message.save()
+        
+        self.assertEqual(self.search(q='zeppelin')['results'], [])
+        self.assertEqual([r['id'] for r in self.search(q='airship')['results']], [str(message.id)])
+    
+    def test_page_query_budget(self):
+        """Test that a page of results costs the search, the bodies and one headline query."""
+        for i in range(5):
+            self.add(f'budget message number {i}')
+        
+        with self.assertNumQueries(3):
+            response = self.client.get(reverse('message-search'), {'q': 'budget', 'page_size': 3})
+        
+        self.assertEqual(len(response.data['results']), 3)
+        self.assertTrue(response.data['has_more'])
+    
+    def test_index_command_backfills(self):
+        """Test that index_message_search indexes bodies stored without a search vector."""
+        message = self.add('backfilled walrus')
+        MessageBody.objects.update(search_vector=None)
+        self.assertEqual(self.search(q='walrus')['results'], [])
+        
+        out = StringIO()
+        call_command('index_message_search', stdout=out)
+        
+        self.assertIn(f'Indexed {MessageBody.objects.count()} message bodies', out.getvalue())
+        self.assertEqual([r['id'] for r in self.search(q='walrus')['results']], [str(message.id)])
+
+
+class SparseFieldsetTests(BaseTestCase):
+    """Test ?fields= / ?expand= and the columns they let the queries skip."""
+    
+    def get_with_sql(self, url, params=None):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(url, params or {})
+        return response, ' '.join(q['sql'] for q in ctx.captured_queries)
+    
+    def test_chat_list_fields(self):
+        """Test that the chat list returns only the requested keys."""
+        url = reverse('chat-list')
+        response, sql = self.get_with_sql(url, {'fields': 'id,name'})
+        
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(set(response.data['results'][0]), {'id', 'name'})
+        self.assertNotIn('"chats"."description"', sql)
+    
+    def test_chat_detail_never_reads_message_graph(self):
+        """Test that chat detail skips message_graph even without ?fields=."""
+        url = reverse('chat-detail', kwargs={'pk': self.chat.id})
+        response, sql = self.get_with_sql(url)
+        
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data['messages']), 2)
+        self.assertNotIn('message_graph', sql)
+    
+    def test_chat_detail_nested_message_fields(self):
+        """Test that dotted names trim embedded messages and skip Message.content."""
+        url = reverse('chat-detail', kwargs={'pk': self.chat.id})
+        response, sql = self.get_with_sql(url, {'fields': 'id,messages.id,messages.role'})
+        
+        self.assertEqual(set(response.data), {'id', 'messages'})
+        self.assertEqual(set(response.data['messages'][0]), {'id', 'role'})
+        self.assertNotIn('message_bodies', sql)
+    
+    def test_chat_detail_whole_relation(self):
+        """Test that naming a relation keeps all of its fields."""
+        url = reverse('chat-detail', kwargs={'pk': self.chat.id})
+        response = self.client.get(url, {'fields': 'name', 'expand': 'messages'})
+        
+        self.assertEqual(set(response.data), {'name', 'messages'})
+        self.assertEqual(response.data['messages'][0]['content'], self.user_message.content)
+    
+    def test_profile_list_skips_user_memory(self):
+        """Test that UserProfile.user_memory isn't read unless requested."""
+        url = reverse('profile-list')
+        response, sql = self.get_with_sql(url, {'fields': 'id,display_name'})
+        
+        self.assertEqual(set(response.data['results'][0]), {'id', 'display_name'})
+        self.assertNotIn('user_memory', sql)
+    
+    def test_project_detail_expand_chats(self):
+        """Test that embedded project chats appear only when requested."""
+        url = reverse('project-detail', kwargs={'pk': self.project.id})
+        response, sql = self.get_with_sql(url, {'fields': 'id,name'})
+        self.assertEqual(set(response.data), {'id', 'name'})
+        self.assertNotIn('FROM "chats"', sql)
+        
+        response, sql = self.get_with_sql(url, {'fields': 'id,chats.name'})
+        self.assertEqual(response.data['chats'], [{'name': 'Test Chat'}])
+        self.assertNotIn('message_graph', sql)
+    
+    def test_project_detail_chat_fields_prefetch_once(self):
+        """Test that trimmed embedded chats still load in one prefetch, not one query per chat."""
+        for i in range(3):
+            Chat.objects.create(owner=self.user, name=f'Chat {i}', project=self.project)
+        url = reverse('project-detail', kwargs={'pk': self.project.id})
+        
+        # The project and its chats
+        with self.assertNumQueries(2):
+            response = self.client.get(url, {'fields': 'chats.name'})
+        self.assertEqual(len(response.data['chats']), 4)
+    
+    def test_fields_ignored_on_writes(self):
+        """Test that ?fields= doesn't drop fields from write validation."""
+        url = reverse('chat-detail', kwargs={'pk': self.chat.id})
+        response = self.client.patch(f"{url}?fields=id", {'name': 'Renamed'}, format='json')
+        
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.chat.refresh_from_db()
+        self.assertEqual(self.chat.name, 'Renamed')
+
+
 class SeparateDataRetrievalTests(BaseTestCase):
     """Test separate data retrieval endpoints."""
     
@@ -325,6 +2251,10 @@ class SeparateDataRetrievalTests(BaseTestCase):
 class DashboardViewTests(BaseTestCase):
     """Test the dashboard view functionality."""
     
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+    
     def test_dashboard_view_success(self):
         """Test successful dashboard data retrieval."""
         url = reverse('dashboard')
@@ -344,6 +2274,42 @@ class DashboardViewTests(BaseTestCase):
         self.assertEqual(response.data['total_projects'], 1)
         self.assertEqual(response.data['total_chats'], 1)
     
+    def test_dashboard_view_query_budget_and_cache_hit(self):
+        """Test that a cold dashboard is three queries and a warm one is none."""
+        url = reverse('dashboard')
+        with self.assertNumQueries(3):
+            first = self.client.get(url)
+        with self.assertNumQueries(0):
+            second = self.client.get(url)
+        self.assertEqual(first.data, second.data)
+    
+    def test_dashboard_view_invalidated_by_writes(self):
+        """Test that a chat write invalidates the cached dashboard."""
+        url = reverse('dashboard')
+        self.client.get(url)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('chat-list'), {'name': 'Standalone'})
+        
+        response = self.client.get(url)
+        
+        self.assertEqual(response.data['total_chats'], 2)
+        self.assertEqual(len(response.data['standalone_chats']), 1)
+    
+    def test_dashboard_view_does_not_create_profile(self):
+        """Test that a missing profile is returned as the defaults, without GET writing one."""
+        stored = self.client.get(reverse('dashboard')).data['profile']
+        self.user_profile.delete()
+        cache.clear()
+        response = self.client.get(reverse('dashboard'))
+        
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        profile = response.data['profile']
+        self.assertEqual(set(profile), set(stored))
+        self.assertIsNone(profile['id'])
+        self.assertEqual(profile['user']['id'], self.user.id)
+        self.assertEqual(profile['display_name'], UserProfile._meta.get_field('display_name').get_default())
+        self.assertFalse(UserProfile.objects.filter(user=self.user).exists())
+    
     def test_dashboard_view_unauthorized(self):
         """Test dashboard access without authentication."""
         self.client.force_authenticate(user=None)
@@ -1,11 +1,15 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from rest_framework_simplejwt.views import TokenRefreshView
 from .views import (
     UserProfileViewSet, ProjectViewSet, ChatViewSet, MessageViewSet, 
     UserSettingsViewSet, DashboardView, HealthCheckView, AllProjectsView, ProjectChatsView, ChatMessagesView,
-    UserRegistrationView, UserDeletionView, MyTokenObtainPairView
+    UserRegistrationView, UserDeletionView, MyTokenObtainPairView, MyTokenRefreshView, LogoutView
 )
+from .views_graph import ChatGraphViewSet
+from .views_sync import SyncView
+from .views_batch import BatchView
+from .views_metrics import MetricsView
+from .views_search import MessageSearchView, QuickSearchView, SemanticSearchView
 
 # Create a router and register our viewsets with it
 router = DefaultRouter()
@@ -14,6 +18,7 @@ router.register(r'projects', ProjectViewSet, basename='project')
 router.register(r'chats', ChatViewSet, basename='chat')
 router.register(r'messages', MessageViewSet, basename='message')
 router.register(r'settings', UserSettingsViewSet, basename='settings')
+router.register(r'chat-graph', ChatGraphViewSet, basename='chat-graph')
 
 urlpatterns = [
     # Include the router URLs
@@ -21,13 +26,20 @@ urlpatterns = [
     
     # JWT Authentication endpoints
     path('auth/login/', MyTokenObtainPairView.as_view(), name='token_obtain_pair'),
-    path('auth/token/refresh/', TokenRefreshView.as_view(), name='token_refresh'),
+    path('auth/token/refresh/', MyTokenRefreshView.as_view(), name='token_refresh'),
+    path('auth/logout/', LogoutView.as_view(), name='logout'),
     path('auth/register/', UserRegistrationView.as_view(), name='user_register'),
     path('auth/delete/', UserDeletionView.as_view(), name='user_delete'),
     
     # Dashboard and utility endpoints
     path('dashboard/', DashboardView.as_view(), name='dashboard'),
     path('health/', HealthCheckView.as_view(), name='health_check'),
+    path('metrics', MetricsView.as_view(), name='metrics'),
+    path('sync/', SyncView.as_view(), name='sync'),
+    path('batch/', BatchView.as_view(), name='batch'),
+    path('search/', MessageSearchView.as_view(), name='message-search'),
+    path('quick-search/', QuickSearchView.as_view(), name='quick-search'),
+    path('semantic-search/', SemanticSearchView.as_view(), name='semantic-search'),
     
     # Additional separate data retrieval endpoints
     path('all-projects/', AllProjectsView.as_view(), name='all-projects'),
@@ -0,0 +1,54 @@
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import transaction
+
+# Utility functions for the cached authentication principal (see authentication.CachedJWTAuthentication)
+
+PRINCIPAL_FIELDS = ('id', 'username', 'is_active')
+
+# Unique constraints on auth_user, by the field a violation is reported against
+USER_UNIQUE_CONSTRAINTS = {
+    'auth_user_username_key': 'username',
+    'auth_user_email_lower_uniq': 'email',
+}
+
+def principal_cache_key(user_id):
+    return f"auth-principal:{user_id}"
+
+def get_principal(user_id):
+    """
+    The user as a deferred User holding only id, username and is_active, or None if missing.
+    - Served from the cache, so a hit costs no query; a miss costs one narrow query.
+    - With AUTH_PRINCIPAL_CACHE_TIMEOUT at 0 (no cache shared by all workers) it is read on
+      every call, so deactivations and deletions apply at once in every worker.
+    - Any other field loads on first access, and save() writes only the loaded fields, so
+      the principal can be used (and saved) like a normal User.
+    """
+    timeout = settings.AUTH_PRINCIPAL_CACHE_TIMEOUT
+    key = principal_cache_key(user_id)
+    values = cache.get(key) if timeout else None
+    if values is None:
+        values = User.objects.filter(pk=user_id).values_list(*PRINCIPAL_FIELDS).first()
+        if values is None:
+            return None
+        if timeout:
+            cache.set(key, values, timeout)
+    return User.from_db('default', PRINCIPAL_FIELDS, values)
+
+def forget_principal(user_id):
+    """
+    Drop the cached principal now and again after commit, so a concurrent request can't
+    re-cache the pre-commit row.
+    """
+    key = principal_cache_key(user_id)
+    cache.delete(key)
+    transaction.on_commit(lambda: cache.delete(key))
+
+def unique_violation_field(error):
+    """
+    The User field ('username' or 'email') whose unique constraint an IntegrityError violated,
+    or None if it was something else.
+    """
+    diag = getattr(error.__cause__, 'diag', None)
+    return USER_UNIQUE_CONSTRAINTS.get(getattr(diag, 'constraint_name', None))
@@ -0,0 +1,64 @@
+from django.db import connection, transaction
+from django.db.models import Count, Sum
+from .models import Message, MessageBody
+from .utils_counters import iter_pk_batches, reconcile_in_parallel
+
+# Utility functions for the content-addressed MessageBody store
+
+def collect_garbage(batch_size=1000):
+    """
+    Delete bodies no message references, batch_size at a time; returns the number deleted.
+    - Only bodies at ref_count 0 with no referencing row are candidates, and they are
+      locked (SKIP LOCKED) so a writer re-referencing one either wins or waits for us.
+    """
+    deleted = 0
+    while True:
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(
+                "WITH doomed AS ("
+                "  SELECT b.hash FROM message_bodies b WHERE b.ref_count = 0"
+                "  AND NOT EXISTS (SELECT 1 FROM messages m WHERE m.body_hash = b.hash)"
+                "  LIMIT %s FOR UPDATE SKIP LOCKED"
+                "), embeddings AS (DELETE FROM message_embeddings WHERE body_hash IN (SELECT hash FROM doomed)) "
+                "DELETE FROM message_bodies WHERE hash IN (SELECT hash FROM doomed) AND ref_count = 0",
+                [batch_size],
+            )
+            batch = cursor.rowcount
+        deleted += batch
+        if batch < batch_size:
+            return deleted
+
+def reconcile_body_refs(hashes):
+    """
+    Recount references for a batch of bodies and repair any drifted ref_count.
+    - Locks the body rows so concurrent interning can't be overwritten.
+    - Returns the number of bodies that were repaired.
+    """
+    with transaction.atomic():
+        stored = dict(MessageBody.objects.select_for_update().filter(pk__in=hashes).values_list('pk', 'ref_count'))
+        actual = dict(
+            Message.objects.filter(body_id__in=hashes)
+            .values('body_id').annotate(total=Count('id')).values_list('body_id', 'total')
+        )
+        drifted = [MessageBody(pk=pk, ref_count=actual.get(pk, 0)) for pk, count in stored.items() if count != actual.get(pk, 0)]
+        MessageBody.objects.bulk_update(drifted, ['ref_count'])
+    return len(drifted)
+
+def reconcile_body_refcounts(batch_size=1000, workers=4):
+    """
+    Repair drift in every body's ref_count; returns the number repaired.
+    """
+    return reconcile_in_parallel(reconcile_body_refs, iter_pk_batches(MessageBody.objects.all(), batch_size), workers)
+
+def dedup_stats():
+    """
+    How much the body store saves: messages, distinct bodies, and bytes with and without sharing.
+    """
+    bodies = MessageBody.objects.aggregate(count=Count('pk'), stored=Sum('size'))
+    logical = Message.objects.aggregate(bytes=Sum('body__size'))['bytes'] or 0
+    return {
+        'messages': Message.objects.count(),
+        'bodies': bodies['count'],
+        'body_bytes': bodies['stored'] or 0,
+        'message_bytes': logical,
+    }
@@ -0,0 +1,35 @@
+import uuid
+from django.core.cache import cache
+from django.db import transaction
+
+# Utility functions for the per-user dashboard cache
+
+def dashboard_version_key(user_id):
+    return f"dashboard-version:{user_id}"
+
+def dashboard_version(user_id):
+    """
+    Return the user's current "last changed" stamp, creating one if the cache has none.
+    - A fresh random stamp means a lost stamp can never resurrect an old payload.
+    """
+    key = dashboard_version_key(user_id)
+    version = cache.get(key)
+    if version is None:
+        version = uuid.uuid4().hex
+        cache.add(key, version, None)
+        version = cache.get(key, version)
+    return version
+
+def dashboard_cache_key(user_id):
+    """
+    Cache key for the user's dashboard payload at the current stamp.
+    - Resolve it once per request, before reading the DB, so a bump mid-build isn't lost.
+    """
+    return f"dashboard:{user_id}:{dashboard_version(user_id)}"
+
+def bump_dashboard_version(user_id):
+    """
+    Invalidate the user's cached dashboard once the current transaction commits.
+    - Bumping after commit stops a concurrent read from caching pre-commit data under the new stamp.
+    """
+    transaction.on_commit(lambda: cache.set(dashboard_version_key(user_id), uuid.uuid4().hex, None))
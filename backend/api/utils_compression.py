@@ -0,0 +1,96 @@
+import time
+from django.db import connection, transaction
+from .fields import COMPRESSED_MARKER, decompress_text, register_dictionary, zstandard
+from .models import Message, MessageBody
+
+# Utility functions for compressing message bodies at rest (see fields.CompressedTextField)
+
+def compress_message_batch(after_pk, batch_size, threshold):
+    """
+    Compress one batch of plain-stored message bodies of at least threshold bytes, in hash order.
+    - Rows are locked (SKIP LOCKED) so a concurrent edit is never overwritten with stale text.
+    - Returns (last pk seen or None when done, rows rewritten, bytes before, bytes after).
+    """
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT hash, content FROM message_bodies "
+            "WHERE (%s::text IS NULL OR hash > %s) AND octet_length(content) >= %s "
+            "AND substring(content from 1 for 1) <> %s "
+            "ORDER BY hash LIMIT %s FOR UPDATE SKIP LOCKED",
+            [after_pk, after_pk, threshold, COMPRESSED_MARKER, batch_size],
+        )
+        rows = [(pk, bytes(stored)) for pk, stored in cursor.fetchall()]
+        if not rows:
+            return None, 0, 0, 0
+        bodies = [MessageBody(pk=pk, content=stored.decode('utf-8')) for pk, stored in rows]
+        MessageBody.objects.bulk_update(bodies, ['content'])
+        cursor.execute("SELECT sum(octet_length(content)) FROM message_bodies WHERE hash = ANY(%s)", [[pk for pk, _ in rows]])
+        after = cursor.fetchone()[0]
+    before = sum(len(stored) for _, stored in rows)
+    return rows[-1][0], len(rows), before, after
+
+def compress_existing_messages(threshold, batch_size=500, pause=0.0):
+    """
+    Background migration: compress every existing message body above the threshold.
+    - Short per-batch transactions, optionally pausing between batches to limit load.
+    - Returns (rows rewritten, bytes before, bytes after).
+    """
+    last_pk, total_rows, total_before, total_after = None, 0, 0, 0
+    while True:
+        last_pk, rows, before, after = compress_message_batch(last_pk, batch_size, threshold)
+        if last_pk is None:
+            return total_rows, total_before, total_after
+        total_rows += rows
+        total_before += before
+        total_after += after
+        if pause:
+            time.sleep(pause)
+
+def compression_report(fetch_size=500):
+    """
+    Measure how much space compression saves and what decoding costs.
+    - Decodes every compressed body once; returns a dict of totals and per-body decode time.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT count(*), coalesce(sum(octet_length(content)), 0) FROM message_bodies")
+        rows, stored_bytes = cursor.fetchone()
+        cursor.execute("SELECT content FROM message_bodies WHERE substring(content from 1 for 1) = %s", [COMPRESSED_MARKER])
+        compressed_rows = compressed_stored = compressed_raw = 0
+        decode_seconds = 0.0
+        while batch := cursor.fetchmany(fetch_size):
+            for (stored,) in batch:
+                stored = bytes(stored)
+                started = time.perf_counter()
+                text = decompress_text(stored)
+                decode_seconds += time.perf_counter() - started
+                compressed_rows += 1
+                compressed_stored += len(stored)
+                compressed_raw += len(text.encode('utf-8'))
+    return {
+        'rows': rows,
+        'compressed_rows': compressed_rows,
+        'stored_bytes': stored_bytes,
+        'raw_bytes': stored_bytes - compressed_stored + compressed_raw,
+        'bytes_saved': compressed_raw - compressed_stored,
+        'decode_us_per_body': decode_seconds / compressed_rows * 1e6 if compressed_rows else 0.0,
+    }
+
+def train_dictionary(path, samples=2000, dict_size=112640):
+    """
+    Train a zstd dictionary on recent assistant message bodies and write it to path.
+    - It is also registered in MESSAGE_COMPRESSION_DICTIONARY_DIR under its dict_id.
+    - Returns the dictionary size in bytes. Requires the zstandard package.
+    """
+    if zstandard is None:
+        raise ImportError("Training a dictionary requires the zstandard package")
+    assistant_bodies = Message.objects.filter(role=Message.Role.ASSISTANT).values('body')
+    contents = (
+        MessageBody.objects.filter(hash__in=assistant_bodies)
+        .order_by('-created_at').values_list('content', flat=True)[:samples]
+    )
+    dictionary = zstandard.train_dictionary(dict_size, [content.encode('utf-8') for content in contents])
+    data = dictionary.as_bytes()
+    with open(path, 'wb') as f:
+        f.write(data)
+    register_dictionary(dictionary)
+    return len(data)
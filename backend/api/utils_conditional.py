@@ -0,0 +1,93 @@
+import hashlib
+from django.core.exceptions import ValidationError
+from django.db.models import Count, Max
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
+from django.utils.http import http_date
+from .models import Chat, Message, ChangeLog, ChangeCounter
+
+# Utility functions for conditional GET (ETag / Last-Modified) on polled endpoints
+#
+# Each *_validators() function runs one query and returns (parts, last_modified), or None
+# when the object doesn't exist (the normal view then answers 404). The parts cover
+# everything a response depends on, including deletions.
+
+def change_counter_validators(user, entities):
+    """
+    Validators from the owner's trigger-maintained ChangeCounter rows for the given entities.
+    - One lookup on the (owner_id, entity) unique index, however many rows the list has.
+    - Every insert, update and delete of those entities (counter updates included) moves a counter.
+    """
+    counters = dict.fromkeys(entities)
+    last_modified = None
+    for entity, seq, updated_at in ChangeCounter.objects.filter(
+        owner_id=user.pk, entity__in=entities,
+    ).values_list('entity', 'seq', 'updated_at'):
+        counters[entity] = seq
+        last_modified = max(filter(None, (last_modified, updated_at)))
+    return tuple(counters.values()), last_modified
+
+def chat_list_validators(user):
+    # Chat rows carry their project's name, so project changes count too
+    return change_counter_validators(user, [ChangeLog.Entity.CHAT, ChangeLog.Entity.PROJECT])
+
+def project_list_validators(user):
+    return change_counter_validators(user, [ChangeLog.Entity.PROJECT])
+
+def chat_messages_validators(user, chat_id):
+    try:
+        stamp = (
+            Chat.objects.filter(pk=chat_id, owner=user)
+            .annotate(total=Count('messages'), last=Max('messages__updated_at'))
+            .values_list('total', 'last').first()
+        )
+    except ValidationError:
+        return None
+    if stamp is None:
+        return None
+    return stamp, stamp[1]
+
+def message_validators(user, message_id):
+    # The detail embeds edited_versions, so they count as part of the message
+    try:
+        stamp = (
+            Message.objects.filter(pk=message_id, chat__owner=user)
+            .annotate(edits=Count('edited_versions'), edits_last=Max('edited_versions__updated_at'))
+            .values_list('updated_at', 'edits', 'edits_last').first()
+        )
+    except ValidationError:
+        return None
+    if stamp is None:
+        return None
+    return stamp, max(filter(None, (stamp[0], stamp[2])))
+
+def compute_etag(request, parts):
+    """
+    Weak ETag over the user, full path (page, fields, ...) and Accept header plus the validator parts.
+    """
+    raw = '|'.join(str(part) for part in (
+        request.user.pk, request.get_full_path(), request.META.get('HTTP_ACCEPT', ''), *parts,
+    ))
+    return f'W/"{hashlib.sha256(raw.encode()).hexdigest()[:32]}"'
+
+def conditional_get(request, validators, respond):
+    """
+    Return 304 Not Modified when the client's If-None-Match is current, else respond().
+    - 200 responses carry ETag, Last-Modified and `Cache-Control: private, no-cache`.
+    - Last-Modified is informational: on the detail endpoints a deletion doesn't move it
+      forward, so only the ETag decides a 304.
+    """
+    if validators is None:
+        return respond()
+    parts, last_modified = validators
+    etag = compute_etag(request, parts)
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        response = respond()
+        if response.status_code != 200:
+            return response
+    response['ETag'] = etag
+    if last_modified is not None:
+        response['Last-Modified'] = http_date(last_modified.timestamp())
+    patch_cache_control(response, private=True, no_cache=True)
+    patch_vary_headers(response, ['Authorization'])
+    return response
@@ -0,0 +1,123 @@
+from concurrent.futures import ThreadPoolExecutor
+from django.db import connection, transaction
+from django.db.models import Count, F
+from django.db.models.functions import Greatest, Now
+from django.utils import timezone
+from .models import Project, Chat, Message
+
+# Utility functions for the denormalized Chat.message_count / Project.chat_count counters
+
+def adjust_message_count(chat_id, delta):
+    """
+    Atomically add delta to a chat's message_count.
+    - Clamped at zero so a drifted counter can't break the write; reconcile repairs it.
+    - Touches updated_at so conditional GETs see the change.
+    """
+    Chat.objects.filter(pk=chat_id).update(message_count=Greatest(F('message_count') + delta, 0), updated_at=Now())
+
+def adjust_chat_count(project_id, delta):
+    """
+    Atomically add delta to a project's chat_count.
+    - Clamped at zero so a drifted counter can't break the write; reconcile repairs it.
+    - Touches updated_at so conditional GETs see the change.
+    """
+    if project_id:
+        Project.objects.filter(pk=project_id).update(chat_count=Greatest(F('chat_count') + delta, 0), updated_at=Now())
+
+def move_chat_count(old_project_id, old_active, new_project_id, new_active):
+    """
+    Update project chat counts after a chat moves project or changes status.
+    - Only active chats are counted.
+    """
+    if old_project_id == new_project_id and old_active == new_active:
+        return
+    if old_active:
+        adjust_chat_count(old_project_id, -1)
+    if new_active:
+        adjust_chat_count(new_project_id, 1)
+
+def reconcile_message_counts(chat_ids):
+    """
+    Recount messages for a batch of chats and repair any drifted counters.
+    - Locks the chat rows so concurrent increments can't be overwritten.
+    - Returns the number of chats that were repaired.
+    """
+    with transaction.atomic():
+        stored = dict(Chat.objects.select_for_update().filter(pk__in=chat_ids).values_list('pk', 'message_count'))
+        actual = dict(
+            Message.objects.filter(chat_id__in=chat_ids)
+            .values('chat_id').annotate(total=Count('id')).values_list('chat_id', 'total')
+        )
+        now = timezone.now()
+        drifted = [
+            Chat(pk=pk, message_count=actual.get(pk, 0), updated_at=now)
+            for pk, count in stored.items() if count != actual.get(pk, 0)
+        ]
+        Chat.objects.bulk_update(drifted, ['message_count', 'updated_at'])
+    return len(drifted)
+
+def reconcile_chat_counts(project_ids):
+    """
+    Recount active chats for a batch of projects and repair any drifted counters.
+    - Locks the project rows so concurrent increments can't be overwritten.
+    - Returns the number of projects that were repaired.
+    """
+    with transaction.atomic():
+        stored = dict(Project.objects.select_for_update().filter(pk__in=project_ids).values_list('pk', 'chat_count'))
+        actual = dict(
+            Chat.objects.filter(project_id__in=project_ids, status=Chat.Status.ACTIVE)
+            .values('project_id').annotate(total=Count('id')).values_list('project_id', 'total')
+        )
+        now = timezone.now()
+        drifted = [
+            Project(pk=pk, chat_count=actual.get(pk, 0), updated_at=now)
+            for pk, count in stored.items() if count != actual.get(pk, 0)
+        ]
+        Project.objects.bulk_update(drifted, ['chat_count', 'updated_at'])
+    return len(drifted)
+
+def iter_pk_batches(queryset, batch_size):
+    """
+    Yield lists of primary keys in pk order, batch_size at a time.
+    """
+    last_pk = None
+    while True:
+        page = queryset.order_by('pk')
+        if last_pk is not None:
+            page = page.filter(pk__gt=last_pk)
+        batch = list(page.values_list('pk', flat=True)[:batch_size])
+        if not batch:
+            return
+        yield batch
+        last_pk = batch[-1]
+
+def reconcile_in_parallel(func, batches, workers):
+    """
+    Run func over each batch on a thread pool and return the summed results.
+    - Each worker thread closes its own DB connection when its batch is done.
+    - With a single worker the batches run inline on the caller's connection.
+    """
+    if workers <= 1:
+        return sum(func(batch) for batch in batches)
+
+    def run(batch):
+        try:
+            return func(batch)
+        finally:
+            connection.close()
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        return sum(pool.map(run, batches))
+
+def reconcile_counters(batch_size=1000, workers=4):
+    """
+    Repair drift in every chat and project counter.
+    - Returns (chats_repaired, projects_repaired).
+    """
+    chats_repaired = reconcile_in_parallel(
+        reconcile_message_counts, iter_pk_batches(Chat.objects.all(), batch_size), workers
+    )
+    projects_repaired = reconcile_in_parallel(
+        reconcile_chat_counts, iter_pk_batches(Project.objects.all(), batch_size), workers
+    )
+    return chats_repaired, projects_repaired
@@ -0,0 +1,72 @@
+import hashlib
+import json
+from django.conf import settings
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.response import Response
+from .models import IdempotencyKey
+
+# Utility functions for Idempotency-Key handling on write endpoints
+
+IDEMPOTENCY_HEADER = 'HTTP_IDEMPOTENCY_KEY'
+
+def get_idempotency_key(request):
+    """
+    Return the Idempotency-Key header value, or None when the client didn't send one.
+    """
+    key = request.META.get(IDEMPOTENCY_HEADER, '').strip()
+    return key[:255] or None
+
+def request_fingerprint(request):
+    """
+    Hash the request path and body so a reused key with a different payload can be rejected.
+    """
+    body = json.dumps(request.data, sort_keys=True, default=str)
+    return hashlib.sha256(f"{request.path}\n{body}".encode()).hexdigest()
+
+def expiry_cutoff():
+    """
+    Keys created before this timestamp are expired.
+    """
+    return timezone.now() - settings.IDEMPOTENCY_KEY_TTL
+
+def replay_response(request, key):
+    """
+    Return the stored response for this key, or None if the key is new or expired.
+    - A key reused with a different request payload gets a 422 instead of a replay.
+    """
+    stored = IdempotencyKey.objects.filter(
+        user=request.user, key=key, created_at__gte=expiry_cutoff()
+    ).first()
+    if stored is None:
+        return None
+    if stored.request_hash != request_fingerprint(request):
+        return Response(
+            {'error': 'Idempotency-Key was already used with a different request'},
+            status=status.HTTP_422_UNPROCESSABLE_ENTITY,
+        )
+    response = Response(stored.response_body, status=stored.response_status)
+    response['Idempotent-Replayed'] = 'true'
+    return response
+
+def store_response(request, key, response):
+    """
+    Save the response under this key; an expired row with the same key is overwritten.
+    """
+    IdempotencyKey.objects.update_or_create(
+        user=request.user,
+        key=key,
+        defaults={
+            'request_hash': request_fingerprint(request),
+            'response_status': response.status_code,
+            'response_body': response.data,
+            'created_at': timezone.now(),
+        },
+    )
+
+def purge_expired_keys():
+    """
+    Delete expired keys and return how many rows were removed.
+    """
+    deleted, _ = IdempotencyKey.objects.filter(created_at__lt=expiry_cutoff()).delete()
+    return deleted
@@ -0,0 +1,260 @@
+import atexit
+import contextvars
+import fcntl
+import json
+import os
+import threading
+import time
+import uuid
+from bisect import bisect_left
+from contextlib import contextmanager
+from pathlib import Path
+from django.conf import settings
+
+# Utility functions for request metrics in the Prometheus text format (see middleware.MetricsMiddleware)
+
+# Per-request serialization accounting, set by MetricsMiddleware
+serializer_stats = contextvars.ContextVar('serializer_stats', default=None)
+
+# Methods outside this set share one label, so odd requests can't grow the series without bound
+METHODS = {'GET', 'HEAD', 'POST', 'PUT', 'PATCH', 'DELETE', 'OPTIONS'}
+
+# Per (route, method) totals: request count, then the sums below, then one slot per latency bucket
+COUNT, DURATION, DB_QUERIES, DB_SECONDS, SERIALIZER_SECONDS, RESPONSE_BYTES, FIRST_BUCKET = range(7)
+
+# Totals of exited workers, folded together so METRICS_DIR holds one file per live worker plus this
+ARCHIVE = 'metrics-archive.json'
+
+def route_label(request):
+    """The URL pattern name that served the request ('chat-detail'), never the raw path."""
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return 'unmatched'
+    return match.view_name or match.route
+
+def method_label(request):
+    return request.method if request.method in METHODS else 'OTHER'
+
+def response_size(response):
+    if response.streaming:
+        return int(response.get('Content-Length') or 0)
+    return len(response.content)
+
+class RequestMetrics:
+    """
+    This process's request metrics, aggregated in memory under a lock.
+    - With METRICS_DIR set, the totals are also written to a file of this process's own there, at
+      most every METRICS_FLUSH_INTERVAL seconds, and collect() sums every process's file: any
+      gunicorn worker answers a scrape for all of them.
+    - A worker that exits folds its totals into ARCHIVE and removes its file; files of workers
+      that died without exiting cleanly are folded in by the next scrape. The sums never go
+      backwards when a worker restarts, and the directory doesn't grow with every restart.
+    - A forked child starts from zero under a new file name, as a preloaded gunicorn worker would.
+    """
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.lock = threading.Lock()
+        self.buckets = tuple(settings.METRICS_LATENCY_BUCKETS)
+        self.requests = {}
+        self.timings = {}
+        self.file_name = f'metrics-{os.getpid()}-{uuid.uuid4().hex[:8]}.json'
+        self.next_flush = 0.0
+
+    def observe(self, route, method, status, duration, db_queries, db_seconds, serializer_seconds, response_bytes):
+        now = time.monotonic()
+        with self.lock:
+            key = (route, method, status)
+            self.requests[key] = self.requests.get(key, 0) + 1
+            totals = self.timings.get((route, method))
+            if totals is None:
+                totals = self.timings[(route, method)] = [0] * (FIRST_BUCKET + len(self.buckets) + 1)
+            totals[COUNT] += 1
+            totals[DURATION] += duration
+            totals[DB_QUERIES] += db_queries
+            totals[DB_SECONDS] += db_seconds
+            totals[SERIALIZER_SECONDS] += serializer_seconds
+            totals[RESPONSE_BYTES] += response_bytes
+            # Buckets are stored per slot and made cumulative on export (le is inclusive)
+            totals[FIRST_BUCKET + bisect_left(self.buckets, duration)] += 1
+            flush = settings.METRICS_DIR and now >= self.next_flush
+            if flush:
+                self.next_flush = now + settings.METRICS_FLUSH_INTERVAL
+                snapshot = self.snapshot()
+        if flush:
+            self.write(snapshot)
+
+    def snapshot(self):
+        return {
+            'buckets': list(self.buckets),
+            'requests': [[*key, count] for key, count in self.requests.items()],
+            'timings': [[*key, list(totals)] for key, totals in self.timings.items()],
+        }
+
+    def write(self, snapshot):
+        directory = Path(settings.METRICS_DIR)
+        directory.mkdir(parents=True, exist_ok=True)
+        # Written aside and renamed, so a scrape never reads half a file
+        partial = directory / f'.{self.file_name}.{threading.get_ident()}'
+        partial.write_text(json.dumps(snapshot))
+        os.replace(partial, directory / self.file_name)
+
+    def flush(self):
+        if settings.METRICS_DIR:
+            with self.lock:
+                snapshot = self.snapshot()
+            self.write(snapshot)
+
+    def retire(self):
+        """Fold this process's totals into ARCHIVE and remove its file, as it exits."""
+        if not settings.METRICS_DIR:
+            return
+        with self.lock:
+            snapshot = self.snapshot()
+        directory = Path(settings.METRICS_DIR)
+        with directory_lock(directory):
+            archive(directory, [snapshot], self.buckets)
+            (directory / self.file_name).unlink(missing_ok=True)
+
+    def collect(self):
+        """Totals across every process writing to METRICS_DIR (this one read live), or this process's alone."""
+        with self.lock:
+            snapshots = [self.snapshot()]
+        if settings.METRICS_DIR:
+            directory = Path(settings.METRICS_DIR)
+            # Under the lock a retiring worker's totals are either in its file or in ARCHIVE, never both
+            with directory_lock(directory):
+                fold_dead_workers(directory, self.buckets)
+                for path in directory.glob('metrics-*.json'):
+                    if path.name == self.file_name:
+                        continue
+                    try:
+                        snapshots.append(json.loads(path.read_text()))
+                    except (OSError, ValueError):
+                        continue
+        return merge(snapshots, self.buckets)
+
+@contextmanager
+def directory_lock(directory):
+    directory.mkdir(parents=True, exist_ok=True)
+    with open(directory / 'lock', 'a') as handle:
+        fcntl.flock(handle, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(handle, fcntl.LOCK_UN)
+
+def archive(directory, snapshots, buckets):
+    """Add snapshots to ARCHIVE (callers hold directory_lock); an archive with other buckets is replaced."""
+    try:
+        snapshots = [json.loads((directory / ARCHIVE).read_text()), *snapshots]
+    except (OSError, ValueError):
+        pass
+    requests, timings = merge(snapshots, buckets)
+    partial = directory / f'.{ARCHIVE}'
+    partial.write_text(json.dumps({
+        'buckets': list(buckets),
+        'requests': [[*key, count] for key, count in requests.items()],
+        'timings': [[*key, totals] for key, totals in timings.items()],
+    }))
+    os.replace(partial, directory / ARCHIVE)
+
+def process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+def fold_dead_workers(directory, buckets):
+    """
+    Fold the files of workers that died without retire() (SIGKILL, OOM) into ARCHIVE.
+    - Liveness is checked by pid, so METRICS_DIR must not be shared across hosts or containers.
+    """
+    for path in directory.glob('metrics-*.json'):
+        try:
+            pid = int(path.name.split('-')[1])
+        except ValueError:
+            continue
+        if process_alive(pid):
+            continue
+        try:
+            snapshot = json.loads(path.read_text())
+        except (OSError, ValueError):
+            snapshot = None
+        if snapshot is not None:
+            archive(directory, [snapshot], buckets)
+        path.unlink(missing_ok=True)
+
+def merge(snapshots, buckets):
+    """
+    Sum snapshots into ({(route, method, status): count}, {(route, method): totals}).
+    - Snapshots taken with other latency buckets (an older deploy) are skipped.
+    """
+    requests, timings = {}, {}
+    for snapshot in snapshots:
+        if tuple(snapshot['buckets']) != buckets:
+            continue
+        for route, method, status, count in snapshot['requests']:
+            key = (route, method, status)
+            requests[key] = requests.get(key, 0) + count
+        for route, method, values in snapshot['timings']:
+            totals = timings.setdefault((route, method), [0] * len(values))
+            for i, value in enumerate(values):
+                totals[i] += value
+    return requests, timings
+
+def escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def labels(**values):
+    return '{' + ','.join(f'{name}="{escape(value)}"' for name, value in values.items()) + '}'
+
+def number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+# Per-route counters: (name, help, slot in the per-route totals)
+ROUTE_COUNTERS = [
+    ('api_request_db_queries_total', 'SQL queries run by requests.', DB_QUERIES),
+    ('api_request_db_seconds_total', 'Time requests spent executing SQL.', DB_SECONDS),
+    ('api_request_serializer_seconds_total',
+     'Time requests spent in serializer to_representation and response rendering.', SERIALIZER_SECONDS),
+    ('api_response_bytes_total', 'Response body bytes sent.', RESPONSE_BYTES),
+]
+
+def render_metrics(requests, timings, buckets):
+    """The merged metrics in the Prometheus text exposition format (version 0.0.4)."""
+    lines = [
+        '# HELP api_requests_total Requests served, by route, method and status code.',
+        '# TYPE api_requests_total counter',
+    ]
+    for (route, method, status), count in sorted(requests.items()):
+        lines.append(f'api_requests_total{labels(route=route, method=method, status=status)} {count}')
+
+    lines += [
+        '# HELP api_request_duration_seconds Request latency, from the first middleware to the rendered response.',
+        '# TYPE api_request_duration_seconds histogram',
+    ]
+    for (route, method), totals in sorted(timings.items()):
+        cumulative = 0
+        for bound, count in zip([*buckets, '+Inf'], totals[FIRST_BUCKET:]):
+            cumulative += count
+            le = bound if bound == '+Inf' else number(float(bound))
+            lines.append(f'api_request_duration_seconds_bucket{labels(route=route, method=method, le=le)} {cumulative}')
+        lines.append(f'api_request_duration_seconds_sum{labels(route=route, method=method)} {number(totals[DURATION])}')
+        lines.append(f'api_request_duration_seconds_count{labels(route=route, method=method)} {totals[COUNT]}')
+
+    for name, help_text, slot in ROUTE_COUNTERS:
+        lines += [f'# HELP {name} {help_text}', f'# TYPE {name} counter']
+        for (route, method), totals in sorted(timings.items()):
+            lines.append(f'{name}{labels(route=route, method=method)} {number(totals[slot])}')
+    return '\n'.join(lines) + '\n'
+
+request_metrics = RequestMetrics()
+# Workers forked from a process that already served requests (gunicorn --preload) start empty
+os.register_at_fork(after_in_child=lambda: request_metrics.reset())
+# A worker shutting down moves its totals, including requests since its last flush, into ARCHIVE
+atexit.register(lambda: request_metrics.retire())
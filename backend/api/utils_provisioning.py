@@ -0,0 +1,86 @@
+from itertools import islice
+from django.contrib.auth.hashers import identify_hasher, make_password
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.models.functions import Lower
+from .models import UserProfile, UserSettings
+
+# Utility functions for provisioning users in bulk (see the provision_users command)
+
+def batched(iterable, size):
+    iterator = iter(iterable)
+    while batch := list(islice(iterator, size)):
+        yield batch
+
+def existing_identities(usernames, emails):
+    """
+    Usernames and lowercased emails among these that already belong to a user: two index scans
+    (the lower(email) index only covers non-blank emails, hence the exclude).
+    """
+    taken_usernames = set(User.objects.filter(username__in=usernames).values_list('username', flat=True))
+    taken_emails = set(
+        User.objects.exclude(email='').annotate(email_lower=Lower('email'))
+        .filter(email_lower__in=emails).values_list('email_lower', flat=True)
+    )
+    return taken_usernames, taken_emails
+
+def usable_hash(password_hash):
+    """Whether a row's password_hash is absent or a hash some configured hasher can verify."""
+    if not password_hash:
+        return True
+    try:
+        identify_hasher(password_hash)
+    except ValueError:
+        return False
+    return True
+
+def provision_users(rows, password=None, batch_size=1000):
+    """
+    Create users with their profile and settings from dicts with username, email and optionally
+    display_name and password_hash. Returns (created, skipped).
+    - Nothing is hashed per user: password_hash must already be a Django password hash (e.g.
+      exported from another Django site); rows without one share `password`, hashed once, or get
+      an unusable password so the user sets one through a reset.
+    - Rows whose username or email (ignoring case) is taken, repeated or missing, or whose
+      password_hash isn't a recognised hash, are skipped.
+    - Each batch is checked with two queries and written with three bulk INSERTs in a transaction.
+    - bulk_create sends no signals, which is fine here: the users are new.
+    """
+    shared_hash = make_password(password) if password else None
+    seen_usernames, seen_emails = set(), set()
+    created = skipped = 0
+
+    for batch in batched(rows, batch_size):
+        candidates = []
+        for row in batch:
+            username = User.normalize_username((row.get('username') or '').strip())
+            email = User.objects.normalize_email((row.get('email') or '').strip())
+            email_lower = email.lower()
+            if not username or not email or username in seen_usernames or email_lower in seen_emails:
+                skipped += 1
+                continue
+            seen_usernames.add(username)
+            seen_emails.add(email_lower)
+            candidates.append((username, email, email_lower, row))
+
+        taken_usernames, taken_emails = existing_identities(
+            [candidate[0] for candidate in candidates], [candidate[2] for candidate in candidates]
+        )
+        users, display_names = [], []
+        for username, email, email_lower, row in candidates:
+            password_hash = row.get('password_hash')
+            if username in taken_usernames or email_lower in taken_emails or not usable_hash(password_hash):
+                skipped += 1
+                continue
+            users.append(User(username=username, email=email, password=password_hash or shared_hash or make_password(None)))
+            display_names.append(row.get('display_name') or username)
+
+        with transaction.atomic():
+            User.objects.bulk_create(users)
+            UserProfile.objects.bulk_create(
+                UserProfile(user=user, display_name=display_name) for user, display_name in zip(users, display_names)
+            )
+            UserSettings.objects.bulk_create(UserSettings(user=user) for user in users)
+        created += len(users)
+
+    return created, skipped
@@ -0,0 +1,93 @@
+import re
+import time
+from collections import Counter
+from contextlib import ExitStack, contextmanager
+from django.db import connections
+
+# Utility functions for per-request SQL instrumentation (see middleware.QueryBudgetMiddleware)
+
+STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+NUMBER_LITERAL = re.compile(r"(?<![\w.\"])-?\d+(?:\.\d+)?\b")
+VALUE_LIST = re.compile(r"\((?:\s*\?\s*(?:::[\w\s()\[\]]+)?\s*,?)+\)")
+WHITESPACE = re.compile(r"\s+")
+
+# Transaction bookkeeping counts towards the total, but repeating it isn't an N+1
+BOOKKEEPING = ('SAVEPOINT', 'RELEASE SAVEPOINT', 'ROLLBACK TO SAVEPOINT')
+
+def fingerprint(sql):
+    """
+    The statement with its literal values removed, so repeats of one query with different
+    parameters (the shape of an N+1) compare equal.
+    """
+    sql = STRING_LITERAL.sub('?', sql)
+    sql = NUMBER_LITERAL.sub('?', sql)
+    sql = VALUE_LIST.sub('(?)', sql)
+    return WHITESPACE.sub(' ', sql).strip()
+
+class QueryRecorder:
+    """
+    Counts and times every statement run while installed as a connection execute wrapper.
+    - With keep_statements, also keeps each statement's SQL (fingerprinted only when
+      duplicates() is asked), so repeated query shapes can be reported. Without it nothing
+      outlives the statement, which is what the always-on metrics path wants.
+    """
+    def __init__(self, keep_statements=True):
+        self.statements = [] if keep_statements else None
+        self.count = 0
+        self.seconds = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.seconds += time.perf_counter() - started
+            self.count += 1
+            if self.statements is not None:
+                self.statements.append(sql)
+
+    def duplicates(self, limit):
+        """Query shapes run more than `limit` times, most repeated first, as (count, fingerprint)."""
+        shapes = Counter(
+            fingerprint(sql) for sql in self.statements
+            if not sql.lstrip().upper().startswith(BOOKKEEPING)
+        )
+        return [(count, shape) for shape, count in shapes.most_common() if count > limit]
+
+@contextmanager
+def record_queries(keep_statements=True):
+    """Record the statements run on every database connection inside the block."""
+    recorder = QueryRecorder(keep_statements)
+    with ExitStack() as stack:
+        for alias in connections:
+            stack.enter_context(connections[alias].execute_wrapper(recorder))
+        yield recorder
+
+class QueryBudgetExceeded(Exception):
+    """Raised (in QUERY_BUDGET_MODE 'raise') when a request breaks its view's query budget."""
+
+def view_budget(request):
+    """
+    The (view name, budget) declared for the view that served this request, or None.
+    - Views declare `query_budgets`, keyed by viewset action (e.g. 'list', 'add_message') or,
+      on plain APIViews, by handler name ('get', 'post').
+    """
+    match = getattr(request, 'resolver_match', None)
+    view = getattr(match.func, 'cls', None) if match else None
+    budgets = getattr(view, 'query_budgets', None)
+    if not budgets:
+        return None
+    actions = getattr(match.func, 'actions', None)
+    action = actions.get(request.method.lower()) if actions else request.method.lower()
+    if action not in budgets:
+        return None
+    return f'{view.__name__}.{action}', budgets[action]
+
+def budget_violations(recorder, budget, duplicate_limit):
+    """Why these queries break the budget: too many in total, or a query shape repeated (an N+1)."""
+    problems = []
+    if recorder.count > budget:
+        problems.append(f"ran {recorder.count} queries, budget is {budget}")
+    for count, shape in recorder.duplicates(duplicate_limit):
+        problems.append(f"repeated {count} times (N+1?): {shape[:300]}")
+    return problems
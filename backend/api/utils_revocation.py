@@ -0,0 +1,150 @@
+import hashlib
+import math
+import threading
+import time
+from datetime import timedelta
+from django.conf import settings
+from django.utils import timezone
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.utils import datetime_from_epoch
+from .models import RevokedToken
+
+# Utility functions for JWT revocation: a RevokedToken table fronted by an in-process bloom filter
+
+# Incremental syncs re-read this far behind the last one, so a revocation committed slightly
+# after its revoked_at timestamp is still picked up (full rebuilds catch anything later)
+SYNC_OVERLAP = timedelta(seconds=60)
+
+# Smallest filter built, so an empty table doesn't force a rebuild after a few revocations
+MIN_CAPACITY = 1024
+
+class BloomFilter:
+    """
+    Fixed-size bloom filter over strings: never a false negative, and false positives at about
+    error_rate while it holds at most `capacity` items.
+    - add() is a read-modify-write of shared bytes: callers adding from several threads serialize it.
+    """
+    def __init__(self, capacity, error_rate):
+        self.capacity = capacity
+        self.size = max(8, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def positions(self, item):
+        # Double hashing: k positions from two 64-bit halves of one digest
+        digest = hashlib.blake2b(item.encode(), digest_size=16).digest()
+        first = int.from_bytes(digest[:8], 'little')
+        second = int.from_bytes(digest[8:], 'little') | 1
+        return [(first + i * second) % self.size for i in range(self.hashes)]
+
+    def add(self, item):
+        for position in self.positions(item):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, item):
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self.positions(item))
+
+class RevocationFilter:
+    """
+    This process's bloom filter over the jti of every unexpired RevokedToken.
+    - Every TOKEN_REVOCATION_SYNC_INTERVAL seconds it adds rows revoked since the last sync (one
+      indexed query); every TOKEN_REVOCATION_REBUILD_INTERVAL seconds, or when it fills up, it is
+      rebuilt from scratch so expired tokens drop out.
+    - Revocations made by this process are added immediately; other processes see them within
+      one sync interval.
+    - A sync runs in one thread at a time; the others keep using the current filter meanwhile.
+    - Additions (from syncs and from revoke_token on request threads) and the swap to a rebuilt
+      filter share add_lock, so no bit is lost to a concurrent add and no revocation made during
+      a rebuild is left out of the new filter.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.add_lock = threading.Lock()
+        self.bloom = None
+        # jtis added while a rebuild is reading the table, replayed into the rebuilt filter
+        self.added_during_rebuild = None
+        self.synced_at = None
+        self.next_sync = self.next_rebuild = 0.0
+
+    def refresh(self, force=False):
+        now = time.monotonic()
+        if not force and now < self.next_sync:
+            return
+        if not self.lock.acquire(blocking=force or self.bloom is None):
+            return
+        try:
+            if force or self.bloom is None or now >= self.next_rebuild or self.bloom.count >= self.bloom.capacity:
+                self.rebuild(now)
+            else:
+                self.sync()
+            self.next_sync = now + settings.TOKEN_REVOCATION_SYNC_INTERVAL
+        finally:
+            self.lock.release()
+
+    def rebuild(self, now):
+        with self.add_lock:
+            self.added_during_rebuild = []
+        started = timezone.now()
+        jtis = list(RevokedToken.objects.filter(expires_at__gt=started).values_list('jti', flat=True))
+        bloom = BloomFilter(max(2 * len(jtis), MIN_CAPACITY), settings.TOKEN_REVOCATION_ERROR_RATE)
+        for jti in jtis:
+            bloom.add(jti)
+        with self.add_lock:
+            for jti in self.added_during_rebuild:
+                bloom.add(jti)
+            self.added_during_rebuild = None
+            self.bloom, self.synced_at = bloom, started
+        self.next_rebuild = now + settings.TOKEN_REVOCATION_REBUILD_INTERVAL
+
+    def sync(self):
+        started = timezone.now()
+        revoked = RevokedToken.objects.filter(revoked_at__gte=self.synced_at - SYNC_OVERLAP, expires_at__gt=started)
+        for jti in revoked.values_list('jti', flat=True):
+            self.add(jti)
+        self.synced_at = started
+
+    def add(self, jti):
+        with self.add_lock:
+            if self.added_during_rebuild is not None:
+                self.added_during_rebuild.append(jti)
+            if self.bloom is not None and jti not in self.bloom:
+                self.bloom.add(jti)
+
+    def __contains__(self, jti):
+        self.refresh()
+        return jti in self.bloom
+
+revocation_filter = RevocationFilter()
+
+def is_revoked(jti):
+    """
+    Whether the token with this jti was revoked.
+    - Tokens the filter hasn't seen (nearly all of them) cost a few hashes and no query.
+    - A filter match is confirmed against the table, so false positives never reject a token.
+    """
+    if jti is None or jti not in revocation_filter:
+        return False
+    return RevokedToken.objects.filter(jti=jti).exists()
+
+def revoke_token(token):
+    """
+    Record a simplejwt token as revoked until it expires. Returns False if it already was, which
+    lets refresh-token rotation reject a token replayed concurrently.
+    """
+    jti = token[api_settings.JTI_CLAIM]
+    _, created = RevokedToken.objects.get_or_create(jti=jti, defaults={
+        'user_id': token[api_settings.USER_ID_CLAIM],
+        'token_type': token[api_settings.TOKEN_TYPE_CLAIM],
+        'expires_at': datetime_from_epoch(token['exp']),
+    })
+    revocation_filter.add(jti)
+    return created
+
+def purge_expired_tokens():
+    """
+    Delete revocations of tokens that have expired anyway, and return how many rows were removed.
+    """
+    deleted, _ = RevokedToken.objects.filter(expires_at__lte=timezone.now()).delete()
+    return deleted
@@ -0,0 +1,160 @@
+import html
+import time
+from contextlib import contextmanager
+from django.conf import settings
+from django.contrib.postgres.search import SearchQuery, SearchRank, TrigramWordSimilarity
+from django.db import connection, transaction
+from django.db.models import Case, F, FloatField, Q, Value, When
+from django.db.models.expressions import RawSQL
+from django.db.models.functions import Greatest
+from .models import Message, MessageBody
+
+# Utility functions for full-text search over message bodies and name search over chats/projects
+
+# ts_headline marks matches with private-use characters, swapped for <mark> after HTML-escaping
+START_SEL, STOP_SEL = '\ue000', '\ue001'
+HEADLINE_OPTIONS = f'StartSel={START_SEL}, StopSel={STOP_SEL}, MaxFragments=2, MaxWords=20, MinWords=5'
+
+def search_query(text):
+    return SearchQuery(text, config=settings.MESSAGE_SEARCH_CONFIG, search_type='websearch')
+
+def search_messages(user, text, project_id=None, chat_id=None):
+    """
+    The user's messages matching text (web search syntax: "phrases", or, -word), best match first.
+    - Matches through the GIN index on message_bodies.search_vector; rows are values() dicts.
+    - Ties on ts_rank go to the newest message.
+    """
+    query = search_query(text)
+    queryset = Message.objects.filter(chat__owner=user, body__search_vector=query)
+    if project_id:
+        queryset = queryset.filter(chat__project_id=project_id)
+    if chat_id:
+        queryset = queryset.filter(chat_id=chat_id)
+    return queryset.annotate(
+        rank=SearchRank(F('body__search_vector'), query)
+    ).order_by('-rank', '-created_at', '-id').values(
+        'id', 'chat_id', 'chat__name', 'chat__project_id', 'role', 'created_at', 'body_id', 'rank'
+    )
+
+# Ancestors of a head (itself included) through the indexed parent links; UNION stops on cycles
+BRANCH_CHAIN_SQL = (
+    "WITH RECURSIVE chain(id, parent_id) AS ("
+    "  SELECT id, parent_id FROM messages WHERE id = %s AND chat_id = %s"
+    "  UNION SELECT m.id, m.parent_id FROM messages m JOIN chain c ON m.id = c.parent_id WHERE m.chat_id = %s"
+    ") SELECT id FROM chain"
+)
+
+def search_branch(chat, head_id, text):
+    """
+    Messages on the branch ending at head_id that match text, best match first, as one query.
+    - The chain is walked in SQL over Message.parent (one primary-key probe per level) and
+      intersected with the full-text match, so a deep or heavily forked chat costs no Python walk.
+    """
+    query = search_query(text)
+    return Message.objects.filter(
+        chat=chat, id__in=RawSQL(BRANCH_CHAIN_SQL, [head_id, chat.pk, chat.pk]), body__search_vector=query,
+    ).annotate(rank=SearchRank(F('body__search_vector'), query)).order_by('-rank', 'created_at', 'id')
+
+def message_snippets(text, rows):
+    """
+    Map body hash -> HTML-escaped snippet with matches wrapped in <mark>, for a page of search rows.
+    - Two queries however long the page: the bodies, then one ts_headline over all of them.
+    """
+    hashes = list({row['body_id'] for row in rows})
+    if not hashes:
+        return {}
+    bodies = dict(MessageBody.objects.filter(pk__in=hashes).values_list('pk', 'content'))
+    hashes = [digest for digest in hashes if digest in bodies]
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT ts_headline(%s::regconfig, doc, websearch_to_tsquery(%s::regconfig, %s), %s) "
+            "FROM unnest(%s::text[]) WITH ORDINALITY AS d(doc, n) ORDER BY n",
+            [settings.MESSAGE_SEARCH_CONFIG, settings.MESSAGE_SEARCH_CONFIG, text, HEADLINE_OPTIONS,
+             [bodies[digest][:settings.MESSAGE_SEARCH_MAX_CHARS] for digest in hashes]],
+        )
+        headlines = [headline for headline, in cursor.fetchall()]
+    return {
+        digest: html.escape(headline).replace(START_SEL, '<mark>').replace(STOP_SEL, '</mark>')
+        for digest, headline in zip(hashes, headlines)
+    }
+
+def index_message_bodies(batch_size=500, pause=0.0):
+    """
+    Background backfill: fill search_vector for bodies stored before full-text search existed.
+    - Walks bodies in hash order in short batches; content is decompressed here, not in SQL.
+    - Returns the number of bodies indexed.
+    """
+    last_pk, total = '', 0
+    while True:
+        rows = list(
+            MessageBody.objects.filter(search_vector__isnull=True, pk__gt=last_pk)
+            .order_by('pk').values_list('pk', 'content')[:batch_size]
+        )
+        if not rows:
+            return total
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "UPDATE message_bodies b SET search_vector = to_tsvector(%s::regconfig, d.doc) "
+                "FROM unnest(%s::text[], %s::text[]) AS d(hash, doc) WHERE b.hash = d.hash",
+                [settings.MESSAGE_SEARCH_CONFIG, [pk for pk, _ in rows],
+                 [content[:settings.MESSAGE_SEARCH_MAX_CHARS] for _, content in rows]],
+            )
+        last_pk, total = rows[-1][0], total + len(rows)
+        if pause:
+            time.sleep(pause)
+
+# pg_trgm stays once installed, so a yes is kept for good; a no is re-checked after this long,
+# so installing the extension on a running deployment needs no restart
+TRIGRAM_RECHECK_SECONDS = 60
+trigram_state = {'available': False, 'checked_at': None}
+
+def trigram_available():
+    """
+    Whether pg_trgm is installed (migration 0012 installs it and its indexes when the server has it).
+    """
+    if trigram_state['available']:
+        return True
+    now = time.monotonic()
+    if trigram_state['checked_at'] is not None and now - trigram_state['checked_at'] < TRIGRAM_RECHECK_SECONDS:
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'")
+        available = cursor.fetchone() is not None
+    trigram_state.update(available=available, checked_at=now)
+    return available
+
+def match_names(queryset, text):
+    """
+    Filter a Project or Chat queryset to rows whose name or description matches text as typed.
+    - From 3 characters, typo-tolerant word similarity (`%>`), served by the pg_trgm GIN indexes.
+    - Shorter text matches name prefixes; without pg_trgm, longer text matches substrings.
+    - Ordered by name prefix match, then similarity, then most recently updated.
+    """
+    if len(text) >= 3 and trigram_available():
+        queryset = queryset.filter(
+            Q(name__trigram_word_similar=text) | Q(description__trigram_word_similar=text)
+        ).annotate(score=Greatest(TrigramWordSimilarity(text, 'name'), TrigramWordSimilarity(text, 'description')))
+    else:
+        matches = Q(name__icontains=text) | Q(description__icontains=text) if len(text) >= 3 else Q(name__istartswith=text)
+        queryset = queryset.filter(matches).annotate(score=Value(0.0, output_field=FloatField()))
+    prefix = Case(When(name__istartswith=text, then=Value(1)), default=Value(0))
+    return queryset.annotate(prefix=prefix).order_by('-prefix', '-score', '-updated_at')
+
+@contextmanager
+def statement_timeout(milliseconds):
+    """
+    Cap each query inside the block; an overrun raises OperationalError and rolls the block back.
+    - Runs in its own transaction (a savepoint when nested) and restores the previous timeout.
+    """
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT current_setting('statement_timeout'), set_config('statement_timeout', %s, true)",
+            [str(milliseconds)],
+        )
+        previous = cursor.fetchone()[0]
+        yield
+        cursor.execute("SELECT set_config('statement_timeout', %s, true)", [previous])
+
+def is_query_canceled(error):
+    # SQLSTATE 57014: query_canceled, which is what statement_timeout raises
+    return getattr(error.__cause__, 'pgcode', None) == '57014'
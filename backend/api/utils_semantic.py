@@ -0,0 +1,338 @@
+import fcntl
+import logging
+import os
+import shutil
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from django.conf import settings
+from .embeddings import get_embedder, numpy
+from .models import Message, MessageBody, MessageEmbedding
+
+logger = logging.getLogger(__name__)
+
+# Utility functions for semantic search: per-user approximate nearest-neighbour indexes on disk
+
+def semantic_search_available():
+    return numpy is not None and settings.SEMANTIC_SEARCH_ENABLED
+
+def kmeans(vectors, lists, iterations=10, sample_size=None, seed=0):
+    """
+    Spherical k-means centroids (unit rows) for IVF partitioning, trained on a sample.
+    - Empty clusters are re-seeded from random rows, so every list gets members.
+    """
+    rng = numpy.random.default_rng(seed)
+    sample_size = sample_size or lists * 64
+    sample = vectors[rng.choice(len(vectors), min(len(vectors), sample_size), replace=False)]
+    centroids = sample[rng.choice(len(sample), lists, replace=False)].copy()
+    for _ in range(iterations):
+        assign = numpy.argmax(sample @ centroids.T, axis=1)
+        sums = numpy.zeros_like(centroids)
+        numpy.add.at(sums, assign, sample)
+        empty = numpy.bincount(assign, minlength=lists) == 0
+        sums[empty] = sample[rng.choice(len(sample), int(empty.sum()))]
+        centroids = sums / numpy.maximum(numpy.linalg.norm(sums, axis=1, keepdims=True), 1e-12)
+    return centroids.astype(numpy.float32)
+
+def assign_lists(vectors, centroids, chunk=65536):
+    return numpy.concatenate([
+        numpy.argmax(vectors[start:start + chunk] @ centroids.T, axis=1) for start in range(0, len(vectors), chunk)
+    ]) if len(vectors) else numpy.zeros(0, dtype=numpy.int64)
+
+class SemanticIndex:
+    """
+    One user's IVF (inverted file) index over unit vectors, memory-mapped from a directory.
+    - The base is a generation directory (centroids, vectors grouped by list, list offsets,
+      keys) named by the CURRENT file; searches scan only the `nprobe` closest lists.
+    - New vectors are appended to a delta file that every search scans exhaustively; once it
+      holds SEMANTIC_INDEX_DELTA_MAX rows the base is rebuilt with it merged in, off the request
+      (see schedule_merge).
+    - Keys are (message id, body hash), so hits whose message was edited or deleted since
+      can be dropped when they are checked against the database.
+    """
+    key_dtype = numpy.dtype([('message', 'V16'), ('body', 'V32')]) if numpy is not None else None
+
+    def __init__(self, directory, dim):
+        self.directory = str(directory)
+        self.dim = dim
+        self.delta_dtype = numpy.dtype(self.key_dtype.descr + [('vector', '<f4', (dim,))])
+
+    @staticmethod
+    def make_keys(pairs):
+        """Keys array for (message id, body hash) pairs."""
+        keys = numpy.zeros(len(pairs), dtype=SemanticIndex.key_dtype)
+        for row, (message_id, body) in enumerate(pairs):
+            keys[row] = (uuid.UUID(str(message_id)).bytes, bytes.fromhex(body))
+        return keys
+
+    @contextmanager
+    def lock(self, name='lock'):
+        """
+        Exclusive file lock: 'lock' guards the delta and CURRENT, 'merge' one rebuild at a time.
+        - Take 'merge' before 'lock' when holding both.
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        with open(os.path.join(self.directory, name), 'a') as handle:
+            fcntl.flock(handle, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(handle, fcntl.LOCK_UN)
+
+    def load_base(self):
+        """(centroids, offsets, vectors, keys) of the current generation, memory-mapped, or None."""
+        try:
+            with open(os.path.join(self.directory, 'CURRENT')) as handle:
+                generation = os.path.join(self.directory, handle.read().strip())
+            return tuple(
+                numpy.load(os.path.join(generation, f'{part}.npy'), mmap_mode='r')
+                for part in ('centroids', 'offsets', 'vectors', 'keys')
+            )
+        except FileNotFoundError:
+            return None
+
+    def load_delta(self):
+        path = os.path.join(self.directory, 'delta')
+        try:
+            rows = os.path.getsize(path) // self.delta_dtype.itemsize
+        except FileNotFoundError:
+            rows = 0
+        if not rows:
+            return numpy.zeros(0, dtype=self.delta_dtype)
+        # A concurrent append may have written a partial record; only whole rows are mapped
+        return numpy.memmap(path, dtype=self.delta_dtype, mode='r', shape=(rows,))
+
+    def add(self, keys, vectors):
+        """
+        Append rows to the delta file; returns how many rows the delta now holds.
+        """
+        records = numpy.zeros(len(keys), dtype=self.delta_dtype)
+        records['message'], records['body'], records['vector'] = keys['message'], keys['body'], vectors
+        with self.lock():
+            with open(os.path.join(self.directory, 'delta'), 'ab') as handle:
+                handle.write(records.tobytes())
+            return len(self.load_delta())
+
+    def build(self, keys, vectors, lists=None):
+        """
+        Write a new base generation for these rows and empty the delta (callers hold both locks).
+        """
+        self.publish(self.write_generation(keys, vectors, lists))
+
+    def write_generation(self, keys, vectors, lists=None):
+        """
+        Write a base generation directory for these rows and return its name; searches don't see it yet.
+        - Defaults to about sqrt(rows) lists; below SEMANTIC_INDEX_IVF_THRESHOLD rows there is
+          a single list, i.e. an exact scan.
+        """
+        vectors = numpy.ascontiguousarray(vectors, dtype=numpy.float32).reshape(-1, self.dim)
+        if lists is None:
+            lists = int(len(vectors) ** 0.5) if len(vectors) >= settings.SEMANTIC_INDEX_IVF_THRESHOLD else 1
+        lists = max(1, min(lists, len(vectors)))
+        if lists > 1:
+            centroids = kmeans(vectors, lists)
+            assign = assign_lists(vectors, centroids)
+        else:
+            centroids = numpy.zeros((1, self.dim), dtype=numpy.float32)
+            assign = numpy.zeros(len(vectors), dtype=numpy.int64)
+        order = numpy.argsort(assign, kind='stable')
+        offsets = numpy.concatenate([[0], numpy.cumsum(numpy.bincount(assign, minlength=lists))]).astype(numpy.int64)
+
+        name = f'gen-{time.time_ns()}'
+        generation = os.path.join(self.directory, name)
+        os.makedirs(generation)
+        for part, array in (('centroids', centroids), ('offsets', offsets), ('vectors', vectors[order]), ('keys', keys[order])):
+            numpy.save(os.path.join(generation, f'{part}.npy'), array)
+        return name
+
+    def publish(self, name, delta=None):
+        """
+        Switch CURRENT to a written generation and replace the delta with `delta` (callers hold the lock).
+        """
+        pointer = os.path.join(self.directory, 'CURRENT.tmp')
+        with open(pointer, 'w') as handle:
+            handle.write(name)
+        os.replace(pointer, os.path.join(self.directory, 'CURRENT'))
+        # Swapped in whole, so a search that already mapped the old delta keeps reading it
+        partial = os.path.join(self.directory, 'delta.tmp')
+        with open(partial, 'wb') as handle:
+            if delta is not None:
+                handle.write(delta.tobytes())
+        os.replace(partial, os.path.join(self.directory, 'delta'))
+        # Keep the previous generation for searches that loaded CURRENT just before the switch
+        generations = sorted(entry for entry in os.listdir(self.directory) if entry.startswith('gen-'))
+        for stale in generations[:-2]:
+            shutil.rmtree(os.path.join(self.directory, stale), ignore_errors=True)
+
+    def merge(self):
+        """
+        Rebuild the base with the delta folded in; a message's newest row wins.
+        - The delta lock is held only to snapshot and to publish, so add() (on the request
+          path) never waits for the rebuild; rows added meanwhile stay in the new delta.
+        """
+        with self.lock('merge'):
+            with self.lock():
+                base, delta = self.load_base(), numpy.array(self.load_delta())
+            keys = numpy.concatenate([base[3], delta[['message', 'body']].astype(self.key_dtype)]) if base else \
+                delta[['message', 'body']].astype(self.key_dtype)
+            vectors = numpy.concatenate([base[2], delta['vector']]) if base else delta['vector']
+            # Last occurrence of each message: unique() on the reversed keys
+            _, last = numpy.unique(keys['message'][::-1], return_index=True)
+            keep = numpy.sort(len(keys) - 1 - last)
+            name = self.write_generation(keys[keep], vectors[keep])
+            with self.lock():
+                self.publish(name, numpy.array(self.load_delta()[len(delta):]))
+
+    def search(self, query, k, nprobe):
+        """
+        Up to k (message id, body hash, score) hits by cosine similarity, best first.
+        """
+        query = numpy.asarray(query, dtype=numpy.float32)
+        key_parts, vector_parts = [], []
+        base = self.load_base()
+        if base is not None:
+            centroids, offsets, vectors, keys = base
+            probe = numpy.argsort(-(centroids @ query))[:nprobe]
+            for lst in probe:
+                start, end = offsets[lst], offsets[lst + 1]
+                key_parts.append(keys[start:end])
+                vector_parts.append(vectors[start:end])
+        delta = self.load_delta()
+        if len(delta):
+            key_parts.append(delta[['message', 'body']].astype(self.key_dtype))
+            vector_parts.append(delta['vector'])
+        if not key_parts:
+            return []
+        keys = numpy.concatenate(key_parts)
+        scores = numpy.concatenate(vector_parts) @ query
+        top = numpy.argsort(-scores)[:k * 2] if len(scores) <= k * 2 else \
+            numpy.argpartition(-scores, k * 2)[:k * 2]
+        hits, seen = [], set()
+        for row in top[numpy.argsort(-scores[top])]:
+            message = uuid.UUID(bytes=bytes(keys[row]['message']))
+            if message not in seen:
+                seen.add(message)
+                hits.append((message, bytes(keys[row]['body']).hex(), float(scores[row])))
+        return hits[:k]
+
+def user_index(user_id):
+    embedder = get_embedder()
+    return SemanticIndex(os.path.join(settings.SEMANTIC_INDEX_DIR, embedder.name, str(user_id)), embedder.dim)
+
+def embed_bodies(hashes):
+    """
+    Map body hash -> vector for the current embedder, embedding and storing any missing ones.
+    """
+    embedder = get_embedder()
+    hashes = list(dict.fromkeys(hashes))
+    stored = dict(
+        MessageEmbedding.objects.filter(body_id__in=hashes, model=embedder.name).values_list('body_id', 'vector')
+    )
+    vectors = {digest: numpy.frombuffer(bytes(vector), dtype='<f4') for digest, vector in stored.items()}
+    missing = dict(MessageBody.objects.filter(pk__in=[h for h in hashes if h not in stored]).values_list('pk', 'content'))
+    if missing:
+        embedded = embedder.embed(list(missing.values()))
+        MessageEmbedding.objects.bulk_create(
+            [MessageEmbedding(body_id=digest, model=embedder.name, vector=vector.tobytes())
+             for digest, vector in zip(missing, embedded)],
+            update_conflicts=True, unique_fields=['body'], update_fields=['model', 'vector'],
+        )
+        vectors.update(zip(missing, embedded))
+    return vectors
+
+# Delta merges run here, one at a time, so no request waits for a rebuild
+merge_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='semantic-merge')
+pending_merges = set()
+pending_merges_lock = threading.Lock()
+
+def schedule_merge(index):
+    """
+    Merge an index's delta on the background merge thread; a merge already queued for it is enough.
+    """
+    with pending_merges_lock:
+        if index.directory in pending_merges:
+            return
+        pending_merges.add(index.directory)
+
+    def run():
+        with pending_merges_lock:
+            pending_merges.discard(index.directory)
+        try:
+            index.merge()
+        except Exception:
+            logger.exception("Could not merge the semantic index delta in %s", index.directory)
+
+    merge_executor.submit(run)
+
+def index_messages(user_id, messages):
+    """
+    Add just-written messages to their owner's index; schedules a merge once the delta is large.
+    - Runs after commit, and only appends to the delta: the merge runs on a background thread.
+    - The index can always be rebuilt from the database, so a failure here is logged rather
+      than failing the request.
+    """
+    if not semantic_search_available():
+        return
+    try:
+        vectors = embed_bodies([message.body_id for message in messages])
+        indexed = [message for message in messages if message.body_id in vectors]
+        index = user_index(user_id)
+        keys = SemanticIndex.make_keys([(message.id, message.body_id) for message in indexed])
+        if index.add(keys, numpy.stack([vectors[message.body_id] for message in indexed])) >= settings.SEMANTIC_INDEX_DELTA_MAX:
+            schedule_merge(index)
+    except Exception:
+        logger.exception("Could not add messages to the semantic index of user %s", user_id)
+
+def rebuild_user_index(user_id, lists=None, batch_size=2000):
+    """
+    Rebuild a user's index from the database, embedding bodies that have no vector yet.
+    - Returns the number of messages indexed.
+    """
+    pairs, vectors = [], []
+    queryset = Message.objects.filter(chat__owner_id=user_id).order_by('pk').values_list('pk', 'body_id')
+    last_pk = None
+    while True:
+        batch = list((queryset.filter(pk__gt=last_pk) if last_pk else queryset)[:batch_size])
+        if not batch:
+            break
+        embedded = embed_bodies([body for _, body in batch])
+        pairs += batch
+        vectors += [embedded[body] for _, body in batch]
+        last_pk = batch[-1][0]
+    index = user_index(user_id)
+    with index.lock('merge'), index.lock():
+        index.build(
+            SemanticIndex.make_keys(pairs),
+            numpy.stack(vectors) if vectors else numpy.zeros((0, index.dim), dtype=numpy.float32),
+            lists,
+        )
+    return len(pairs)
+
+def semantic_search(user, text, limit):
+    """
+    The user's messages closest in meaning to text, best first, as dicts with a `score`.
+    - Over-fetches from the index, then drops hits whose message was deleted or edited.
+    """
+    hits = user_index(user.id).search(get_embedder().embed([text])[0], limit * 3, settings.SEMANTIC_INDEX_NPROBE)
+    rows = {
+        row['id']: row for row in Message.objects.filter(id__in=[hit[0] for hit in hits], chat__owner=user).values(
+            'id', 'body_id', 'chat_id', 'chat__name', 'role', 'created_at', 'body__content'
+        )
+    }
+    results = []
+    for message_id, body, score in hits:
+        row = rows.get(message_id)
+        if row is None or row['body_id'] != body:
+            continue
+        results.append({
+            'id': message_id,
+            'chat_id': row['chat_id'],
+            'chat_name': row['chat__name'],
+            'role': row['role'],
+            'created_at': row['created_at'],
+            'score': round(score, 4),
+            'preview': row['body__content'][:200],
+        })
+    return results[:limit]
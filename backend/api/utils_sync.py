@@ -0,0 +1,106 @@
+from datetime import timedelta
+from django.db import connection
+from django.db.models import Q
+from django.db.models.expressions import RawSQL
+from django.utils import timezone
+from .models import Project, Chat, Message, Branch, ChangeLog
+from .serializers import ProjectSerializer, ChatSerializer, message_rows, sparse_only
+
+# Utility functions for delta sync over the ChangeLog sequence
+#
+# Rows are read in (txid, id) order, not id order: ids are handed out when a row is
+# written but become visible only at commit, so a slow transaction could commit an id
+# below a cursor a client already holds. Only rows from transactions older than every
+# transaction still running are returned (plus the reader's own writes), and any
+# transaction that commits later has a larger txid than all of them.
+
+def encode_cursor(change):
+    return f"{change.txid}-{change.id}"
+
+def decode_cursor(cursor):
+    """
+    Return (txid, id) from a cursor string; raises ValueError on malformed input.
+    """
+    txid, pk = cursor.split('-')
+    return int(txid), int(pk)
+
+def changes_since(user, cursor=None, limit=500):
+    """
+    Return (latest change per entity, next cursor, has_more) for a user's changes after cursor.
+    - Several changes to one entity within the page collapse into the last one.
+    """
+    changes = ChangeLog.objects.filter(owner_id=user.pk).filter(
+        Q(txid__lt=RawSQL("txid_snapshot_xmin(txid_current_snapshot())", []))
+        | Q(txid=RawSQL("txid_current_if_assigned()", []))
+    )
+    if cursor:
+        txid, pk = decode_cursor(cursor)
+        changes = changes.filter(Q(txid__gt=txid) | Q(txid=txid, id__gt=pk))
+    rows = list(changes.order_by('txid', 'id')[:limit + 1])
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    latest = {(change.entity, change.entity_id): change for change in rows}
+    next_cursor = encode_cursor(rows[-1]) if rows else cursor
+    return list(latest.values()), next_cursor, has_more
+
+def serialize_changes(user, changes):
+    """
+    Current state of every changed entity plus tombstones, grouped by entity type.
+    - One query per entity type that has changes; rows deleted since logging count as deleted.
+    """
+    changed = {entity: [] for entity in ChangeLog.Entity.values}
+    deleted = {entity: [] for entity in ChangeLog.Entity.values}
+    for change in changes:
+        (deleted if change.deleted else changed)[change.entity].append(change.entity_id)
+
+    payload = {'projects': [], 'chats': [], 'messages': [], 'branches': []}
+    if changed['project']:
+        projects = Project.objects.filter(owner=user, id__in=changed['project'])
+        payload['projects'] = ProjectSerializer(projects, many=True).data
+    if changed['chat']:
+        chats = sparse_only(Chat.objects.filter(owner=user, id__in=changed['chat']), ChatSerializer)
+        payload['chats'] = ChatSerializer(chats, many=True).data
+    if changed['message']:
+        payload['messages'] = message_rows(Message.objects.filter(chat__owner=user, id__in=changed['message']))
+    if changed['branch']:
+        payload['branches'] = [
+            {
+                'branch_id': str(branch_id),
+                'chat': str(chat_id),
+                'head_message_id': str(head_id) if head_id else None,
+            }
+            for branch_id, chat_id, head_id in Branch.objects.filter(
+                chat__owner=user, branch_id__in=changed['branch']
+            ).values_list('branch_id', 'chat_id', 'head_message_id')
+        ]
+
+    # A row changed and then deleted by a transaction the page doesn't include yet
+    found = {
+        'project': {p['id'] for p in payload['projects']},
+        'chat': {c['id'] for c in payload['chats']},
+        'message': {m['id'] for m in payload['messages']},
+        'branch': {b['branch_id'] for b in payload['branches']},
+    }
+    for entity, ids in changed.items():
+        deleted[entity] += [pk for pk in ids if str(pk) not in found[entity]]
+
+    payload['deleted'] = {
+        key: [str(pk) for pk in deleted[entity]]
+        for key, entity in [('projects', 'project'), ('chats', 'chat'), ('messages', 'message'), ('branches', 'branch')]
+    }
+    return payload
+
+def compact_change_log(older_than=timedelta(days=7)):
+    """
+    Delete log rows superseded by a later change to the same entity; returns the number deleted.
+    - Safe for every cursor: a client before the deleted row is also before its replacement.
+    - The newest row per entity (including tombstones) is always kept.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "DELETE FROM change_log c WHERE c.created_at < %s AND EXISTS ("
+            "  SELECT 1 FROM change_log n WHERE n.entity_id = c.entity_id AND n.entity = c.entity"
+            "  AND (n.txid, n.id) > (c.txid, c.id))",
+            [timezone.now() - older_than],
+        )
+        return cursor.rowcount
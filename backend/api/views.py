@@ -6,16 +6,62 @@ from rest_framework import status, permissions, viewsets
 from rest_framework.decorators import api_view, action
 from django.shortcuts import get_object_or_404
 from django.contrib.auth.models import User
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, OuterRef, Prefetch, Subquery, Value
+from django.db.models.functions import Coalesce, Lower
+from django.contrib.auth.hashers import make_password
+from django.conf import settings
+from django.core.cache import cache
 from rest_framework import serializers
-from .models import UserProfile, Project, Chat, Message, UserSettings, Branch
+from .models import UserProfile, Project, Chat, Message, MessageBody, UserSettings, Branch, Edit
 from .serializers import (
     UserSerializer, UserProfileSerializer, ProjectSerializer, 
-    ChatSerializer, MessageSerializer, ChatDetailSerializer,
+    ChatSerializer, MessageSerializer, MessageContentSerializer, ChatDetailSerializer,
     ProjectDetailSerializer, MessageDetailSerializer, UserSettingsSerializer,
-    DashboardProjectSerializer, DashboardChatSerializer
+    DashboardProjectSerializer, DashboardChatSerializer, message_rows,
+    sparse_only, sparse_spec, kept_field_names
 )
-from rest_framework_simplejwt.serializers import TokenObtainPairSerializer
-from rest_framework_simplejwt.views import TokenObtainPairView
+from .utils_message_graph import add_message_to_graph, edit_message_in_graph, get_branch_from_head
+from .utils_idempotency import get_idempotency_key, replay_response, store_response
+from .utils_counters import adjust_message_count, move_chat_count
+from .utils_cache import dashboard_cache_key, bump_dashboard_version
+from .utils_semantic import index_messages
+from .utils_revocation import is_revoked, revoke_token
+from .utils_auth import get_principal, unique_violation_field
+from .utils_conditional import (
+    conditional_get, chat_list_validators, project_list_validators, chat_messages_validators, message_validators
+)
+from .pagination import MessageKeysetPagination, EstimatedCountPagination, HasMorePagination
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.serializers import TokenObtainPairSerializer, TokenRefreshSerializer
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.tokens import RefreshToken
+from rest_framework_simplejwt.views import TokenObtainPairView, TokenRefreshView
+
+# ---
+# AI response generation (stubbed model call)
+# ---
+def generate_ai_content(user_content):
+    """
+    Build the assistant reply for a user message.
+    - Returns a Python snippet when the user asks for code, plain text otherwise.
+    """
+    ai_content = f"This is a standard text response for your query about: {user_content}"
+
+    # If user asks for code, provide a Python snippet
+    lowered = user_content.lower()
+    if 'code' in lowered or 'python' in lowered:
+        code_snippet = (
+            "def process_data(data_source):\n"
+            "    # This is a sample code block.\n"
+            "    items = [1, 2, 3, 4, 5]\n"
+            "    for item in items:\n"
+            "        print(f'Processing item: {item}')\n"
+            "    return 'Completed'"
+        )
+        ai_content = f"```python\n{code_snippet}\n```"
+    return ai_content
 
 # ---
 # Custom Permission: Only allow owners to edit their own objects
@@ -25,22 +71,58 @@ class IsOwnerOrReadOnly(permissions.BasePermission):
     Custom permission to only allow owners of an object to edit it.
     - SAFE_METHODS (GET, HEAD, OPTIONS) are always allowed.
     - For write operations (POST, PUT, PATCH, DELETE), only the owner can edit.
+    - Compares owner ids, so the check needs no query: owner_id/user_id are columns, and
+      objects owned through their chat carry an annotated chat_owner_id (see MessageViewSet).
     """
     def has_object_permission(self, request, view, obj):
         if request.method in permissions.SAFE_METHODS:
             return True
-        if hasattr(obj, 'owner'):
-            return obj.owner == request.user
-        elif hasattr(obj, 'user'):
-            return obj.user == request.user
-        elif hasattr(obj, 'chat') and hasattr(obj.chat, 'owner'):
-            return obj.chat.owner == request.user
-        return False
+        return self.owner_id(obj) == request.user.pk
+    
+    @staticmethod
+    def owner_id(obj):
+        for attname in ('owner_id', 'user_id', 'chat_owner_id'):
+            if hasattr(obj, attname):
+                return getattr(obj, attname)
+        if hasattr(obj, 'chat_id'):
+            # Not annotated: fall back to one lookup rather than loading the chat row
+            return next(iter(Chat.objects.filter(pk=obj.chat_id).values_list('owner_id', flat=True)), None)
+        return None
+
+# ---
+# Mixin: only read the columns the response will contain
+# ---
+class SparseQuerysetMixin:
+    """
+    Applies ?fields= / ?expand= to list and retrieve querysets via .only().
+    - Without ?fields= the serializer's own fields are loaded, so large unlisted
+      columns (e.g. Chat.message_graph) are never read.
+    """
+    def filter_queryset(self, queryset):
+        queryset = super().filter_queryset(queryset)
+        if self.action in ('list', 'retrieve'):
+            queryset = sparse_only(queryset, self.get_serializer_class(), self.request)
+        return queryset
+
+# ---
+# Mixin: invalidate the owner's cached dashboard after any successful write
+# ---
+class DashboardInvalidationMixin:
+    """
+    Bumps the user's dashboard cache stamp after successful non-safe requests.
+    - Mixed into every viewset that writes data shown on the dashboard.
+    """
+    def finalize_response(self, request, response, *args, **kwargs):
+        if (request.method not in permissions.SAFE_METHODS
+                and response.status_code < 400
+                and request.user.is_authenticated):
+            bump_dashboard_version(request.user.id)
+        return super().finalize_response(request, response, *args, **kwargs)
 
 # ---
 # User Profile ViewSet
 # ---
-class UserProfileViewSet(viewsets.ModelViewSet):
+class UserProfileViewSet(SparseQuerysetMixin, DashboardInvalidationMixin, viewsets.ModelViewSet):
     """
     API endpoint for viewing and editing the current user's profile.
     - Each user has one profile (extra info: display name, avatar, bio, memory).
@@ -48,10 +130,14 @@ class UserProfileViewSet(viewsets.ModelViewSet):
     """
     serializer_class = UserProfileSerializer
     permission_classes = [permissions.IsAuthenticated, IsOwnerOrReadOnly]
+    # Most SQL queries per action (QueryBudgetMiddleware); a repeated query shape fails regardless
+    query_budgets = {
+        'list': 2, 'retrieve': 1, 'create': 1, 'update': 2, 'partial_update': 2, 'destroy': 2,
+    }
     
     def get_queryset(self):
-        # Only allow users to see their own profile
-        return UserProfile.objects.filter(user=self.request.user)
+        # Only allow users to see their own profile; the serializer nests the user
+        return UserProfile.objects.filter(user=self.request.user).select_related('user')
     
     def perform_create(self, serializer):
         # When creating, link the profile to the current user
@@ -60,7 +146,7 @@ class UserProfileViewSet(viewsets.ModelViewSet):
 # ---
 # Project ViewSet
 # ---
-class ProjectViewSet(viewsets.ModelViewSet):
+class ProjectViewSet(SparseQuerysetMixin, DashboardInvalidationMixin, viewsets.ModelViewSet):
     """
     API endpoint for managing projects.
     - Projects group related chats together (like folders).
@@ -70,10 +156,28 @@ class ProjectViewSet(viewsets.ModelViewSet):
     """
     serializer_class = ProjectSerializer
     permission_classes = [permissions.IsAuthenticated, IsOwnerOrReadOnly]
+    pagination_class = EstimatedCountPagination
+    # Deletes cascade through a fixed set of tables, so their cost doesn't grow with the rows
+    query_budgets = {
+        'list': 4, 'retrieve': 3, 'create': 1, 'update': 2, 'partial_update': 2, 'destroy': 15,
+        'create_chat': 5, 'rename': 2, 'chats': 2, 'delete_chat': 13,
+    }
     
     def get_queryset(self):
         # Only show projects owned by the current user
-        return Project.objects.filter(owner=self.request.user)
+        queryset = Project.objects.filter(owner=self.request.user)
+        if self.action == 'retrieve' and 'chats' in kept_field_names(
+            ProjectDetailSerializer().fields.keys(), sparse_spec(self.request)
+        ):
+            # Embedded chats are trimmed by ?fields=chats.<name> as well; the prefetch
+            # matches chats to their project by project_id, so it is always selected
+            chats = sparse_only(Chat.objects.all(), ChatSerializer, self.request, path='chats', always=('project',))
+            queryset = queryset.prefetch_related(Prefetch('chats', queryset=chats))
+        return queryset
+    
+    def list(self, request, *args, **kwargs):
+        # Polled by the frontend: answer 304 from one change-counter lookup when nothing changed
+        return conditional_get(request, project_list_validators(request.user), lambda: super(ProjectViewSet, self).list(request, *args, **kwargs))
     
     def get_serializer_class(self):
         # Use a detailed serializer for single project view, minimal for list
@@ -87,6 +191,11 @@ class ProjectViewSet(viewsets.ModelViewSet):
         # Set the owner to the current user when creating
         serializer.save(owner=self.request.user)
     
+    def perform_destroy(self, instance):
+        # The cascade deletes every message: release their bodies in one UPDATE
+        with transaction.atomic(), MessageBody.objects.deferred_release():
+            instance.delete()
+    
     @action(detail=True, methods=['post'])
     def create_chat(self, request, pk=None):
         """
@@ -95,15 +204,17 @@ class ProjectViewSet(viewsets.ModelViewSet):
         - Only the project owner can add chats.
         """
         project = self.get_object()
+        # The project is passed to save() rather than validated again from its id
         chat_data = {
             'name': request.data.get('name', 'New Chat'),
-            'project': project.id,
             'description': request.data.get('description', ''),
             'ai_model': request.data.get('ai_model', ''),
         }
         serializer = ChatSerializer(data=chat_data, context={'request': request})
         if serializer.is_valid():
-            serializer.save(owner=request.user, project=project)
+            with transaction.atomic():
+                chat = serializer.save(owner=request.user, project=project)
+                move_chat_count(None, False, project.id, chat.status == Chat.Status.ACTIVE)
             return Response(serializer.data, status=status.HTTP_201_CREATED)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
     
@@ -118,7 +229,7 @@ class ProjectViewSet(viewsets.ModelViewSet):
         new_name = request.data.get('name')
         if new_name:
             project.name = new_name
-            project.save()
+            project.save(update_fields=['name', 'updated_at'])
             serializer = self.get_serializer(project)
             return Response(serializer.data)
         return Response({'error': 'Name is required'}, status=status.HTTP_400_BAD_REQUEST)
@@ -148,7 +259,9 @@ class ProjectViewSet(viewsets.ModelViewSet):
         if chat_id:
             try:
                 chat = project.chats.get(id=chat_id, owner=request.user)
-                chat.delete()
+                with transaction.atomic(), MessageBody.objects.deferred_release():
+                    chat.delete()
+                    move_chat_count(project.id, chat.status == Chat.Status.ACTIVE, None, False)
                 return Response({'message': 'Chat deleted successfully'}, status=status.HTTP_204_NO_CONTENT)
             except Chat.DoesNotExist:
                 return Response({'error': 'Chat not found'}, status=status.HTTP_404_NOT_FOUND)
@@ -157,7 +270,7 @@ class ProjectViewSet(viewsets.ModelViewSet):
 # ---
 # Chat ViewSet
 # ---
-class ChatViewSet(viewsets.ModelViewSet):
+class ChatViewSet(SparseQuerysetMixin, DashboardInvalidationMixin, viewsets.ModelViewSet):
     """
     API endpoint for managing chats (conversations).
     - Each chat belongs to a user and (optionally) a project.
@@ -167,10 +280,24 @@ class ChatViewSet(viewsets.ModelViewSet):
     """
     serializer_class = ChatSerializer
     permission_classes = [permissions.IsAuthenticated, IsOwnerOrReadOnly]
+    pagination_class = EstimatedCountPagination
+    # add_message's ceiling includes an Idempotency-Key lookup and the stored replay
+    query_budgets = {
+        'list': 4, 'retrieve': 4, 'create': 6, 'update': 5, 'partial_update': 5, 'destroy': 13,
+        'add_message': 21, 'update_status': 5, 'rename': 2, 'messages': 3,
+    }
     
     def get_queryset(self):
         # Only show chats owned by the current user
-        return Chat.objects.filter(owner=self.request.user)
+        queryset = Chat.objects.filter(owner=self.request.user)
+        if self.action == 'list':
+            # The list serializer reads project.name for every chat
+            queryset = queryset.select_related('project')
+        return queryset
+    
+    def list(self, request, *args, **kwargs):
+        # Polled by the frontend: answer 304 from one change-counter lookup when nothing changed
+        return conditional_get(request, chat_list_validators(request.user), lambda: super(ChatViewSet, self).list(request, *args, **kwargs))
     
     def get_serializer_class(self):
         # Use a detailed serializer for single chat view, minimal for list
@@ -182,11 +309,26 @@ class ChatViewSet(viewsets.ModelViewSet):
     
     def perform_create(self, serializer):
         # Set the owner to the current user when creating
-        chat = serializer.save(owner=self.request.user, message_graph={})
-        # Create a default branch for the chat
-        default_branch = Branch.objects.create(chat=chat, head_message_id=None)
+        with transaction.atomic():
+            chat = serializer.save(owner=self.request.user, message_graph={})
+            move_chat_count(None, False, chat.project_id, chat.status == Chat.Status.ACTIVE)
+            # Create a default branch for the chat
+            default_branch = Branch.objects.create(chat=chat, head_message_id=None)
         print(f"Created chat {chat.id} with default branch {default_branch.branch_id}")
     
+    def perform_update(self, serializer):
+        # Keep project chat counts in step when a chat moves project or changes status
+        old = serializer.instance
+        old_project_id, old_active = old.project_id, old.status == Chat.Status.ACTIVE
+        with transaction.atomic():
+            chat = serializer.save()
+            move_chat_count(old_project_id, old_active, chat.project_id, chat.status == Chat.Status.ACTIVE)
+    
+    def perform_destroy(self, instance):
+        with transaction.atomic(), MessageBody.objects.deferred_release():
+            instance.delete()
+            move_chat_count(instance.project_id, instance.status == Chat.Status.ACTIVE, None, False)
+    
     @action(detail=True, methods=['post'])
     def add_message(self, request, pk=None):
         """
@@ -194,74 +336,76 @@ class ChatViewSet(viewsets.ModelViewSet):
         - POST to /api/chats/{chat_id}/add_message/
         - Only the chat owner can add messages.
         - Creates both user message and AI response.
+        - An Idempotency-Key header makes retries replay the first response.
         """
         chat = self.get_object()
         print(f"Adding message to chat {chat.id}")
         print(f"Request data: {request.data}")
         
-        # Create user message
+        # Retried request: replay without writing or calling the model again
+        idempotency_key = get_idempotency_key(request)
+        if idempotency_key:
+            replay = replay_response(request, idempotency_key)
+            if replay is not None:
+                return replay
+        
+        # Validate the user message before touching the chat (which is already in hand)
         user_message_data = {
-            'chat': chat.id,
             'role': 'user',
             'content': request.data.get('content', ''),
         }
         
-        user_serializer = MessageSerializer(data=user_message_data)
+        user_serializer = MessageContentSerializer(data=user_message_data)
         if not user_serializer.is_valid():
             print(f"User message validation errors: {user_serializer.errors}")
             return Response(user_serializer.errors, status=status.HTTP_400_BAD_REQUEST)
         
-        user_message = user_serializer.save()
-        print(f"Created user message: {user_message.id}")
-        
-        # Get user content to check for keywords
-        user_content = request.data.get('content', '').lower()
-        ai_content = f"This is a standard text response for your query about: {request.data.get('content', '')}"
-
-        # If user asks for code, provide a Python snippet
-        if 'code' in user_content or 'python' in user_content:
-            code_snippet = (
-                "def process_data(data_source):\n"
-                "    # This is a sample code block.\n"
-                "    items = [1, 2, 3, 4, 5]\n"
-                "    for item in items:\n"
-                "        print(f'Processing item: {item}')\n"
-                "    return 'Completed'"
-            )
-            ai_content = f"```python\n{code_snippet}\n```"
-
-        # Create AI response
-        ai_message_data = {
-            'chat': chat.id,
-            'role': 'assistant',
-            'content': ai_content,
-        }
-        
-        ai_serializer = MessageSerializer(data=ai_message_data)
-        if not ai_serializer.is_valid():
-            print(f"AI message validation errors: {ai_serializer.errors}")
-            return Response(ai_serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        ai_content = generate_ai_content(user_serializer.validated_data['content'])
+        branch_id = request.data.get('branch_id')
         
-        ai_message = ai_serializer.save()
-        print(f"Created AI message: {ai_message.id}")
-        
-        # Update the default branch head to the AI message
-        try:
-            default_branch = chat.branches.first()
-            if default_branch:
-                default_branch.head_message_id = ai_message.id
-                default_branch.save()
-                print(f"Updated branch head to: {ai_message.id}")
-        except Exception as e:
-            print(f"Error updating branch: {e}")
-        
-        # Return both messages
-        response_data = {
-            'user_message': MessageDetailSerializer(user_message).data,
-            'ai_message': MessageDetailSerializer(ai_message).data,
-        }
+        with transaction.atomic():
+            # Lock the chat row so concurrent writers can't lose graph updates
+            chat = Chat.objects.select_for_update().get(pk=chat.pk)
+            if idempotency_key:
+                # A concurrent retry may have finished while we waited for the lock
+                replay = replay_response(request, idempotency_key)
+                if replay is not None:
+                    return replay
+            branches = chat.branches.order_by('created_at')
+            branch = branches.filter(branch_id=branch_id).first() if branch_id else branches.first()
+            if branch_id and branch is None:
+                return Response({'error': 'Branch not found'}, status=status.HTTP_404_NOT_FOUND)
+            if branch is None:
+                branch = Branch(chat=chat, head_message_id=None)
+            parent_id = str(branch.head_message_id) if branch.head_message_id else None
+            
+            user_message = user_serializer.save(chat=chat, parent_id=parent_id)
+            print(f"Created user message: {user_message.id}")
+            ai_message = Message.objects.create(chat=chat, role=Message.Role.ASSISTANT, content=ai_content, parent=user_message)
+            print(f"Created AI message: {ai_message.id}")
+            transaction.on_commit(lambda: index_messages(chat.owner_id, [user_message, ai_message]))
+            
+            # Append the exchange to the graph and move the branch head to the AI message
+            graph = add_message_to_graph(chat.message_graph, user_message.id, parent_id)
+            graph = add_message_to_graph(graph, ai_message.id, str(user_message.id))
+            chat.message_graph = graph
+            chat.message_count = F('message_count') + 2
+            chat.save(update_fields=['message_graph', 'message_count', 'updated_at'])
+            branch.head_message_id = ai_message.id
+            branch.save()
+            print(f"Updated branch head to: {ai_message.id}")
+            
+            # Return both messages
+            response_data = {
+                'user_message': MessageDetailSerializer(user_message).data,
+                'ai_message': MessageDetailSerializer(ai_message).data,
+                'branch': {'branch_id': str(branch.branch_id), 'head_message_id': str(branch.head_message_id)},
+            }
+            response = Response(response_data, status=status.HTTP_201_CREATED)
+            if idempotency_key:
+                store_response(request, idempotency_key, response)
         
-        return Response(response_data, status=status.HTTP_201_CREATED)
+        return response
     
     @action(detail=True, methods=['patch'])
     def update_status(self, request, pk=None):
@@ -273,8 +417,11 @@ class ChatViewSet(viewsets.ModelViewSet):
         chat = self.get_object()
         new_status = request.data.get('status')
         if new_status in [choice[0] for choice in Chat.Status.choices]:
-            chat.status = new_status
-            chat.save()
+            was_active = chat.status == Chat.Status.ACTIVE
+            with transaction.atomic():
+                chat.status = new_status
+                chat.save(update_fields=['status', 'updated_at'])
+                move_chat_count(chat.project_id, was_active, chat.project_id, new_status == Chat.Status.ACTIVE)
             serializer = self.get_serializer(chat)
             return Response(serializer.data)
         return Response({'error': 'Invalid status'}, status=status.HTTP_400_BAD_REQUEST)
@@ -290,7 +437,7 @@ class ChatViewSet(viewsets.ModelViewSet):
         new_name = request.data.get('name')
         if new_name:
             chat.name = new_name
-            chat.save()
+            chat.save(update_fields=['name', 'updated_at'])
             serializer = self.get_serializer(chat)
             return Response(serializer.data)
         return Response({'error': 'Name is required'}, status=status.HTTP_400_BAD_REQUEST)
@@ -301,16 +448,23 @@ class ChatViewSet(viewsets.ModelViewSet):
         Custom action to get all messages in a chat.
         - GET to /api/chats/{chat_id}/messages/
         - Returns all messages belonging to this chat.
+        - With ?limit= and/or ?cursor=, returns one keyset page (newest first, then older).
+        - Supports If-None-Match: unchanged chats get a 304 without loading the messages.
         """
-        chat = self.get_object()
-        messages = chat.messages.all()
-        serializer = MessageSerializer(messages, many=True)
-        return Response(serializer.data)
+        def respond():
+            chat = self.get_object()
+            messages = chat.messages.all()
+            paginator = MessageKeysetPagination()
+            if paginator.is_requested(request):
+                page = paginator.paginate_queryset(messages, request, view=self)
+                return paginator.get_paginated_response(MessageSerializer(page, many=True).data)
+            return Response(message_rows(messages))
+        return conditional_get(request, chat_messages_validators(request.user, pk), respond)
 
 # ---
 # Message ViewSet
 # ---
-class MessageViewSet(viewsets.ModelViewSet):
+class MessageViewSet(SparseQuerysetMixin, DashboardInvalidationMixin, viewsets.ModelViewSet):
     """
     API endpoint for managing messages inside chats.
     - Each message belongs to a chat.
@@ -320,10 +474,22 @@ class MessageViewSet(viewsets.ModelViewSet):
     """
     serializer_class = MessageSerializer
     permission_classes = [permissions.IsAuthenticated, IsOwnerOrReadOnly]
+    pagination_class = HasMorePagination
+    query_budgets = {
+        'list': 1, 'retrieve': 3, 'create': 6, 'update': 7, 'partial_update': 7, 'destroy': 8,
+        'edit_message': 19,
+    }
     
     def get_queryset(self):
-        # Only show messages in chats owned by the current user
-        return Message.objects.filter(chat__owner=self.request.user)
+        # Only show messages in chats owned by the current user; the owner id rides along on
+        # the same join, so IsOwnerOrReadOnly never loads the chat
+        return Message.objects.filter(chat__owner=self.request.user).annotate(chat_owner_id=F('chat__owner_id'))
+    
+    def retrieve(self, request, *args, **kwargs):
+        return conditional_get(
+            request, message_validators(request.user, kwargs['pk']),
+            lambda: super(MessageViewSet, self).retrieve(request, *args, **kwargs),
+        )
     
     def get_serializer_class(self):
         # Use a detailed serializer for single message view
@@ -332,18 +498,44 @@ class MessageViewSet(viewsets.ModelViewSet):
         return MessageSerializer
     
     def perform_create(self, serializer):
-        serializer.save()
+        with transaction.atomic():
+            message = serializer.save()
+            adjust_message_count(message.chat_id, 1)
+    
+    def perform_update(self, serializer):
+        old_chat_id = serializer.instance.chat_id
+        with transaction.atomic():
+            message = serializer.save()
+            if message.chat_id != old_chat_id:
+                adjust_message_count(old_chat_id, -1)
+                adjust_message_count(message.chat_id, 1)
+    
+    def perform_destroy(self, instance):
+        with transaction.atomic():
+            instance.delete()
+            adjust_message_count(instance.chat_id, -1)
     
     @action(detail=True, methods=['post'])
     def edit_message(self, request, pk=None):
         """
-        Custom action to create an edited version of a message.
+        Custom action to edit a message and regenerate the reply on a new branch.
         - POST to /api/messages/{message_id}/edit_message/
         - Only user messages can be edited (not AI messages).
         - Keeps the original message, creates a new one referencing the original.
+        - In one transaction: forks the message graph, generates a new AI reply,
+          and records the new Branch and Edit rows.
+        - Returns the edited message plus the new branch head and its chain.
+        - An Idempotency-Key header makes retries replay the first response.
         """
         original_message = self.get_object()
         
+        # Retried request: replay without writing or calling the model again
+        idempotency_key = get_idempotency_key(request)
+        if idempotency_key:
+            replay = replay_response(request, idempotency_key)
+            if replay is not None:
+                return replay
+        
         # Check if the message is from a user (not AI)
         if original_message.role != Message.Role.USER:
             return Response(
@@ -352,17 +544,69 @@ class MessageViewSet(viewsets.ModelViewSet):
             )
         
         edited_data = {
-            'chat': original_message.chat.id,
             'role': original_message.role,
             'content': request.data.get('content'),
-            'original_message': original_message.id,
             'status': Message.Status.EDITED
         }
-        serializer = MessageSerializer(data=edited_data)
-        if serializer.is_valid():
-            serializer.save()
-            return Response(serializer.data, status=status.HTTP_201_CREATED)
-        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        serializer = MessageContentSerializer(data=edited_data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        
+        ai_content = generate_ai_content(serializer.validated_data['content'])
+        
+        with transaction.atomic():
+            # Lock the chat row so concurrent edits can't lose graph updates
+            chat = Chat.objects.select_for_update().get(pk=original_message.chat_id)
+            if idempotency_key:
+                # A concurrent retry may have finished while we waited for the lock
+                replay = replay_response(request, idempotency_key)
+                if replay is not None:
+                    return replay
+            # The edit forks at the original: same parent, so it is the original's sibling
+            edited_message = serializer.save(
+                chat=chat, original_message=original_message,
+                parent_id=chat.message_graph.get(str(original_message.id), {}).get('parent'),
+            )
+            ai_message = Message.objects.create(chat=chat, role=Message.Role.ASSISTANT, content=ai_content, parent=edited_message)
+            transaction.on_commit(lambda: index_messages(chat.owner_id, [edited_message, ai_message]))
+            
+            # Fork the graph at the original message and hang the new reply off the edit
+            graph = edit_message_in_graph(chat.message_graph, edited_message.id, str(original_message.id))
+            graph = add_message_to_graph(graph, ai_message.id, str(edited_message.id))
+            chat.message_graph = graph
+            chat.message_count = F('message_count') + 2
+            chat.save(update_fields=['message_graph', 'message_count', 'updated_at'])
+            
+            branch = Branch.objects.create(chat=chat, head_message_id=ai_message.id)
+            edit = Edit.objects.create(
+                chat=chat,
+                branch=branch,
+                prev_message_id=original_message.id,
+                new_message_id=edited_message.id,
+                new_head_id=ai_message.id,
+            )
+            
+            # Only the ancestors need fetching; the two new messages are in memory
+            chain = get_branch_from_head(graph, ai_message.id)
+            known = {str(edited_message.id): edited_message, str(ai_message.id): ai_message}
+            ancestor_ids = [mid for mid in chain if mid not in known]
+            msg_map = {str(m.id): m for m in Message.objects.filter(id__in=ancestor_ids)} if ancestor_ids else {}
+            msg_map.update(known)
+            ordered_msgs = [msg_map[mid] for mid in chain if mid in msg_map]
+            
+            response_data = dict(MessageSerializer(edited_message).data)
+            response_data.update({
+                'ai_message': MessageSerializer(ai_message).data,
+                'branch': {'branch_id': str(branch.branch_id), 'head_message_id': str(ai_message.id)},
+                'edit_id': str(edit.edit_id),
+                'chain': chain,
+                'messages': MessageSerializer(ordered_msgs, many=True).data,
+            })
+            response = Response(response_data, status=status.HTTP_201_CREATED)
+            if idempotency_key:
+                store_response(request, idempotency_key, response)
+        
+        return response
 
 # ---
 # User Settings ViewSet
@@ -375,6 +619,9 @@ class UserSettingsViewSet(viewsets.ModelViewSet):
     """
     serializer_class = UserSettingsSerializer
     permission_classes = [permissions.IsAuthenticated, IsOwnerOrReadOnly]
+    query_budgets = {
+        'list': 1, 'retrieve': 1, 'create': 2, 'update': 2, 'partial_update': 2, 'destroy': 2,
+    }
     
     def get_queryset(self):
         return UserSettings.objects.filter(user=self.request.user)
@@ -390,26 +637,48 @@ class DashboardView(APIView):
     API endpoint for dashboard summary data for the authenticated user.
     - Returns user info, profile, projects, and standalone chats (not in projects).
     - Used to quickly load the main dashboard in the frontend.
+    - Cached per user; project, chat and message writes bump the cache stamp.
     """
     permission_classes = [permissions.IsAuthenticated]
+    # APIViews key their budgets by handler
+    query_budgets = {'get': 3}
     
     def get(self, request):
         user = request.user
-        projects = Project.objects.filter(owner=user)
-        chats = Chat.objects.filter(owner=user)
+        # Resolve the key before reading the DB so a concurrent write's bump isn't lost
+        cache_key = dashboard_cache_key(user.id)
+        payload = cache.get(cache_key)
+        if payload is None:
+            payload = self.build_payload(user)
+            cache.set(cache_key, payload, settings.DASHBOARD_CACHE_TIMEOUT)
+        return Response(payload)
+    
+    def build_payload(self, user):
+        # User, profile and total chat count in one query; never writes on GET
+        total_chats = (
+            Chat.objects.filter(owner=OuterRef('pk')).order_by()
+            .values('owner').annotate(total=Count('id')).values('total')
+        )
+        user = (
+            User.objects.select_related('profile')
+            .annotate(total_chats=Coalesce(Subquery(total_chats), 0))
+            .get(pk=user.pk)
+        )
+        # Users created without a profile (createsuperuser, admin) get the defaults, unsaved:
+        # the same keys as a stored profile, with a null id and timestamps
+        profile = getattr(user, 'profile', None) or UserProfile(user=user, id=None)
+        projects = sparse_only(Project.objects.filter(owner=user), DashboardProjectSerializer)
         projects_data = DashboardProjectSerializer(projects, many=True).data
-        standalone_chats = chats.filter(project__isnull=True)
+        standalone_chats = sparse_only(Chat.objects.filter(owner=user, project__isnull=True), DashboardChatSerializer)
         standalone_chats_data = DashboardChatSerializer(standalone_chats, many=True).data
-        profile, created = UserProfile.objects.get_or_create(user=user)
-        profile_data = UserProfileSerializer(profile).data
-        return Response({
+        return {
             'user': UserSerializer(user).data,
-            'profile': profile_data,
+            'profile': UserProfileSerializer(profile).data,
             'projects': projects_data,
             'standalone_chats': standalone_chats_data,
-            'total_projects': projects.count(),
-            'total_chats': chats.count(),
-        })
+            'total_projects': len(projects_data),
+            'total_chats': user.total_chats,
+        }
 
 # ---
 # Additional API Views for Separate Data Retrieval
@@ -421,6 +690,7 @@ class AllProjectsView(APIView):
     - Returns all projects with detailed information.
     """
     permission_classes = [permissions.IsAuthenticated]
+    query_budgets = {'get': 1}
     
     def get(self, request):
         projects = Project.objects.filter(owner=request.user)
@@ -434,6 +704,7 @@ class ProjectChatsView(APIView):
     - Returns all chats belonging to the specified project.
     """
     permission_classes = [permissions.IsAuthenticated]
+    query_budgets = {'get': 2}
     
     def get(self, request, project_id):
         try:
@@ -449,15 +720,26 @@ class ChatMessagesView(APIView):
     API endpoint to get all messages in a specific chat.
     - GET to /api/chat-messages/{chat_id}/
     - Returns all messages belonging to the specified chat.
+    - With ?limit= and/or ?cursor=, returns one keyset page (newest first, then older).
+    - Supports If-None-Match: unchanged chats get a 304 without loading the messages.
     """
     permission_classes = [permissions.IsAuthenticated]
+    query_budgets = {'get': 3}
     
     def get(self, request, chat_id):
+        return conditional_get(
+            request, chat_messages_validators(request.user, chat_id), lambda: self.list_messages(request, chat_id)
+        )
+    
+    def list_messages(self, request, chat_id):
         try:
             chat = Chat.objects.get(id=chat_id, owner=request.user)
             messages = chat.messages.all()
-            serializer = MessageSerializer(messages, many=True)
-            return Response(serializer.data)
+            paginator = MessageKeysetPagination()
+            if paginator.is_requested(request):
+                page = paginator.paginate_queryset(messages, request, view=self)
+                return paginator.get_paginated_response(MessageSerializer(page, many=True).data)
+            return Response(message_rows(messages))
         except Chat.DoesNotExist:
             return Response({'error': 'Chat not found'}, status=status.HTTP_404_NOT_FOUND)
 
@@ -470,6 +752,7 @@ class HealthCheckView(APIView):
     - Returns status and database connection info.
     """
     permission_classes = []
+    query_budgets = {'get': 1}
     
     def get(self, request):
         from django.db import connection
@@ -496,21 +779,21 @@ class MyTokenObtainPairSerializer(TokenObtainPairSerializer):
         self.fields['username'] = serializers.CharField(required=False, read_only=True)
 
     def validate(self, attrs):
-        from django.contrib.auth import authenticate
-
         email = attrs.get('email')
         password = attrs.get('password')
 
-        # Find the user by email
+        # Find the user by email: one query served by the unique lower(email) index (which
+        # only covers non-blank emails, hence the exclude). Both sides are lowered by the
+        # database, since Python's str.lower() folds some characters differently.
         try:
-            user_obj = User.objects.get(email__iexact=email)
+            user = User.objects.exclude(email='').annotate(email_lower=Lower('email')).get(email_lower=Lower(Value(email)))
         except User.DoesNotExist:
+            # Hash anyway so an unknown address takes as long as a wrong password
+            make_password(password)
             raise serializers.ValidationError('No account found with this email address.')
 
-        # Authenticate with the found username and provided password
-        user = authenticate(username=user_obj.username, password=password)
-
-        if not user:
+        # check_password also re-hashes with the preferred hasher when PASSWORD_HASHERS changed
+        if not user.check_password(password) or not user.is_active:
             raise serializers.ValidationError('Incorrect password. Please try again.')
 
         # If authentication is successful, generate tokens
@@ -534,6 +817,66 @@ class MyTokenObtainPairView(TokenObtainPairView):
     - Returns access and refresh tokens.
     """
     serializer_class = MyTokenObtainPairSerializer
+    query_budgets = {'post': 2}
+
+class RevocableTokenRefreshSerializer(TokenRefreshSerializer):
+    """
+    Refresh serializer that enforces BLACKLIST_AFTER_ROTATION through the RevokedToken store.
+    - With rotation, the presented refresh token is revoked before new tokens are issued; if it
+      was already revoked (replayed, or used by a concurrent refresh) the refresh is refused.
+    - Without rotation, revoked refresh tokens (e.g. after logout) are refused.
+    - Rotates without simplejwt's OutstandingToken bookkeeping, which needs its token_blacklist app.
+    """
+    def validate(self, attrs):
+        refresh = self.token_class(attrs['refresh'])
+        if api_settings.ROTATE_REFRESH_TOKENS and api_settings.BLACKLIST_AFTER_ROTATION:
+            revoked = not revoke_token(refresh)
+        else:
+            revoked = is_revoked(refresh.get(api_settings.JTI_CLAIM))
+        if revoked:
+            raise TokenError('Token is revoked')
+
+        user = get_principal(refresh.get(api_settings.USER_ID_CLAIM))
+        if user is None or not api_settings.USER_AUTHENTICATION_RULE(user):
+            raise AuthenticationFailed(self.error_messages['no_active_account'], 'no_active_account')
+
+        data = {'access': str(refresh.access_token)}
+        if api_settings.ROTATE_REFRESH_TOKENS:
+            refresh.set_jti()
+            refresh.set_exp()
+            refresh.set_iat()
+            data['refresh'] = str(refresh)
+        return data
+
+class MyTokenRefreshView(TokenRefreshView):
+    """
+    Custom view for refreshing a JWT.
+    - Refuses revoked refresh tokens and revokes the old one when rotating.
+    """
+    serializer_class = RevocableTokenRefreshSerializer
+    query_budgets = {'post': 5}
+
+class LogoutView(APIView):
+    """
+    API endpoint for logging out.
+    - Revokes the given refresh token and the access token used for the request.
+    - Both stop working at once in this process, and within TOKEN_REVOCATION_SYNC_INTERVAL elsewhere.
+    """
+    permission_classes = [permissions.IsAuthenticated]
+    query_budgets = {'post': 8}
+
+    def post(self, request):
+        try:
+            refresh = RefreshToken(request.data.get('refresh', ''))
+        except TokenError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        if str(refresh.get(api_settings.USER_ID_CLAIM)) != str(request.user.pk):
+            return Response({'error': 'Token belongs to another user'}, status=status.HTTP_400_BAD_REQUEST)
+
+        revoke_token(refresh)
+        if request.auth is not None:
+            revoke_token(request.auth)
+        return Response({'message': 'Logged out'})
 
 # ---
 # User Registration View
@@ -547,12 +890,14 @@ class UserRegistrationView(APIView):
     - Includes comprehensive validation for username, email, and password.
     """
     permission_classes = []
+    query_budgets = {'post': 4}
     
     def post(self, request):
         """
         Register a new user with the provided credentials.
         - Validates username, email, and password.
-        - Creates user and profile.
+        - Creates user and profile in one transaction, relying on the unique constraints
+          rather than checking for existing usernames and emails first.
         - Returns JWT tokens for immediate login.
         """
         from django.contrib.auth.models import User
@@ -572,18 +917,6 @@ class UserRegistrationView(APIView):
                 'error': 'Username, email, and password are required'
             }, status=status.HTTP_400_BAD_REQUEST)
         
-        # Check if username already exists
-        if User.objects.filter(username=username).exists():
-            return Response({
-                'error': 'Username already exists'
-            }, status=status.HTTP_400_BAD_REQUEST)
-        
-        # Check if email already exists
-        if User.objects.filter(email=email).exists():
-            return Response({
-                'error': 'Email already exists'
-            }, status=status.HTTP_400_BAD_REQUEST)
-        
         # Validate password strength
         try:
             validate_password(password)
@@ -615,50 +948,48 @@ class UserRegistrationView(APIView):
                 'error': 'Username must be between 3 and 30 characters'
             }, status=status.HTTP_400_BAD_REQUEST)
         
+        # Hash before opening the transaction: it's the slow part and needs no locks
+        user = User(username=User.normalize_username(username), email=User.objects.normalize_email(email))
+        user.set_password(password)
+        
+        # One transaction; the unique constraints on username and lower(email) detect conflicts
         try:
-            # Create the user
-            user = User.objects.create_user(
-                username=username,
-                email=email,
-                password=password
-            )
-            
-            # Create user profile
-            profile = UserProfile.objects.create(
-                user=user,
-                display_name=display_name or username
-            )
-            
-            # Generate JWT tokens
-            refresh = RefreshToken.for_user(user)
-            
-            return Response({
-                'message': 'User registered successfully',
-                'user': {
-                    'id': user.id,
-                    'username': user.username,
-                    'email': user.email,
-                    'date_joined': user.date_joined
-                },
-                'profile': {
-                    'id': profile.id,
-                    'display_name': profile.display_name,
-                    'bio': profile.bio,
-                    'avatar_url': profile.avatar_url
-                },
-                'tokens': {
-                    'access': str(refresh.access_token),
-                    'refresh': str(refresh)
-                }
-            }, status=status.HTTP_201_CREATED)
-            
-        except Exception as e:
-            # If anything goes wrong, clean up
-            if user:
-                user.delete()
+            with transaction.atomic():
+                user.save()
+                profile = UserProfile.objects.create(
+                    user=user,
+                    display_name=display_name or username
+                )
+        except IntegrityError as e:
+            field = unique_violation_field(e)
+            if field is None:
+                raise
             return Response({
-                'error': 'Registration failed. Please try again.'
-            }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+                'error': f'{field.capitalize()} already exists'
+            }, status=status.HTTP_400_BAD_REQUEST)
+        
+        # Generate JWT tokens
+        refresh = RefreshToken.for_user(user)
+        
+        return Response({
+            'message': 'User registered successfully',
+            'user': {
+                'id': user.id,
+                'username': user.username,
+                'email': user.email,
+                'date_joined': user.date_joined
+            },
+            'profile': {
+                'id': profile.id,
+                'display_name': profile.display_name,
+                'bio': profile.bio,
+                'avatar_url': profile.avatar_url
+            },
+            'tokens': {
+                'access': str(refresh.access_token),
+                'refresh': str(refresh)
+            }
+        }, status=status.HTTP_201_CREATED)
 
 # ---
 # User Deletion View
@@ -672,6 +1003,8 @@ class UserDeletionView(APIView):
     - Returns confirmation of deletion.
     """
     permission_classes = [permissions.IsAuthenticated]
+    # The cascade reaches every table holding the user's data
+    query_budgets = {'delete': 24}
     
     def delete(self, request):
         """
@@ -708,7 +1041,8 @@ class UserDeletionView(APIView):
             }
             
             # Delete user (this will cascade to related data due to CASCADE relationships)
-            user.delete()
+            with transaction.atomic(), MessageBody.objects.deferred_release():
+                user.delete()
             
             return Response({
                 'message': 'User account deleted successfully',
@@ -0,0 +1,121 @@
+import json
+import logging
+from urllib.parse import urlsplit
+from django.conf import settings
+from django.db import transaction
+from django.http import HttpRequest, QueryDict
+from django.urls import Resolver404, resolve
+from rest_framework import status, permissions
+from rest_framework.response import Response
+from rest_framework.views import APIView
+
+logger = logging.getLogger(__name__)
+
+# Sub-response headers worth handing back to the client
+FORWARDED_HEADERS = ('ETag', 'Last-Modified', 'Cache-Control', 'Location', 'Idempotent-Replayed')
+BATCH_METHODS = ('GET', 'HEAD', 'POST', 'PUT', 'PATCH', 'DELETE')
+
+class BatchView(APIView):
+    """
+    API endpoint that runs several API requests in one round trip.
+    - POST to /api/batch/ with {"requests": [{"method", "path", "body"?, "headers"?}, ...], "atomic"?: bool}
+    - Sub-requests run in order, in-process, as the already-authenticated user on the same
+      DB connection; each result is {"status", "headers", "body"} in the same order.
+    - With "atomic": true the batch runs in one transaction, stops at the first status >= 400
+      and is rolled back (`rolled_back` is true and the skipped requests get status 424).
+    """
+    permission_classes = [permissions.IsAuthenticated]
+
+    def post(self, request):
+        operations = request.data.get('requests') if isinstance(request.data, dict) else None
+        if not isinstance(operations, list) or not operations:
+            return Response({'error': 'requests must be a non-empty list'}, status=status.HTTP_400_BAD_REQUEST)
+        if len(operations) > settings.BATCH_MAX_REQUESTS:
+            return Response(
+                {'error': f'At most {settings.BATCH_MAX_REQUESTS} requests per batch'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        try:
+            prepared = [self.prepare(request, operation) for operation in operations]
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        if not request.data.get('atomic'):
+            return Response({'responses': [self.dispatch_one(*item) for item in prepared], 'rolled_back': False})
+
+        results = []
+        with transaction.atomic():
+            for item in prepared:
+                result = self.dispatch_one(*item)
+                results.append(result)
+                if result['status'] >= 400:
+                    transaction.set_rollback(True)
+                    break
+        rolled_back = len(results) < len(prepared) or results[-1]['status'] >= 400
+        skipped = {'status': status.HTTP_424_FAILED_DEPENDENCY, 'headers': {}, 'body': None}
+        results += [dict(skipped) for _ in prepared[len(results):]]
+        return Response({'responses': results, 'rolled_back': rolled_back})
+
+    def prepare(self, request, operation):
+        """
+        Validate one sub-request and build its (HttpRequest, resolver match).
+        """
+        if not isinstance(operation, dict) or not isinstance(operation.get('path'), str):
+            raise ValueError('Each request needs a path')
+        method = str(operation.get('method', 'GET')).upper()
+        if method not in BATCH_METHODS:
+            raise ValueError(f'Unsupported method: {method}')
+        url = urlsplit(operation['path'])
+        try:
+            match = resolve(url.path)
+        except Resolver404:
+            raise ValueError(f'Unknown path: {url.path}')
+        if not url.path.startswith('/api/') or getattr(match.func, 'view_class', None) is BatchView:
+            raise ValueError(f'Path cannot be batched: {url.path}')
+        headers = operation.get('headers') or {}
+        if not isinstance(headers, dict):
+            raise ValueError('headers must be an object')
+
+        sub_request = HttpRequest()
+        sub_request.method = method
+        sub_request.path = sub_request.path_info = url.path
+        sub_request.resolver_match = match
+        # Keep the server/client environment (host, scheme, Accept) but none of the outer body or auth
+        sub_request.META = {
+            key: value for key, value in request.META.items()
+            if key not in ('CONTENT_TYPE', 'CONTENT_LENGTH', 'HTTP_AUTHORIZATION', 'HTTP_COOKIE')
+            and not key.startswith('HTTP_IF_') and key != 'HTTP_IDEMPOTENCY_KEY'
+        }
+        for name, value in headers.items():
+            key = name.upper().replace('-', '_')
+            if key not in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+                key = f'HTTP_{key}'
+            sub_request.META[key] = str(value)
+        sub_request.META['REQUEST_METHOD'] = method
+        sub_request.META['QUERY_STRING'] = url.query
+        sub_request.GET = QueryDict(url.query)
+        raw = json.dumps(operation['body']).encode() if operation.get('body') is not None else b''
+        sub_request.META['CONTENT_TYPE'] = 'application/json'
+        sub_request.META['CONTENT_LENGTH'] = str(len(raw))
+        sub_request._body = raw
+        sub_request._read_started = True
+        # DRF skips its authenticators for forced credentials: the batch was authenticated once
+        sub_request.user = request.user
+        sub_request._force_auth_user = request.user
+        sub_request._force_auth_token = request.auth
+        return sub_request, match
+
+    def dispatch_one(self, sub_request, match):
+        try:
+            response = match.func(sub_request, *match.args, **match.kwargs)
+        except Exception:
+            logger.exception("Batched request %s %s failed", sub_request.method, sub_request.path)
+            return {'status': 500, 'headers': {}, 'body': {'error': 'Internal server error'}}
+        if isinstance(response, Response):
+            body = response.data
+        elif response.get('Content-Type', '').startswith('application/json') and response.content:
+            body = json.loads(response.content)
+        else:
+            body = None
+        headers = {name: response[name] for name in FORWARDED_HEADERS if response.has_header(name)}
+        return {'status': response.status_code, 'headers': headers, 'body': body}
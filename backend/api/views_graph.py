@@ -1,18 +1,23 @@
+import uuid
 from rest_framework import status, permissions, viewsets
 from rest_framework.decorators import action
 from rest_framework.response import Response
+from django.shortcuts import get_object_or_404
 from .models import Chat, Message, Branch
-from .serializers import MessageSerializer
+from .serializers import message_rows
 from .utils_message_graph import get_heads, get_branch_from_head
+from .utils_search import search_branch
 
 class ChatGraphViewSet(viewsets.ViewSet):
     """
     ViewSet for graph-based chat operations: heads, branches, branch chain.
     """
     permission_classes = [permissions.IsAuthenticated]
+    # Most SQL queries per action (QueryBudgetMiddleware): the chat, then one graph read
+    query_budgets = {'graph_heads': 1, 'branch_chain': 2, 'branches': 2, 'siblings': 2, 'search': 2}
 
     def get_chat(self, pk, user):
-        return Chat.objects.get(pk=pk, owner=user)
+        return get_object_or_404(Chat, pk=pk, owner=user)
 
     @action(detail=True, methods=['get'])
     def graph_heads(self, request, pk=None):
@@ -27,11 +32,9 @@ class ChatGraphViewSet(viewsets.ViewSet):
         if not head_id:
             return Response({'error': 'head_id query param required'}, status=status.HTTP_400_BAD_REQUEST)
         chain = get_branch_from_head(chat.message_graph, head_id)
-        messages = Message.objects.filter(id__in=chain)
-        msg_map = {str(m.id): m for m in messages}
+        msg_map = {m['id']: m for m in message_rows(Message.objects.filter(chat=chat, id__in=chain))}
         ordered_msgs = [msg_map[mid] for mid in chain if mid in msg_map]
-        serializer = MessageSerializer(ordered_msgs, many=True)
-        return Response({'chain': chain, 'messages': serializer.data})
+        return Response({'chain': chain, 'messages': ordered_msgs})
 
     @action(detail=True, methods=['get'])
     def branches(self, request, pk=None):
@@ -61,8 +64,23 @@ class ChatGraphViewSet(viewsets.ViewSet):
             sibling_ids = [mid for mid, node in graph.items() if node.get('parent') is None]
         else:
             sibling_ids = graph.get(parent_id, {}).get('children', [])
-        messages = Message.objects.filter(id__in=sibling_ids)
-        msg_map = {str(m.id): m for m in messages}
+        msg_map = {m['id']: m for m in message_rows(Message.objects.filter(chat=chat, id__in=sibling_ids))}
         ordered_msgs = [msg_map[mid] for mid in sibling_ids if mid in msg_map]
-        serializer = MessageSerializer(ordered_msgs, many=True)
-        return Response({'siblings': serializer.data}) 
\ No newline at end of file
+        return Response({'siblings': ordered_msgs}) 
+
+    @action(detail=True, methods=['get'])
+    def search(self, request, pk=None):
+        """
+        Full-text search restricted to one branch: only messages on the chain ending at head_id.
+        Pass ?head_id=<message_id>&q=<text>; matches come back best first.
+        """
+        chat = self.get_chat(pk, request.user)
+        head_id = request.query_params.get('head_id')
+        text = request.query_params.get('q', '').strip()
+        if not head_id or not text:
+            return Response({'error': 'head_id and q query params required'}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            head_id = uuid.UUID(head_id)
+        except ValueError:
+            return Response({'error': 'Invalid head_id'}, status=status.HTTP_400_BAD_REQUEST)
+        return Response({'head_id': str(head_id), 'messages': message_rows(search_branch(chat, head_id, text))})
@@ -0,0 +1,32 @@
+import hmac
+from django.conf import settings
+from django.http import HttpResponse
+from rest_framework import status
+from rest_framework.views import APIView
+from .utils_metrics import render_metrics, request_metrics
+
+class MetricsView(APIView):
+    """
+    Prometheus scrape endpoint for the request metrics recorded by MetricsMiddleware.
+    - GET to /api/metrics
+    - With METRICS_DIR set, the totals cover every worker process, whichever one answers.
+    - When METRICS_TOKEN is set it must be sent as `Authorization: Bearer <token>`. Without a
+      token the endpoint answers 404 unless METRICS_PUBLIC opts in to unauthenticated scrapes.
+    """
+    authentication_classes = []
+    permission_classes = []
+    # Reads only files and memory
+    query_budgets = {'get': 0}
+
+    def get(self, request):
+        if settings.METRICS_TOKEN:
+            expected = f'Bearer {settings.METRICS_TOKEN}'
+            if not hmac.compare_digest(request.headers.get('Authorization', '').encode(), expected.encode()):
+                return HttpResponse(status=status.HTTP_401_UNAUTHORIZED)
+        elif not settings.METRICS_PUBLIC:
+            return HttpResponse(status=status.HTTP_404_NOT_FOUND)
+        requests, timings = request_metrics.collect()
+        return HttpResponse(
+            render_metrics(requests, timings, request_metrics.buckets),
+            content_type='text/plain; version=0.0.4; charset=utf-8',
+        )
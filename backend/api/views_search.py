@@ -0,0 +1,111 @@
+import uuid
+from django.conf import settings
+from django.db import OperationalError
+from rest_framework import status, permissions
+from rest_framework.response import Response
+from rest_framework.views import APIView
+from .models import Chat, Project
+from .pagination import HasMorePagination
+from .utils_semantic import semantic_search, semantic_search_available
+from .utils_search import is_query_canceled, match_names, message_snippets, search_messages, statement_timeout
+
+class MessageSearchView(APIView):
+    """
+    API endpoint for full-text search over the user's messages.
+    - GET to /api/search/?q=<text>&project=<project_id>&chat=<chat_id>&page=<n>
+    - `q` uses web search syntax: words, "quoted phrases", `or`, and -excluded words.
+    - Results are ranked by ts_rank; each carries a `snippet` with matches wrapped in <mark>.
+    - Paged with `has_more` (no count), so a broad query never counts every match.
+    """
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get(self, request):
+        text = request.query_params.get('q', '').strip()
+        if not text:
+            return Response({'error': 'q query param required'}, status=status.HTTP_400_BAD_REQUEST)
+        scope = {}
+        for param in ('project', 'chat'):
+            value = request.query_params.get(param)
+            if value:
+                try:
+                    scope[f'{param}_id'] = uuid.UUID(value)
+                except ValueError:
+                    return Response({'error': f'Invalid {param}'}, status=status.HTTP_400_BAD_REQUEST)
+
+        paginator = HasMorePagination()
+        rows = paginator.paginate_queryset(search_messages(request.user, text, **scope), request, view=self)
+        snippets = message_snippets(text, rows)
+        results = [
+            {
+                'id': row['id'],
+                'chat_id': row['chat_id'],
+                'chat_name': row['chat__name'],
+                'project_id': row['chat__project_id'],
+                'role': row['role'],
+                'created_at': row['created_at'],
+                'rank': row['rank'],
+                'snippet': snippets.get(row['body_id'], ''),
+            }
+            for row in rows
+        ]
+        return paginator.get_paginated_response(results)
+
+class QuickSearchView(APIView):
+    """
+    API endpoint for as-you-type search over the user's project and chat names and descriptions.
+    - GET to /api/quick-search/?q=<text>&limit=<n>
+    - Typo tolerant from 3 characters (pg_trgm similarity); shorter text matches name prefixes.
+    - Each keystroke gets QUICK_SEARCH_TIMEOUT_MS of database time: past that the search is
+      cancelled and whatever finished is returned with `timed_out` set.
+    """
+    permission_classes = [permissions.IsAuthenticated]
+    default_limit = 10
+    max_limit = 50
+
+    def get(self, request):
+        text = request.query_params.get('q', '').strip()
+        if not text:
+            return Response({'error': 'q query param required'}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            limit = max(1, min(int(request.query_params.get('limit', self.default_limit)), self.max_limit))
+        except ValueError:
+            return Response({'error': 'Invalid limit'}, status=status.HTTP_400_BAD_REQUEST)
+
+        projects, chats, timed_out = [], [], False
+        try:
+            with statement_timeout(settings.QUICK_SEARCH_TIMEOUT_MS):
+                projects = list(
+                    match_names(Project.objects.filter(owner=request.user), text).values('id', 'name')[:limit]
+                )
+                chats = list(
+                    match_names(Chat.objects.filter(owner=request.user), text).values('id', 'name', 'project_id')[:limit]
+                )
+        except OperationalError as e:
+            if not is_query_canceled(e):
+                raise
+            timed_out = True
+        return Response({'projects': projects, 'chats': chats, 'timed_out': timed_out})
+
+class SemanticSearchView(APIView):
+    """
+    API endpoint for "find where I discussed X": the user's messages closest in meaning to q.
+    - GET to /api/semantic-search/?q=<text>&limit=<n>
+    - Served from the user's on-disk nearest-neighbour index (see build_semantic_index);
+      messages are added to it as they are written.
+    - Each hit carries a cosine `score` and a short `preview` of the message.
+    """
+    permission_classes = [permissions.IsAuthenticated]
+    default_limit = 10
+    max_limit = 50
+
+    def get(self, request):
+        if not semantic_search_available():
+            return Response({'error': 'Semantic search is not enabled'}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+        text = request.query_params.get('q', '').strip()
+        if not text:
+            return Response({'error': 'q query param required'}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            limit = max(1, min(int(request.query_params.get('limit', self.default_limit)), self.max_limit))
+        except ValueError:
+            return Response({'error': 'Invalid limit'}, status=status.HTTP_400_BAD_REQUEST)
+        return Response({'results': semantic_search(request.user, text, limit)})
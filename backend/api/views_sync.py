@@ -0,0 +1,28 @@
+from rest_framework import status, permissions
+from rest_framework.response import Response
+from rest_framework.views import APIView
+from .utils_sync import changes_since, serialize_changes
+
+class SyncView(APIView):
+    """
+    API endpoint for delta sync of the user's projects, chats, messages and branches.
+    - GET to /api/sync/?cursor=<cursor>&limit=<n>
+    - Without a cursor, returns everything (a first sync); then pass back the returned `cursor`.
+    - Returns only entities created, updated or deleted since the cursor: current rows per
+      type plus `deleted` ids. While `has_more` is true, call again with the new cursor.
+    """
+    permission_classes = [permissions.IsAuthenticated]
+    default_limit = 500
+    max_limit = 2000
+
+    def get(self, request):
+        try:
+            limit = max(1, min(int(request.query_params.get('limit', self.default_limit)), self.max_limit))
+        except ValueError:
+            return Response({'error': 'Invalid limit'}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            changes, cursor, has_more = changes_since(request.user, request.query_params.get('cursor'), limit)
+        except ValueError:
+            return Response({'error': 'Invalid cursor'}, status=status.HTTP_400_BAD_REQUEST)
+        payload = serialize_changes(request.user, changes)
+        return Response({'cursor': cursor, 'has_more': has_more, **payload})
@@ -11,6 +11,7 @@ https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
 import os
+import sys
 from pathlib import Path
 from datetime import timedelta
 
@@ -39,6 +40,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
 
     # 3rd Party Apps
     'rest_framework',
@@ -50,6 +52,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'api.middleware.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'corsheaders.middleware.CorsMiddleware',
@@ -58,6 +61,8 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'api.middleware.DecompressionTimingMiddleware',
+    'api.middleware.QueryBudgetMiddleware',
 ]
 
 ROOT_URLCONF = 'backend.urls'
@@ -114,6 +119,27 @@ AUTH_PASSWORD_VALIDATORS = [
     },
 ]
 
+# Password hashing: the first entry hashes new passwords, every entry still verifies (and
+# upgrades on login) existing hashes. PASSWORD_HASHER=argon2 selects the OWASP-tuned Argon2id,
+# roughly 10x cheaper per login than the default PBKDF2 (needs argon2-cffi, otherwise PBKDF2
+# stays first). See bench_login.py for the per-worker login throughput of each.
+# The rest are Django's defaults; the tuned Argon2id stands in for Django's Argon2PasswordHasher,
+# whose 'argon2' algorithm name it shares (a later entry would shadow it when verifying).
+PASSWORD_HASHER = os.environ.get('PASSWORD_HASHER', 'pbkdf2').lower()
+PASSWORD_HASHERS = [
+    'django.contrib.auth.hashers.PBKDF2PasswordHasher',
+    'django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher',
+    'api.hashers.Argon2idPasswordHasher',
+    'django.contrib.auth.hashers.BCryptSHA256PasswordHasher',
+    'django.contrib.auth.hashers.ScryptPasswordHasher',
+]
+if PASSWORD_HASHER == 'argon2':
+    try:
+        import argon2  # noqa: F401
+        PASSWORD_HASHERS.insert(0, PASSWORD_HASHERS.pop(2))
+    except ImportError:
+        pass
+
 
 # Internationalization
 # https://docs.djangoproject.com/en/5.2/topics/i18n/
@@ -155,12 +181,17 @@ CORS_ALLOWED_HEADERS = [
     'user-agent',
     'x-csrftoken',
     'x-requested-with',
+    'idempotency-key',
+    'if-none-match',
+    'if-modified-since',
 ]
+# Let the frontend read conditional GET validators
+CORS_EXPOSE_HEADERS = ['etag', 'last-modified']
 
 # REST Framework settings
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'api.authentication.CachedJWTAuthentication',
         'rest_framework.authentication.SessionAuthentication',
     ],
     'DEFAULT_PERMISSION_CLASSES': [
@@ -169,10 +200,105 @@ REST_FRAMEWORK = {
     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
     'PAGE_SIZE': 20,
     'DEFAULT_RENDERER_CLASSES': [
-        'rest_framework.renderers.JSONRenderer',
+        'api.renderers.ORJSONRenderer',
     ],
+    'DEFAULT_PARSER_CLASSES': [
+        'api.parsers.ORJSONParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
+    ],
+}
+
+# Cache
+# LocMemCache is per-process; set REDIS_URL when running several gunicorn workers
+# so dashboard invalidation reaches every worker (requires the redis package).
+REDIS_URL = os.environ.get('REDIS_URL', '')
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache' if REDIS_URL else 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': REDIS_URL,
+    }
 }
 
+# Upper bound on how long a cached dashboard payload lives (seconds)
+DASHBOARD_CACHE_TIMEOUT = 300
+
+# How long CachedJWTAuthentication trusts a cached user principal (seconds). User saves and
+# deletes invalidate it, but only in a cache every worker shares: with LocMemCache the other
+# workers would keep a deactivated or deleted user authenticated, so without REDIS_URL the
+# principal isn't cached (one narrow query per request). QuerySet.update() on users skips the
+# invalidation signals; call utils_auth.forget_principal() after one, or wait out the timeout.
+AUTH_PRINCIPAL_CACHE_TIMEOUT = 60 if REDIS_URL else 0
+
+# JWT revocation (utils_revocation): reject revoked access tokens on every request, with each
+# process's bloom filter catching up on new revocations every SYNC_INTERVAL seconds and
+# rebuilt (dropping expired tokens) every REBUILD_INTERVAL seconds
+TOKEN_REVOCATION_CHECK_ACCESS = True
+TOKEN_REVOCATION_SYNC_INTERVAL = 5
+TOKEN_REVOCATION_REBUILD_INTERVAL = 600
+TOKEN_REVOCATION_ERROR_RATE = 0.001
+
+# How long a stored Idempotency-Key response is replayed before it expires
+IDEMPOTENCY_KEY_TTL = timedelta(hours=24)
+
+# Per-view SQL query budgets (query_budgets on the views, checked by QueryBudgetMiddleware):
+# 'raise' under manage.py test so new N+1s fail the suite, 'log' in development, 'off' otherwise.
+# A query shape repeated more than QUERY_BUDGET_DUPLICATE_LIMIT times in one request is an N+1.
+TESTING = sys.argv[1:2] == ['test']
+QUERY_BUDGET_MODE = os.environ.get('QUERY_BUDGET_MODE', 'raise' if TESTING else 'log' if DEBUG else 'off')
+QUERY_BUDGET_DUPLICATE_LIMIT = 2
+# Allowance on top of every budget for token authentication, which queries on a principal cache
+# miss or a revocation filter sync (budgets are measured with force_authenticate)
+QUERY_BUDGET_AUTH_ALLOWANCE = 2
+
+# Request metrics (MetricsMiddleware), served in Prometheus text format at /api/metrics.
+# With METRICS_DIR set, every worker process writes its totals there (at most every
+# METRICS_FLUSH_INTERVAL seconds) and a scrape of any worker sums them all; use a directory
+# private to this host, e.g. on tmpfs. Scrapes must send METRICS_TOKEN as a Bearer token;
+# without one /api/metrics answers 404 unless METRICS_PUBLIC opts in to open scrapes.
+METRICS_ENABLED = os.environ.get('METRICS_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+METRICS_DIR = os.environ.get('METRICS_DIR', '')
+METRICS_FLUSH_INTERVAL = 1.0
+METRICS_LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN', '')
+METRICS_PUBLIC = os.environ.get('METRICS_PUBLIC', '').lower() in ('1', 'true', 'yes')
+
+# Most sub-requests accepted by one POST /api/batch/
+BATCH_MAX_REQUESTS = 20
+
+# EstimatedCountPagination switches from COUNT(*) to the planner estimate at this many rows
+PAGINATION_ESTIMATE_THRESHOLD = 10000
+
+# Message.content compression at rest: '' (off), 'zlib', or 'zstd' (requires the zstandard package).
+# Values shorter than the threshold (bytes) stay plain; existing rows are compressed with
+# `manage.py compress_messages`. A zstd dictionary comes from `manage.py train_message_dictionary`.
+MESSAGE_COMPRESSION_CODEC = os.environ.get('MESSAGE_COMPRESSION_CODEC', '')
+MESSAGE_COMPRESSION_THRESHOLD = 2048
+MESSAGE_COMPRESSION_LEVEL = None
+MESSAGE_COMPRESSION_DICTIONARY = os.environ.get('MESSAGE_COMPRESSION_DICTIONARY', '')
+# Every dictionary ever written with is kept here as <dict_id>.zdict (zstd frames name theirs),
+# so retraining or repointing MESSAGE_COMPRESSION_DICTIONARY leaves existing values readable
+MESSAGE_COMPRESSION_DICTIONARY_DIR = os.environ.get('MESSAGE_COMPRESSION_DICTIONARY_DIR', str(BASE_DIR / 'message_dictionaries'))
+
+# Full-text search over message bodies: text search configuration, and how much of a very
+# long message is indexed (tsvector has a 1MB limit). Bodies stored before search existed are
+# indexed with `manage.py index_message_search`.
+MESSAGE_SEARCH_CONFIG = 'english'
+MESSAGE_SEARCH_MAX_CHARS = 100000
+
+# Database time allowed per /api/quick-search/ keystroke before it is cancelled (milliseconds)
+QUICK_SEARCH_TIMEOUT_MS = 150
+
+# Semantic message search (needs numpy): the embedder class, and where per-user nearest-neighbour
+# indexes live. Searches scan the NPROBE closest IVF lists; indexes under IVF_THRESHOLD messages
+# are scanned exactly. Appended rows are merged into the index once DELTA_MAX accumulate.
+SEMANTIC_SEARCH_ENABLED = os.environ.get('SEMANTIC_SEARCH_ENABLED', '').lower() in ('1', 'true', 'yes')
+SEMANTIC_EMBEDDER = 'api.embeddings.HashingEmbedder'
+SEMANTIC_INDEX_DIR = os.environ.get('SEMANTIC_INDEX_DIR', str(BASE_DIR / 'semantic_index'))
+SEMANTIC_INDEX_NPROBE = 16
+SEMANTIC_INDEX_IVF_THRESHOLD = 50000
+SEMANTIC_INDEX_DELTA_MAX = 1000
+
 # JWT Settings
 SIMPLE_JWT = {
     'ACCESS_TOKEN_LIFETIME': timedelta(hours=1),
@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+"""
+Benchmark: stock JSONRenderer vs ORJSONRenderer on payloads from the real serializers.
+Creates a throwaway user with chats and messages inside a transaction that is rolled
+back, serializes them once, then times rendering only and checks the bytes match.
+
+Usage: python bench_json_renderer.py [messages]
+"""
+import os
+import sys
+import time
+import django
+
+# Add the backend directory to the Python path
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+# Set up Django
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'backend.settings')
+django.setup()
+
+from django.contrib.auth.models import User
+from django.db import transaction
+from rest_framework.renderers import JSONRenderer
+from api.models import Project, Chat, Message
+from api.renderers import ORJSONRenderer
+from api.serializers import (
+    MessageSerializer, DashboardChatSerializer, ProjectDetailSerializer, message_rows
+)
+
+ROUNDS = 20
+
+def time_best(func):
+    """Best CPU time over ROUNDS runs."""
+    best = float('inf')
+    for _ in range(ROUNDS):
+        start = time.process_time()
+        func()
+        best = min(best, time.process_time() - start)
+    return best
+
+def build_payloads(size):
+    user = User.objects.create_user(username=f'bench_{time.time_ns()}')
+    project = Project.objects.create(owner=user, name='Benchmark project')
+    chats = Chat.objects.bulk_create(
+        Chat(owner=user, project=project, name=f'Chat {i}', description='Benchmark chat ' * 5)
+        for i in range(200)
+    )
+    Message.objects.bulk_create(
+        Message(
+            chat=chats[0],
+            role=Message.Role.USER if i % 2 == 0 else Message.Role.ASSISTANT,
+            content=f"Message {i} with unicode é中 and code:\n```python\nprint({i})\n```\n" * 3,
+        )
+        for i in range(size)
+    )
+    messages = Message.objects.filter(chat=chats[0])
+    return {
+        f'MessageSerializer x{size}': MessageSerializer(messages, many=True).data,
+        f'message_rows x{size}': message_rows(messages),
+        'DashboardChatSerializer x200': DashboardChatSerializer(
+            Chat.objects.filter(owner=user).select_related('project'), many=True
+        ).data,
+        'ProjectDetailSerializer (200 chats)': ProjectDetailSerializer(project).data,
+    }
+
+def main():
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    stock, fast = JSONRenderer(), ORJSONRenderer()
+    print(f"{'payload':<36} | {'KiB':>7} | {'stock ms':>9} | {'orjson ms':>9} | speedup")
+    with transaction.atomic():
+        for name, data in build_payloads(size).items():
+            body = stock.render(data)
+            assert fast.render(data) == body, f"{name}: output differs"
+            stock_cpu = time_best(lambda: stock.render(data))
+            fast_cpu = time_best(lambda: fast.render(data))
+            print(f"{name:<36} | {len(body) / 1024:>7.0f} | {stock_cpu * 1000:>9.2f} | "
+                  f"{fast_cpu * 1000:>9.2f} | {stock_cpu / fast_cpu:>6.1f}x")
+        transaction.set_rollback(True)
+
+if __name__ == '__main__':
+    main()
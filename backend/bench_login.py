@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+"""
+Benchmark: login throughput per worker under each supported password hasher.
+For every hasher configuration, creates a user inside a transaction that is rolled
+back, then reports the cost of one password check, sequential POST /api/auth/login/
+throughput (what a single-threaded worker sustains), and a load scenario where
+several threads in one worker verify passwords at once (a gthread worker under a
+login storm), which shows how much of a core each login pins.
+
+Usage: python bench_login.py [logins] [threads]
+"""
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+import django
+
+# Add the backend directory to the Python path
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+# Set up Django
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'backend.settings')
+django.setup()
+
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.test import Client, override_settings
+
+PASSWORD = 'correct horse battery staple'
+
+# (label, hasher path, needs) - the first entry in PASSWORD_HASHERS hashes new passwords
+HASHERS = [
+    ('pbkdf2 (default)', 'django.contrib.auth.hashers.PBKDF2PasswordHasher', None),
+    ('argon2 (django)', 'django.contrib.auth.hashers.Argon2PasswordHasher', 'argon2'),
+    ('argon2id (tuned)', 'api.hashers.Argon2idPasswordHasher', 'argon2'),
+]
+
+def available(module):
+    if module is None:
+        return True
+    try:
+        __import__(module)
+    except ImportError:
+        return False
+    return True
+
+def run(label, hasher, logins, threads):
+    with override_settings(PASSWORD_HASHERS=[hasher]), transaction.atomic():
+        email = f'bench_{time.time_ns()}@example.com'
+        user = User.objects.create_user(username=email, email=email, password=PASSWORD)
+
+        started = time.perf_counter()
+        for _ in range(logins):
+            user.check_password(PASSWORD)
+        check_ms = (time.perf_counter() - started) * 1000 / logins
+
+        client = Client(HTTP_HOST='localhost')
+        started = time.perf_counter()
+        for _ in range(logins):
+            response = client.post('/api/auth/login/', {'email': email.upper(), 'password': PASSWORD},
+                                   content_type='application/json')
+            assert response.status_code == 200, response.content
+        sequential = logins / (time.perf_counter() - started)
+
+        # Threads only verify passwords: the request work around it is single-core Python anyway
+        started = time.perf_counter()
+        with ThreadPoolExecutor(threads) as pool:
+            assert all(pool.map(lambda _: user.check_password(PASSWORD), range(logins)))
+        concurrent = logins / (time.perf_counter() - started)
+
+        print(f"{label:<17} | {check_ms:>8.1f} | {sequential:>12.1f} | {concurrent:>14.1f}")
+        transaction.set_rollback(True)
+
+def main():
+    logins = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    threads = int(sys.argv[2]) if len(sys.argv) > 2 else 4
+    print(f"{'hasher':<17} | {'check ms':>8} | {'logins/s x1':>12} | {f'logins/s x{threads}':>14}")
+    for label, hasher, needs in HASHERS:
+        if available(needs):
+            run(label, hasher, logins, threads)
+        else:
+            print(f"{label:<17} | skipped ({needs} not installed)")
+
+if __name__ == '__main__':
+    main()
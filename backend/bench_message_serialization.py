@@ -0,0 +1,74 @@
+#!/usr/bin/env python
+"""
+Benchmark: MessageSerializer(many=True) vs the message_rows() fast read path.
+Creates a throwaway chat with 1k and 10k messages inside a transaction that is
+rolled back, then times fetch + serialize + JSON render for each path.
+
+Usage: python bench_message_serialization.py [sizes...]
+"""
+import os
+import sys
+import time
+import django
+
+# Add the backend directory to the Python path
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+# Set up Django
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'backend.settings')
+django.setup()
+
+from django.contrib.auth.models import User
+from django.db import transaction
+from rest_framework.renderers import JSONRenderer
+from api.models import Chat, Message
+from api.serializers import MessageSerializer, message_rows
+
+ROUNDS = 5
+
+def time_best(func):
+    """Best wall time and CPU time over ROUNDS runs."""
+    best_wall = best_cpu = float('inf')
+    for _ in range(ROUNDS):
+        wall, cpu = time.perf_counter(), time.process_time()
+        func()
+        best_wall = min(best_wall, time.perf_counter() - wall)
+        best_cpu = min(best_cpu, time.process_time() - cpu)
+    return best_wall, best_cpu
+
+def run(size):
+    user = User.objects.create_user(username=f'bench_{size}_{time.time_ns()}')
+    chat = Chat.objects.create(owner=user, name='Benchmark chat')
+    Message.objects.bulk_create(
+        Message(
+            chat=chat,
+            role=Message.Role.USER if i % 2 == 0 else Message.Role.ASSISTANT,
+            content=f"Benchmark message {i} " + "lorem ipsum " * 20,
+        )
+        for i in range(size)
+    )
+    renderer = JSONRenderer()
+    queryset = Message.objects.filter(chat=chat)
+
+    def model_serializer():
+        return renderer.render(MessageSerializer(queryset.all(), many=True).data)
+
+    def fast_path():
+        return renderer.render(message_rows(queryset.all()))
+
+    assert model_serializer() == fast_path(), "fast path output differs"
+    slow_wall, slow_cpu = time_best(model_serializer)
+    fast_wall, fast_cpu = time_best(fast_path)
+    print(f"{size:>7} | {slow_wall * 1000:>12.1f} | {fast_wall * 1000:>12.1f} | "
+          f"{slow_cpu * 1000:>11.1f} | {fast_cpu * 1000:>11.1f} | {slow_cpu / fast_cpu:>5.1f}x")
+
+def main():
+    sizes = [int(arg) for arg in sys.argv[1:]] or [1000, 10000]
+    print(f"{'msgs':>7} | {'serializer ms':>12} | {'fast ms':>12} | {'ser. cpu ms':>11} | {'fast cpu ms':>11} | cpu speedup")
+    for size in sizes:
+        with transaction.atomic():
+            run(size)
+            transaction.set_rollback(True)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+"""
+Benchmark: IVF semantic index vs brute-force NumPy search.
+Embeds a synthetic corpus (topic-mixture "messages") with the configured embedder,
+builds a SemanticIndex in a temporary directory, then reports recall@10 against an
+exact brute-force scan, and per-query latency for both, at several nprobe values.
+
+Usage: python bench_semantic_search.py [sizes...]
+"""
+import os
+import sys
+import tempfile
+import time
+import uuid
+import django
+
+# Add the backend directory to the Python path
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+# Set up Django
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'backend.settings')
+django.setup()
+
+from api.embeddings import get_embedder, numpy
+from api.utils_semantic import SemanticIndex
+
+QUERIES = 200
+K = 10
+
+def corpus(size, rng):
+    """Messages drawn from 500 topics of 15 words each, plus a few shared filler words."""
+    vocabulary = [f'w{i}' for i in range(8000)]
+    topics = [rng.choice(vocabulary, 15, replace=False) for _ in range(500)]
+    filler = vocabulary[:300]
+    texts = []
+    for _ in range(size):
+        topic = topics[rng.integers(len(topics))]
+        words = list(rng.choice(topic, 10)) + list(rng.choice(filler, 3))
+        rng.shuffle(words)
+        texts.append(' '.join(words))
+    return texts
+
+def run(size):
+    rng = numpy.random.default_rng(0)
+    embedder = get_embedder()
+    vectors = embedder.embed(corpus(size, rng))
+    keys = SemanticIndex.make_keys([(uuid.UUID(int=i), f'{i:064x}') for i in range(size)])
+    queries = vectors[rng.choice(size, QUERIES, replace=False)]
+
+    with tempfile.TemporaryDirectory() as directory:
+        index = SemanticIndex(directory, embedder.dim)
+        started = time.perf_counter()
+        with index.lock():
+            index.build(keys, vectors, lists=max(1, int(size ** 0.5)))
+        build = time.perf_counter() - started
+
+        started = time.perf_counter()
+        exact = [numpy.partition(vectors @ query, -K)[-K] for query in queries]
+        brute_ms = (time.perf_counter() - started) * 1000 / QUERIES
+
+        for nprobe in (1, 4, 8, 16):
+            started = time.perf_counter()
+            found = [index.search(query, K, nprobe) for query in queries]
+            ivf_ms = (time.perf_counter() - started) * 1000 / QUERIES
+            # A hit counts when it scores at least the exact 10th best (ties are interchangeable)
+            recall = sum(hit[2] >= kth - 1e-6 for hits, kth in zip(found, exact) for hit in hits) / (K * QUERIES)
+            print(f"{size:>8} | {build:>7.1f} | {nprobe:>6} | {recall:>9.3f} | {ivf_ms:>9.2f} | {brute_ms:>11.2f}")
+
+def main():
+    if numpy is None:
+        sys.exit("numpy is required")
+    sizes = [int(arg) for arg in sys.argv[1:]] or [10000, 100000]
+    print(f"{'vectors':>8} | {'build s':>7} | {'nprobe':>6} | {'recall@10':>9} | {'ivf ms/q':>9} | {'brute ms/q':>11}")
+    for size in sizes:
+        run(size)
+
+if __name__ == '__main__':
+    main()